@@ -1,57 +1,347 @@
 from scripts.device_camera import DeviceCamera
+from scripts.replay_camera import ReplayCamera
 from scripts.darknet_yolo import DarknetDNN
+from scripts.pipeline import Pipeline, Job
+from scripts.debug_image import DebugImageWorker
+from scripts.tracker import TrackedDetector
+from scripts.target_lock import TargetLock
+from scripts.latency_controller import LatencyController
+from scripts.stage_metrics import StageMetrics, HISTOGRAM_EDGES_MS
+from scripts.command_link import CommandLink
+from scripts.inference_pool import InferencePool
+from scripts.model_registry import describe, select_model
+from scripts.motion_gate import MotionGate
+from scripts.tiled_detector import TiledDetector
+from scripts.yolo_decoder import empty_detections, to_structured, command_for, detection_rows
 import cv2
 import time
+import numpy as np
 import rospy
 from std_msgs.msg import UInt8
+from sensor_msgs.msg import CompressedImage
+from diagnostic_msgs.msg import DiagnosticArray, DiagnosticStatus, KeyValue
+from follower.msg import PersonDetection, PersonDetections, OperatingPoint, StageLatency, LatencyMetrics, RoverCommand
+
+# Initialize ROS Node
+rospy.init_node('follow_me_node')
+startup_start = time.perf_counter()
+pub = rospy.Publisher('rover_command', UInt8, queue_size=1)
+command_stamped_pub = rospy.Publisher('rover_command_stamped', RoverCommand, queue_size=1)
+detections_pub = rospy.Publisher('detections', PersonDetections, queue_size=1)
+
+# Stage latency histograms over the last metrics_window frames, published at metrics_rate Hz (0 disables the timers)
+metrics_rate = rospy.get_param('~metrics_rate', 1.0)
+metrics = StageMetrics(enabled=metrics_rate > 0, window=rospy.get_param('~metrics_window', 300))
 
 # Initialize Camera and Darknet
-camera = DeviceCamera(4)
-net = DarknetDNN()
+# The camera is a device number or a stable selector (serial, USB bus id, /dev/v4l/by-id name or part of the camera name)
+# The capture profile is a string like "MJPG 1280x720@30", or "auto" for the one locked by the capture_profiles benchmark
+# Without align_depth the Realsense depth stays unaligned and only the detected boxes are projected into it
+# A replay path runs the node on a recording instead of the camera, a record path records every captured frame
+# Without replay_realtime the replay is read on demand and the pipeline runs lossless, every recorded frame is processed exactly once
+replay = rospy.get_param('~replay', '')
+camera_start = time.perf_counter()
+if replay:
+    camera = ReplayCamera(replay, realtime=rospy.get_param('~replay_realtime', True), threaded=rospy.get_param('~threaded_capture', True), metrics=metrics)
+else:
+    camera = DeviceCamera(rospy.get_param('~camera', 4), threaded=rospy.get_param('~threaded_capture', True), depth_filters=rospy.get_param('~depth_filters', None), metrics=metrics,
+                          align_depth=rospy.get_param('~align_depth', True), capture_profile=rospy.get_param('~capture_profile', 'auto'),
+                          capture_buffers=rospy.get_param('~capture_buffers', 1))
+if rospy.get_param('~record', ''):
+    camera.start_recording(rospy.get_param('~record'))
+camera_time = time.perf_counter() - camera_start
+
+# The inference backend is probed when set to "auto", or forced with a name or a comma separated list of names
+# With engine_cache the probe result is kept next to the weights and reused while the model and OpenCV stay the same
+# The model is a registered name, or "auto" for the most accurate installed model within model_budget seconds per forward
+model_start = time.perf_counter()
+model_name = rospy.get_param('~model', 'yolov3-tiny')
+if model_name == 'auto':
+    model, model_profiles = select_model(rospy.get_param('~model_budget', 0.1), backend=rospy.get_param('~backend', 'auto'))
+    rospy.loginfo(f"Model profiles: {model_profiles}")
+else:
+    model = describe(model_name)
+rospy.loginfo(f"Model: {model.name}")
+rospy.set_param('~active_model', model.name)
+net = DarknetDNN(model.weights, model.cfg, backend=rospy.get_param('~backend', 'auto'), onnx_model=rospy.get_param('~onnx_model', None),
+                 preallocate=rospy.get_param('~preallocate', True), metrics=metrics, cache_engine=rospy.get_param('~engine_cache', True), dnn_names=model.names)
+model_time = time.perf_counter() - model_start
+rospy.loginfo(f"Inference backend: {net.backend}")
+rospy.set_param('~active_backend', net.backend)
 #video = cv2.VideoCapture("C:\\Users\\luthf\\Videos\\Captures\\safety_vest_video.mp4")
 
-# Initialize ROS Node
-rospy.init_node('follow_me_node')
-pub = rospy.Publisher('rover_command', UInt8, queue_size=10)
+# Pipelined execution runs every stage on its own thread, frames older than max_frame_age seconds are dropped
+pipelined = rospy.get_param('~pipelined', True)
+max_frame_age = rospy.get_param('~max_frame_age', 0.5)
 
-# Time stamp
-start_time = time.time()
-frequency = 10 # in Hz
+# Headless mode skips every overlay and GUI call, annotated frames go out as JPEG at debug_image_rate Hz (0 disables)
+headless = rospy.get_param('~headless', False)
+debug_image_rate = rospy.get_param('~debug_image_rate', 2.0)
+debug_image_quality = rospy.get_param('~debug_image_quality', 70)
 
-while True:
-    # Get frame from camera
-    frame, _ = camera.get_frame()
+# With detect_interval above 1 the detector runs every detect_interval frames and the tracker propagates the boxes in between
+detect_interval = rospy.get_param('~detect_interval', 1)
+tracked = TrackedDetector(net, detect_interval, rospy.get_param('~redetect_confidence', 0.3)) if detect_interval > 1 else None
 
-    frame = camera.show_fps(frame)
+# Target lock runs the detector on a region around the followed person, with a full-frame search every full_search_interval frames
+target_lock = None
+if rospy.get_param('~target_lock', False):
+    roi_blob_size = rospy.get_param('~roi_blob_size', 224)
+    target_lock = TargetLock(rospy.get_param('~roi_expand', 2.0), (roi_blob_size, roi_blob_size),
+                             rospy.get_param('~full_search_interval', 30), rospy.get_param('~roi_max_misses', 3))
 
-    #ret, frame = video.read()
-    #if not ret:
-    #    break
+# The motion gate skips the detector while the scene (depth with a Realsense, downscaled gray otherwise) stays still,
+# reusing the last detections for at most motion_max_hold seconds
+motion_gate = None
+if rospy.get_param('~motion_gate', False):
+    motion_gate = MotionGate(rospy.get_param('~motion_threshold', 0.01), rospy.get_param('~motion_pixel_threshold', 12),
+                             rospy.get_param('~motion_depth_threshold', 50), rospy.get_param('~motion_max_hold', 1.0))
+last_detections = None
 
-    # Detect the human from the frame
-    net.detect_object(frame)
-    
-    # Draw the bounding box of the object detected
-    net.draw_detected_object(frame)
-
-    # Publish the command
-    if time.time() - start_time >= 1/frequency:
-        direct = net.get_command()
-        if direct == 'Right':
-            command = 1
-        elif direct == 'Left':
-            command = 2
-        elif direct == 'Center':
-            command = 3
+# Tiled inference splits the full-frame detection into tiles of tile_size pixels overlapping by tile_overlap, run as one
+# batch, so distant people keep enough pixels; tile_full_frame adds the whole frame to the batch for nearby people (0 disables)
+tile_size = rospy.get_param('~tile_size', 0)
+tiler = None
+if tile_size > 0:
+    tiler = TiledDetector(net, (tile_size, tile_size), rospy.get_param('~tile_overlap', 0.2), rospy.get_param('~tile_full_frame', True))
+
+# The latency controller switches the blob size among blob_sizes to stay within latency_budget seconds (0 disables)
+latency_budget = rospy.get_param('~latency_budget', 0.0)
+controller = None
+if latency_budget > 0:
+    controller = LatencyController(rospy.get_param('~blob_sizes', [224, 320, 416]), latency_budget, net.blob_size[0])
+    net.blob_size = controller.blob_size
+    operating_point_pub = rospy.Publisher('operating_point', OperatingPoint, queue_size=1, latch=True)
+    last_operating_point = 0.0
+
+# Warm up every blob size the node may switch to, so the first frames already run at the steady-state latency
+warmup_sizes = {tuple(net.blob_size)}
+if controller is not None:
+    warmup_sizes.update((size, size) for size in controller.blob_sizes)
+if target_lock is not None:
+    warmup_sizes.add(tuple(target_lock.blob_size))
+warmup_time = net.warmup(sorted(warmup_sizes), rospy.get_param('~warmup_forwards', 2))
+# The pool slots and the tiled warmup are sized for the frames the camera really delivers
+frame_shape = camera.frame_shape()
+if tiler is not None:
+    warmup_time += tiler.warmup(frame_shape, rospy.get_param('~warmup_forwards', 2))
+
+# With inference_workers above 0 the detector runs in that many processes of inference_threads OpenCV threads each,
+# the frames are passed through shared memory and the results come back in frame order
+inference_workers = rospy.get_param('~inference_workers', 0)
+pool = None
+if inference_workers > 0:
+    pool_start = time.perf_counter()
+    if tiler is not None:
+        rospy.logwarn("Tiled inference is not supported by the inference pool, the workers detect on the whole frame")
+    pool = InferencePool(inference_workers, {"dnn_model": model.weights, "dnn_config": model.cfg, "dnn_names": model.names,
+                                            "backend": rospy.get_param('~inference_worker_backend', 'cpu'), "onnx_model": rospy.get_param('~onnx_model', None)},
+                         frame_shape, threads=rospy.get_param('~inference_threads', 1), warmup=sorted(warmup_sizes))
+    rospy.loginfo(f"Inference pool of {inference_workers} workers started in {(time.perf_counter() - pool_start) * 1000:.0f} ms")
+
+rospy.loginfo(f"Startup: camera {camera_time * 1000:.0f} ms, model {model_time * 1000:.0f} ms (backend selection {net.load_time * 1000:.0f} ms), "
+              f"warmup of {len(warmup_sizes)} blob sizes {warmup_time * 1000:.0f} ms, total {(time.perf_counter() - startup_start) * 1000:.0f} ms")
+rospy.set_param('~ready', True)
+
+def capture():
+    # End at the end of a replay, once the stages have processed the frames they hold
+    if camera.finished:
+        pipeline.finish()
+        return None
+
+    # Get frame from camera
+    frame = camera.get_frame_stamped()
+    if frame.color is None:
+        return None
+    return Job(frame.sequence, frame.timestamp, frame=frame.color, depth=frame.depth)
+
+def preprocess(job):
+    # Drop the frames that are already older than the latency budget
+    if controller is not None and controller.should_skip(job.timestamp):
+        return None
+
+    # Skip the detector on a still scene, and on the frames the tracker can propagate
+    job.blob = None
+    job.roi = None
+    job.tiles = None
+    job.reuse = motion_gate is not None and not motion_gate.should_detect(job.frame, job.depth, job.timestamp)
+    job.detect = not job.reuse and (tracked is None or tracked.should_detect())
+    if job.detect:
+        if target_lock is not None:
+            job.roi = target_lock.plan(job.frame.shape)
+        # The workers of the inference pool preprocess the frames themselves
+        if pool is not None:
+            return job
+        if job.roi is None and tiler is not None:
+            job.blob, job.tiles = tiler.preprocess(job.frame)
+        elif job.roi is None:
+            job.blob = net.preprocess(job.frame)
         else:
-            command = 0
-        
-        rospy.loginfo(command)
-        pub.publish(command)
+            job.blob = net.preprocess(TargetLock.crop(job.frame, job.roi), target_lock.blob_size)
+    return job
+
+def inference(job):
+    # Hand the frame to the inference pool, or run the forward on this stage's thread
+    job.ticket = None
+    job.output = None
+    if job.detect and pool is not None:
+        job.ticket = pool.submit(TargetLock.crop(job.frame, job.roi), net.blob_size if job.roi is None else target_lock.blob_size)
+    elif job.blob is not None:
+        with metrics.timer("forward"):
+            job.output = net.forward_blob(job.blob)
+    return job
+
+def postprocess(job):
+    global last_detections
+    # Nothing moved since the last detection, keep its result and so its command
+    if job.reuse:
+        job.detections = last_detections if last_detections is not None else empty_detections()
+        return job
+
+    # Detect the human from the frame, or from the target region mapped back to the frame
+    height, width, _ = job.frame.shape
+    job.detections = None
+    if job.ticket is not None:
+        # The pool already decoded the detections, in the coordinates of the submitted crop
+        result = pool.get(job.ticket, timeout=10.0)
+        if result is None:
+            raise RuntimeError("The inference pool returned no result within 10 s")
+        job.detections = TargetLock.to_frame(result[1], job.roi, width)
+    elif job.tiles is not None:
+        job.detections = tiler.decode(job.output, job.tiles, width, height)
+    elif job.output is not None:
+        crop = TargetLock.crop(job.frame, job.roi)
+        job.detections = TargetLock.to_frame(net.decode(job.output, crop.shape[1], crop.shape[0]), job.roi, width)
+    if tracked is not None:
+        job.detections = tracked.track(job.detections, width, height)
+
+    # Lock on the largest person, the one command_for follows
+    if target_lock is not None and job.detections is not None:
+        boxes, confidences, positions, areas = job.detections
+        target_lock.update(boxes, job.roi, int(np.argmax(areas)) if len(areas) else None)
+    # Copied since the preallocated detection buffers are recycled while the result may be reused for a while
+    if motion_gate is not None and job.detections is not None:
+        last_detections = tuple(array.copy() for array in job.detections)
+    return job
 
-        start_time = time.time()
+def publish_debug_image(jpeg, timestamp):
+    msg = CompressedImage()
+    msg.header.stamp = rospy.Time.from_sec(timestamp)
+    msg.format = "jpeg"
+    msg.data = jpeg
+    debug_image_pub.publish(msg)
 
-    
+def draw_debug_image(frame, detections):
+    net.draw_human_info(frame, detections)
+
+def publish_detections(job, detections, distances, direct):
+    msg = PersonDetections()
+    msg.header.stamp = rospy.Time.from_sec(job.timestamp)
+    msg.height, msg.width = job.frame.shape[:2]
+    msg.command = direct
+    for row, distance in zip(detection_rows(detections), distances):
+        msg.detections.append(PersonDetection(*row, distance))
+    detections_pub.publish(msg)
+
+debug_image_worker = None
+if headless and debug_image_rate > 0:
+    debug_image_pub = rospy.Publisher('debug_image/compressed', CompressedImage, queue_size=1)
+    debug_image_worker = DebugImageWorker(publish_debug_image, draw_debug_image, debug_image_rate, debug_image_quality)
+
+def publish_operating_point():
+    point = controller.operating_point()
+    msg = OperatingPoint()
+    msg.header.stamp = rospy.Time.now()
+    msg.blob_size = point["blob_size"]
+    msg.latency_ms = point["latency_ms"]
+    msg.budget_ms = point["budget_ms"]
+    msg.skipped_frames = point["skipped_frames"]
+    msg.switches = point["switches"]
+    operating_point_pub.publish(msg)
+
+def control_latency(job):
+    global last_operating_point
+    if controller.observe(job.age()):
+        net.blob_size = controller.blob_size
+        rospy.loginfo(f"Blob size switched to {controller.blob_size}")
+        last_operating_point = 0.0
+    if time.time() - last_operating_point >= 1.0:
+        publish_operating_point()
+        last_operating_point = time.time()
+
+def publish_metrics(event):
+    summary = metrics.summary()
+    stamp = rospy.Time.now()
+
+    msg = LatencyMetrics()
+    msg.header.stamp = stamp
+    msg.histogram_edges_ms = list(HISTOGRAM_EDGES_MS)
+    status = DiagnosticStatus()
+    status.name = f"{rospy.get_name()}: latency"
+    status.hardware_id = net.backend
+    status.level = DiagnosticStatus.OK
+    status.message = "OK"
+    for name, stats in summary.items():
+        msg.stages.append(StageLatency(name, stats["count"], stats["mean_ms"], stats["p50_ms"], stats["p95_ms"], stats["p99_ms"], stats["max_ms"], stats["histogram"]))
+        status.values.append(KeyValue(f"{name} p50/p95/p99/max ms", f"{stats['p50_ms']:.1f}/{stats['p95_ms']:.1f}/{stats['p99_ms']:.1f}/{stats['max_ms']:.1f}"))
+
+    # Warn when the commands go out on frames older than the pipeline accepts
+    frame_age = summary.get("frame_age")
+    if frame_age is not None and max_frame_age and frame_age["p95_ms"] > max_frame_age * 1000:
+        status.level = DiagnosticStatus.WARN
+        status.message = f"Frame age p95 {frame_age['p95_ms']:.0f} ms above {max_frame_age * 1000:.0f} ms"
+    metrics_pub.publish(msg)
+
+    diagnostics = DiagnosticArray()
+    diagnostics.header.stamp = stamp
+    diagnostics.status.append(status)
+    diagnostics_pub.publish(diagnostics)
+
+if metrics.enabled:
+    metrics_pub = rospy.Publisher('latency_metrics', LatencyMetrics, queue_size=1)
+    diagnostics_pub = rospy.Publisher('/diagnostics', DiagnosticArray, queue_size=1)
+    metrics_timer = rospy.Timer(rospy.Duration(1.0 / metrics_rate), publish_metrics)
+
+def publish_command(command, direct, timestamp):
+    # The Arduino only reads the UInt8, the stamped copy carries the capture time of the frame for the rest of ROS
+    rospy.loginfo(command)
+    pub.publish(command)
+    msg = RoverCommand()
+    msg.header.stamp = rospy.Time.from_sec(timestamp)
+    msg.command = command
+    msg.direction = direct
+    command_stamped_pub.publish(msg)
+    metrics.record("frame_age", time.time() - timestamp)
+
+# The command goes out from its own timer, only on change or keepalive and never for a frame older than command_deadline
+command_link = CommandLink(publish_command, rospy.get_param('~command_keepalive', 1.0), rospy.get_param('~command_deadline', 0.5))
+command_timer = rospy.Timer(rospy.Duration(1.0 / rospy.get_param('~command_rate', 10.0)), command_link.tick)
+
+def output(job):
+    # One read-only copy of the detections feeds the command, the message and the overlays
+    detections = to_structured(*job.detections)
+    direct = command_for(detections)
+    with metrics.timer("distance"):
+        distances = camera.box_distances(job.depth, detections["box"])
+    with metrics.timer("publish"):
+        publish_detections(job, detections, distances, direct)
+
+    # Hand the command to the command link
+    command_link.update(direct, job.timestamp)
+
+    if controller is not None:
+        control_latency(job)
+
+    if headless:
+        # Overlays are drawn by the debug image worker, off the hot path
+        if debug_image_worker is not None:
+            debug_image_worker.submit(job.frame, detections, job.timestamp)
+        return job
+
+    frame = camera.show_fps(job.frame)
+
+    # Draw the bounding box of the object detected
+    net.draw_detected_object(frame, detections)
 
     # Show the result
     cv2.imshow("Video", frame)
@@ -60,4 +350,38 @@ while True:
     key = cv2.waitKey(1)
     if key == 27 or key == ord('q'):
         print(f"Key {key} is pressed")
-        break
+        pipeline.stop()
+    return job
+
+# Every worker of the inference pool can have a frame in flight before postprocess collects the oldest one
+pipeline = Pipeline([
+    ("capture", capture),
+    ("preprocess", preprocess),
+    ("inference", inference),
+    ("postprocess", postprocess),
+    ("output", output),
+], queue_size=[1, 1, max(1, inference_workers), 1], max_age=max_frame_age,
+                    stop_condition=rospy.is_shutdown, lossless=bool(replay) and not camera.realtime)
+
+if pipelined:
+    pipeline.run()
+else:
+    pipeline.run_inline()
+
+command_timer.shutdown()
+camera.stop()
+if pool is not None:
+    for name, stats in pool.stats().items():
+        rospy.loginfo(f"Inference {name}: {stats}")
+    pool.close()
+if debug_image_worker is not None:
+    debug_image_worker.stop()
+for name, stats in pipeline.stats().items():
+    rospy.loginfo(f"{name}: {stats}")
+rospy.loginfo(f"Commands: {command_link.stats()}")
+for name, stats in metrics.summary().items():
+    rospy.loginfo(f"{name}: p50 {stats['p50_ms']:.2f} ms, p95 {stats['p95_ms']:.2f} ms, p99 {stats['p99_ms']:.2f} ms")
+if motion_gate is not None:
+    rospy.loginfo(f"Motion gate saved {motion_gate.skipped} of {motion_gate.frames} forwards")
+if tracked is not None:
+    rospy.loginfo(f"Detector ran on {tracked.detections_run} of {tracked.frame_count} frames")
@@ -0,0 +1,60 @@
+from scripts.device_camera import DeviceCamera
+from scripts.darknet_yolo import DarknetDNN
+from scripts.multi_camera import MultiCameraDetector
+from scripts.yolo_decoder import detection_rows
+from scripts.command_link import CommandLink
+from scripts.model_registry import describe
+import rospy
+from std_msgs.msg import UInt8
+from follower.msg import PersonDetection, PersonDetections
+
+# Initialize ROS Node
+rospy.init_node('follow_me_multi_node')
+
+# One DarknetDNN serves every camera with a batched forward
+camera_ids = rospy.get_param('~camera_ids', [4, 6])
+camera_names = rospy.get_param('~camera_names', ['front', 'rear'])
+# The capture profile applies to every camera, "auto" uses the one locked for each camera by the capture_profiles benchmark
+cameras = [DeviceCamera(camera_id, realsense=False, threaded=True, capture_profile=rospy.get_param('~capture_profile', 'auto'),
+                        capture_buffers=rospy.get_param('~capture_buffers', 1)) for camera_id in camera_ids]
+model = describe(rospy.get_param('~model', 'yolov3-tiny'))
+net = DarknetDNN(model.weights, model.cfg, backend=rospy.get_param('~backend', 'auto'), onnx_model=rospy.get_param('~onnx_model', None), dnn_names=model.names)
+detector = MultiCameraDetector(net, cameras, camera_names, rospy.get_param('~max_skew', 0.05))
+rospy.loginfo(f"Inference backend: {net.backend}")
+
+# Every camera publishes its own command and detections under its name, remap one of them to rover_command
+command_pubs = {name: rospy.Publisher(f'{name}/rover_command', UInt8, queue_size=1) for name in camera_names}
+detections_pubs = {name: rospy.Publisher(f'{name}/detections', PersonDetections, queue_size=1) for name in camera_names}
+
+# The commands go out from a timer, only on change or keepalive and never for a frame older than command_deadline
+command_links = {name: CommandLink(lambda command, direct, timestamp, name=name: command_pubs[name].publish(command),
+                                   rospy.get_param('~command_keepalive', 1.0), rospy.get_param('~command_deadline', 0.5)) for name in camera_names}
+
+def send_commands(event):
+    for command_link in command_links.values():
+        command_link.tick(event)
+
+command_timer = rospy.Timer(rospy.Duration(1.0 / rospy.get_param('~command_rate', 10.0)), send_commands)
+
+while not rospy.is_shutdown():
+    frames = detector.get_frames()
+    if frames is None:
+        continue
+
+    results = detector.detect(frames)
+    for camera, frame, (name, (detections, direct)) in zip(cameras, frames, results.items()):
+        msg = PersonDetections()
+        msg.header.stamp = rospy.Time.from_sec(frame.timestamp)
+        msg.header.frame_id = name
+        msg.height, msg.width = frame.color.shape[:2]
+        msg.command = direct
+        for row, distance in zip(detection_rows(detections), camera.box_distances(frame.depth, detections["box"])):
+            msg.detections.append(PersonDetection(*row, distance))
+        detections_pubs[name].publish(msg)
+
+        # Hand the command to the command link of the camera
+        command_links[name].update(direct, frame.timestamp)
+
+command_timer.shutdown()
+detector.stop()
+rospy.loginfo(f"Rounds with unsynchronized frames: {detector.unsynced_rounds}")
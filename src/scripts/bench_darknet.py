@@ -0,0 +1,183 @@
+"""
+Hardware-free benchmark suite of DarknetDNN.
+
+For every cfg in cfg/ random weights are synthesized with synthetic_weights.py, so no trained weights, camera or ROS
+are needed. The stages are timed separately:
+  load         readNet and backend setup (create_engine), per model and backend
+  preprocess   DarknetDNN.preprocess of a 640x480 frame, per blob size
+  forward      engine forward of the blob, per model, backend and blob size
+  decode       DarknetDNN.decode of the output layers, including its Non-Maximum Suppression
+  nms          cv2.dnn.NMSBoxes alone on the candidate boxes of decode
+  check_color  DarknetDNN.check_color of the detected boxes
+  draw         DarknetDNN.draw_detected_object of the detected boxes
+The last four run on synthetic output layers with the shapes of the real ones and `persons` people in the frame, since
+random weights do not detect anything meaningful. p50/p95/p99 are printed and every measurement is written as JSON
+with --json so runs of different builds can be compared.
+
+Usage: python bench_darknet.py [--models yolov3-tiny,yolov7-tiny] [--sizes 224,320,416] [--backends cpu]
+                               [--persons 0,1,5,10] [--repeat 100] [--json results.json]
+"""
+import argparse
+import json
+import os
+import platform
+import tempfile
+import time
+import cv2
+import numpy as np
+
+from darknet_yolo import DarknetDNN, ROOT_DIR
+from inference_backend import create_engine, is_available, parse_backends
+from synthetic_weights import write_random_weights
+from yolo_decoder import decode_detections, to_structured
+from bench_decode import synthetic_output
+
+# HSV range of the safety vest, the same one as in playground.py
+VEST_LOW_HSV = np.array([0, 140, 185])
+VEST_HIGH_HSV = np.array([30, 255, 255])
+
+def percentiles(timings):
+    timings = np.asarray(timings) * 1000
+    return {
+        "p50": float(np.percentile(timings, 50)),
+        "p95": float(np.percentile(timings, 95)),
+        "p99": float(np.percentile(timings, 99)),
+        "mean": float(timings.mean()),
+        "samples": len(timings),
+    }
+
+def measure(function, repeat, warmup = 3, setup = None):
+    # setup() runs before every call outside of the timing, its result is passed to function
+    for _ in range(warmup):
+        function(setup() if setup else None)
+    timings = []
+    for _ in range(repeat):
+        argument = setup() if setup else None
+        start = time.perf_counter()
+        function(argument)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+def synthesize_weights(model, weights_dir):
+    # The weights only depend on the cfg, so they are generated once and reused by later runs
+    cfg = os.path.join(ROOT_DIR, "cfg", f"{model}.cfg")
+    weights = os.path.join(weights_dir, f"{model}-random.weights")
+    if not os.path.isfile(weights) or os.path.getmtime(weights) < os.path.getmtime(cfg):
+        print(f"Synthesizing random weights for {model}")
+        write_random_weights(cfg, weights)
+    return weights, cfg
+
+def synthetic_frame(width = 640, height = 480, seed = 0):
+    return np.random.default_rng(seed).integers(0, 255, (height, width, 3), dtype=np.uint8)
+
+def candidates(net, output, width, height):
+    # Boxes and confidences of decode before Non-Maximum Suppression, an IoU threshold of 1 keeps every box
+    boxes, confidences, _, _ = decode_detections(output, width, height, net.confidence_threshold, 1.0)
+    rects = boxes.copy()
+    rects[:, 2:] -= rects[:, :2]
+    return rects, confidences
+
+def bench_model(model, args, results):
+    weights, cfg = synthesize_weights(model, args.weights_dir)
+    frame = synthetic_frame()
+    height, width = frame.shape[:2]
+
+    def record(stage, timings, backend = None, blob_size = None, persons = None):
+        row = {"model": model, "backend": backend, "blob_size": blob_size, "persons": persons, "stage": stage}
+        row.update(percentiles(timings))
+        results.append(row)
+        print(f"{model:<14}{stage:<13}{backend or '-':<12}{blob_size or '-':>6}{'-' if persons is None else persons:>9}"
+              f"{row['p50']:>10.3f}{row['p95']:>10.3f}{row['p99']:>10.3f}")
+
+    net = None
+    for backend in args.backends:
+        record("load", measure(lambda _: create_engine(backend, weights, cfg), args.load_repeat, warmup=0), backend)
+
+        net = DarknetDNN(weights, cfg, backend, preallocate=args.preallocate)
+        for size in args.sizes:
+            blob_size = (size, size)
+            blob = net.preprocess(frame, blob_size)
+            if backend == args.backends[0]:
+                record("preprocess", measure(lambda _: net.preprocess(frame, blob_size), args.repeat), None, size)
+            record("forward", measure(lambda _: net.forward_blob(blob), args.repeat, args.warmup), backend, size)
+
+    # Decoding and drawing do not depend on the backend, only on the shape of the output layers
+    for size in args.sizes:
+        blob = net.preprocess(frame, (size, size))
+        layers = net.forward_blob(blob)
+        grids = [int(round(np.sqrt(len(layer) / 3))) for layer in layers]
+        for persons in args.persons:
+            output = synthetic_output(grids, persons, layers[0].shape[1] - 5)
+            boxes, confidences, positions, areas = net.decode(output, width, height)
+            boxes, confidences, positions, areas = boxes.copy(), confidences.copy(), positions.copy(), areas.copy()
+            rects, candidate_confidences = candidates(net, output, width, height)
+
+            record("decode", measure(lambda _: net.decode(output, width, height), args.repeat), None, size, persons)
+            record("nms", measure(lambda _: cv2.dnn.NMSBoxes(rects, candidate_confidences, net.confidence_threshold, net.nms_threshold), args.repeat), None, size, persons)
+            record("check_color", measure(lambda _: net.check_color(frame, boxes, VEST_LOW_HSV, VEST_HIGH_HSV), args.repeat), None, size, persons)
+
+            detections = to_structured(boxes, confidences, positions, areas)
+            record("draw", measure(lambda canvas: net.draw_detected_object(canvas, detections), args.repeat, setup=frame.copy), None, size, persons)
+
+def parse_list(value, cast = str):
+    return [cast(item.strip()) for item in value.split(",") if item.strip()]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--models", default=",".join(sorted(name[:-4] for name in os.listdir(os.path.join(ROOT_DIR, "cfg")) if name.endswith(".cfg"))))
+    parser.add_argument("--sizes", default="224,320,416")
+    parser.add_argument("--backends", default="cpu", help='comma separated backends, or "auto" for every available one')
+    parser.add_argument("--persons", default="0,1,5,10")
+    parser.add_argument("--repeat", type=int, default=100)
+    parser.add_argument("--warmup", type=int, default=3)
+    parser.add_argument("--load-repeat", type=int, default=3)
+    parser.add_argument("--preallocate", action="store_true", help="use the preallocated preprocessing and decoding path")
+    parser.add_argument("--weights-dir", default=os.path.join(tempfile.gettempdir(), "follower-bench"))
+    parser.add_argument("--json", help="write the results to this file")
+    args = parser.parse_args()
+
+    args.models = parse_list(args.models)
+    args.sizes = parse_list(args.sizes, int)
+    args.persons = parse_list(args.persons, int)
+    requested = parse_backends(args.backends)
+    args.backends = [name for name in requested if name != "onnxruntime" and is_available(name)]
+    skipped = [name for name in requested if name not in args.backends]
+    if skipped:
+        print(f"Skipping unavailable backends {skipped}")
+    if not args.backends:
+        parser.error("none of the requested backends is available")
+    os.makedirs(args.weights_dir, exist_ok=True)
+
+    results = []
+    print(f"{'model':<14}{'stage':<13}{'backend':<12}{'blob':>6}{'persons':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for model in args.models:
+        bench_model(model, args, results)
+
+    if args.json:
+        report = {
+            "environment": {
+                "opencv": cv2.__version__,
+                "numpy": np.__version__,
+                "python": platform.python_version(),
+                "machine": platform.machine(),
+                "processor": platform.processor(),
+                "cpu_count": os.cpu_count(),
+                "threads": cv2.getNumThreads(),
+                "time": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            },
+            "config": {
+                "models": args.models,
+                "sizes": args.sizes,
+                "backends": args.backends,
+                "persons": args.persons,
+                "repeat": args.repeat,
+                "preallocate": args.preallocate,
+            },
+            "results": results,
+        }
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote {len(results)} results to {args.json}")
+
+if __name__ == "__main__":
+    main()
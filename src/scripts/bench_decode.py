@@ -0,0 +1,104 @@
+"""
+Microbenchmark of the YOLO output decoding.
+
+It compares the per-row Python loop that DarknetDNN used before against the vectorized decode_detections on
+synthetic output layers with the shapes of yolov3-tiny and yolov7-tiny, so it runs without weights or camera.
+
+Usage: python bench_decode.py [--repeat 200] [--persons 5]
+"""
+import argparse
+import time
+import cv2
+import numpy as np
+
+from yolo_decoder import decode_detections
+
+# Number of grid cells of every output layer for a 320x320 blob (3 anchors per cell)
+MODEL_GRIDS = {
+    "yolov3-tiny": [10, 20],
+    "yolov7-tiny": [40, 20, 10],
+}
+
+def synthetic_output(grids, persons, num_classes = 80, seed = 0):
+    rng = np.random.default_rng(seed)
+    output = []
+    for grid in grids:
+        rows = grid * grid * 3
+        out = np.zeros((rows, 5 + num_classes), dtype=np.float32)
+        out[:, 0:2] = rng.random((rows, 2))
+        out[:, 2:4] = rng.random((rows, 2)) * 0.5
+        out[:, 4] = rng.random(rows) * 0.2
+        out[:, 5:] = rng.random((rows, num_classes)) * 0.05
+
+        # Put a few confident overlapping detections around every person
+        for center in rng.random((persons, 2)):
+            hits = rng.choice(rows, 3, replace=False)
+            out[hits, 0:2] = center + rng.normal(0, 0.005, (3, 2))
+            out[hits, 2:4] = (0.2, 0.5)
+            out[hits, 4] = 0.9
+            out[hits, 5] = rng.uniform(0.6, 0.9, 3)
+        output.append(out)
+    return output
+
+def legacy_decode(output, width, height, confidence_threshold = 0.3, nms_threshold = 0.4):
+    # The loop that used to live in DarknetDNN.detect_object and draw_detected_object
+    object_confidences = []
+    object_boxes = []
+    object_area = []
+    object_position = []
+    for out in output:
+        for detection in out:
+            scores = detection[5:]
+            class_id = np.argmax(scores)
+            confidence = scores[class_id]
+            if confidence <= confidence_threshold:
+                continue
+            if class_id != 0:
+                continue
+            cx = int(detection[0] * width)
+            cy = int(detection[1] * height)
+            w = int(detection[2] * width)
+            h = int(detection[3] * height)
+            x1 = int(cx - w/2)
+            y1 = int(cy - h/2)
+            x2 = int(cx + w/2)
+            y2 = int(cy + h/2)
+            object_confidences.append(confidence)
+            object_boxes.append([x1, y1, x2, y2])
+            object_area.append(w * h)
+            position = 'Center'
+            if cx <= width/3:
+                position = 'Left'
+            elif cx >= 2 * width/3:
+                position = 'Right'
+            object_position.append(position)
+    indexes = cv2.dnn.NMSBoxes(object_boxes, object_confidences, confidence_threshold, nms_threshold)
+    return [object_boxes[i] for i in np.asarray(indexes).reshape(-1)]
+
+def measure(function, repeat):
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--persons", type=int, default=5)
+    args = parser.parse_args()
+
+    width, height = 640, 480
+    print(f"{'model':<14}{'rows':>7}{'loop p50':>11}{'loop p99':>11}{'numpy p50':>11}{'numpy p99':>11}{'speedup':>9}")
+    for model, grids in MODEL_GRIDS.items():
+        output = synthetic_output(grids, args.persons)
+        rows = sum(len(out) for out in output)
+
+        loop_p50, loop_p99 = measure(lambda: legacy_decode(output, width, height), args.repeat)
+        numpy_p50, numpy_p99 = measure(lambda: decode_detections(output, width, height), args.repeat)
+        print(f"{model:<14}{rows:>7}{loop_p50:>9.3f}ms{loop_p99:>9.3f}ms{numpy_p50:>9.3f}ms{numpy_p99:>9.3f}ms{loop_p50/numpy_p50:>8.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+"""
+Benchmark of the RealSense depth post-processing chain on recorded bag files.
+
+Every combination of the filters in FILTER_ORDER (decimation always first) is run on the same frames of the bag, followed
+by rs.align to the color stream like DeviceCamera does, and the per-frame cost of the filters and of the alignment is
+printed. Record a bag with the RealSense Viewer or `rs-record` with the depth and color streams enabled.
+
+Usage: python bench_depth_filters.py recording.bag [--frames 300]
+"""
+import argparse
+import itertools
+import time
+import numpy as np
+import pyrealsense2 as rs
+
+from depth_filters import DepthFilterChain, FILTER_ORDER
+
+def load_frames(bag, count):
+    # Keep the recorded framesets in memory so every combination runs on the same input
+    pipeline = rs.pipeline()
+    config = rs.config()
+    config.enable_device_from_file(bag, repeat_playback=False)
+    profile = pipeline.start(config)
+    profile.get_device().as_playback().set_real_time(False)
+
+    frames = []
+    try:
+        while len(frames) < count:
+            success, frameset = pipeline.try_wait_for_frames(1000)
+            if not success:
+                break
+            frameset.keep()
+            frames.append(frameset)
+    finally:
+        pipeline.stop()
+    return frames
+
+def run(frames, config):
+    chain = DepthFilterChain(rs, config)
+    align = rs.align(rs.stream.color)
+    filter_times = []
+    align_times = []
+    for frameset in frames:
+        start = time.perf_counter()
+        filtered = chain.process(frameset)
+        middle = time.perf_counter()
+        aligned = align.process(filtered)
+        aligned.get_depth_frame()
+        end = time.perf_counter()
+        filter_times.append(middle - start)
+        align_times.append(end - middle)
+    return chain, np.array(filter_times) * 1000, np.array(align_times) * 1000
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("bag", nargs="+")
+    parser.add_argument("--frames", type=int, default=300)
+    args = parser.parse_args()
+
+    others = FILTER_ORDER[1:]
+    combinations = []
+    for decimation in (False, True):
+        for count in range(len(others) + 1):
+            for names in itertools.combinations(others, count):
+                combinations.append({name: True for name in (("decimation",) if decimation else ()) + names})
+
+    for bag in args.bag:
+        frames = load_frames(bag, args.frames)
+        print(f"{bag}: {len(frames)} frames")
+        print(f"{'filters':<58}{'filter p50':>12}{'align p50':>11}{'total p95':>11}")
+        for config in combinations:
+            chain, filter_times, align_times = run(frames, config)
+            total = filter_times + align_times
+            print(f"{' -> '.join(chain.names) or 'none':<58}{np.median(filter_times):>10.2f}ms{np.median(align_times):>9.2f}ms{np.percentile(total, 95):>9.2f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Benchmark of the preallocated preprocessing and decoding path.
+
+It compares cv2.dnn.blobFromImage with decode_detections allocating its results against BlobPreprocessor with
+DetectionBuffers, on random 640x480 frames and synthetic yolov3-tiny outputs. It reports the bytes allocated per frame
+(traced with tracemalloc, which sees the NumPy allocations made by OpenCV too) and the p50/p99 latency.
+
+Usage: python bench_preallocated.py [--repeat 500] [--size 320]
+"""
+import argparse
+import time
+import tracemalloc
+import cv2
+import numpy as np
+
+from blob_preprocessor import BlobPreprocessor
+from yolo_decoder import decode_detections, DetectionBuffers
+from bench_decode import synthetic_output, MODEL_GRIDS
+
+def allocating_path(frame, output, size):
+    blob = cv2.dnn.blobFromImage(frame, 1/255.0, size, (0, 0, 0), True, False, cv2.CV_32F)
+    return blob, decode_detections(output, frame.shape[1], frame.shape[0])
+
+def make_preallocated_path():
+    preprocessor = BlobPreprocessor()
+    buffers = DetectionBuffers()
+    def preallocated_path(frame, output, size):
+        blob = preprocessor(frame, size)
+        return blob, decode_detections(output, frame.shape[1], frame.shape[0], out=buffers)
+    return preallocated_path
+
+def allocated_bytes(function, frames, output, size):
+    # Warm up first so the persistent buffers are not counted
+    function(frames[0], output, size)
+    tracemalloc.start()
+    total = 0
+    for frame in frames:
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        function(frame, output, size)
+        total += tracemalloc.get_traced_memory()[1] - before
+    tracemalloc.stop()
+    return total / len(frames)
+
+def latency(function, frames, output, size):
+    timings = []
+    for frame in frames:
+        start = time.perf_counter()
+        function(frame, output, size)
+        timings.append(time.perf_counter() - start)
+    timings = np.array(timings) * 1000
+    return np.percentile(timings, 50), np.percentile(timings, 99)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--repeat", type=int, default=500)
+    parser.add_argument("--size", type=int, default=320)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    frames = [rng.integers(0, 255, (480, 640, 3), dtype=np.uint8) for _ in range(8)] * (args.repeat // 8 + 1)
+    frames = frames[:args.repeat]
+    output = synthetic_output(MODEL_GRIDS["yolov3-tiny"], persons=5)
+    size = (args.size, args.size)
+
+    print(f"{'path':<14}{'bytes/frame':>14}{'p50':>11}{'p99':>11}")
+    for name, function in (("allocating", allocating_path), ("preallocated", make_preallocated_path())):
+        allocated = allocated_bytes(function, frames[:100], output, size)
+        p50, p99 = latency(function, frames, output, size)
+        print(f"{name:<14}{allocated:>14.0f}{p50:>9.3f}ms{p99:>9.3f}ms")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,38 @@
+import cv2
+import numpy as np
+
+class BlobPreprocessor:
+    """
+    Build NCHW float32 blobs like cv2.dnn.blobFromImage (no mean, no crop) into persistent buffers.
+
+    The resize, the BGR->RGB swap and the scaling are written in place into memory allocated once per blob size, so the
+    steady state does not allocate. `count` buffers are kept per size and handed out in turn, because cv2.dnn keeps a
+    reference to the input until the forward is done and the pipeline can have a few blobs in flight.
+    """
+    def __init__(self, scalefactor = 1/255.0, swap_rb = True, count = 3):
+        self.scalefactor = np.float32(scalefactor)
+        self.channels = (2, 1, 0) if swap_rb else (0, 1, 2)
+        self.count = count
+        self.buffers = {}
+        self.index = 0
+
+    def ring(self, size):
+        ring = self.buffers.get(size)
+        if ring is None:
+            width, height = size
+            ring = [(np.empty((height, width, 3), dtype=np.uint8), np.empty((1, 3, height, width), dtype=np.float32)) for _ in range(self.count)]
+            self.buffers[size] = ring
+        return ring
+
+    def __call__(self, image, size):
+        size = tuple(size)
+        self.index = (self.index + 1) % self.count
+        resized, blob = self.ring(size)[self.index]
+
+        if image.shape[1] != size[0] or image.shape[0] != size[1]:
+            cv2.resize(image, size, dst=resized, interpolation=cv2.INTER_LINEAR)
+            image = resized
+
+        for plane, channel in enumerate(self.channels):
+            np.multiply(image[:, :, channel], self.scalefactor, out=blob[0, plane])
+        return blob
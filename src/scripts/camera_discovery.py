@@ -0,0 +1,204 @@
+"""
+Camera discovery from /sys/class/video4linux, without opening any video stream.
+
+Every /dev/videoN node is listed with the name, sysfs node index, USB bus id, vendor/product ids and serial read from
+sysfs, its stable /dev/v4l/by-id and by-path links, and (with formats=True) the capture pixel formats from the
+VIDIOC_QUERYCAP and VIDIOC_ENUM_FMT ioctls, which query the driver without starting a stream.
+
+Usage: python camera_discovery.py [selector]
+"""
+import os
+import sys
+import json
+import fcntl
+import struct
+from collections import namedtuple
+
+SYSFS_ROOT = "/sys/class/video4linux"
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "follower", "cameras.json")
+
+# V4L2 ioctls and flags from linux/videodev2.h
+VIDIOC_QUERYCAP = 0x80685600
+VIDIOC_ENUM_FMT = 0xC0405602
+V4L2_CAP_VIDEO_CAPTURE = 0x00000001
+V4L2_CAP_DEVICE_CAPS = 0x80000000
+V4L2_BUF_TYPE_VIDEO_CAPTURE = 1
+
+VideoDevice = namedtuple("VideoDevice", ["number", "path", "name", "index", "bus_id", "vendor_id", "product_id", "serial",
+                                         "by_id", "by_path", "capture", "formats"])
+
+def read_text(path):
+    try:
+        with open(path, "r") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+def usb_device_dir(node_dir):
+    # The device link of a video node points at the USB interface, the USB device with the serial is one of its parents
+    path = os.path.realpath(os.path.join(node_dir, "device"))
+    while path and path != "/":
+        if os.path.isfile(os.path.join(path, "idVendor")):
+            return path
+        path = os.path.dirname(path)
+    return None
+
+def stable_links(directory):
+    # Map /dev/videoN to the names of its by-id or by-path symlinks
+    links = {}
+    if os.path.isdir(directory):
+        for name in sorted(os.listdir(directory)):
+            links.setdefault(os.path.realpath(os.path.join(directory, name)), name)
+    return links
+
+def query_formats(path):
+    """
+    Return (is a video capture node, list of FOURCC strings) from the driver, or (None, []) when the node can't be queried.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return None, []
+    try:
+        capability = bytearray(104)
+        fcntl.ioctl(fd, VIDIOC_QUERYCAP, capability)
+        capabilities, device_caps = struct.unpack_from("<II", capability, 84)
+        caps = device_caps if capabilities & V4L2_CAP_DEVICE_CAPS else capabilities
+        capture = bool(caps & V4L2_CAP_VIDEO_CAPTURE)
+
+        formats = []
+        while capture:
+            description = bytearray(64)
+            struct.pack_into("<II", description, 0, len(formats), V4L2_BUF_TYPE_VIDEO_CAPTURE)
+            try:
+                fcntl.ioctl(fd, VIDIOC_ENUM_FMT, description)
+            except OSError:
+                break
+            pixelformat = struct.unpack_from("<I", description, 44)[0]
+            formats.append(pixelformat.to_bytes(4, "little").decode("ascii", "replace").strip())
+        return capture, formats
+    except OSError:
+        return None, []
+    finally:
+        os.close(fd)
+
+def list_devices(root = SYSFS_ROOT, formats = True, dev_dir = "/dev"):
+    """
+    Return a VideoDevice for every videoN node in sysfs, sorted by N.
+
+    capture is true for the nodes streaming video (UVC cameras also expose metadata nodes), or None when formats is
+    false or the node could not be queried; it then falls back to the sysfs index, which is 0 for the video node.
+    """
+    if not os.path.isdir(root):
+        return []
+    by_id = stable_links(os.path.join(dev_dir, "v4l", "by-id"))
+    by_path = stable_links(os.path.join(dev_dir, "v4l", "by-path"))
+
+    devices = []
+    for entry in os.listdir(root):
+        if not entry.startswith("video") or not entry[5:].isdigit():
+            continue
+        node_dir = os.path.join(root, entry)
+        path = os.path.join(dev_dir, entry)
+        index = read_text(os.path.join(node_dir, "index"))
+        usb_dir = usb_device_dir(node_dir)
+        usb = lambda name: read_text(os.path.join(usb_dir, name)) if usb_dir else None
+        capture, pixel_formats = query_formats(path) if formats else (None, [])
+        devices.append(VideoDevice(
+            number=int(entry[5:]),
+            path=path,
+            name=read_text(os.path.join(node_dir, "name")),
+            index=int(index) if index is not None and index.isdigit() else None,
+            bus_id=os.path.basename(usb_dir) if usb_dir else None,
+            vendor_id=usb("idVendor"),
+            product_id=usb("idProduct"),
+            serial=usb("serial"),
+            by_id=by_id.get(os.path.realpath(path)),
+            by_path=by_path.get(os.path.realpath(path)),
+            capture=capture,
+            formats=pixel_formats,
+        ))
+    return sorted(devices, key=lambda device: device.number)
+
+def is_capture(device):
+    return device.capture if device.capture is not None else device.index in (None, 0)
+
+def matches(device, selector):
+    # Exact stable identifiers first (serials may be all digits), then the device number, the device name matches as a
+    # case insensitive substring
+    if isinstance(selector, int):
+        return device.number == selector
+    if selector in (device.path, device.serial, device.bus_id, device.by_id, device.by_path):
+        return True
+    if selector.isdigit():
+        return device.number == int(selector)
+    if ":" in selector and selector.split(":", 1)[0] == device.vendor_id and selector.split(":", 1)[1] == device.product_id:
+        return True
+    return device.name is not None and selector.lower() in device.name.lower()
+
+def find_device(selector, devices):
+    """
+    Return the first capture node matching selector: a /dev path, serial, USB bus id (e.g. "2-1.3"), /dev/v4l/by-id or
+    by-path name, device number, "vendor:product" ids or part of the device name. None when nothing matches.
+    """
+    for device in devices:
+        if is_capture(device) and matches(device, selector):
+            return device
+    return None
+
+def still_present(device, root = SYSFS_ROOT):
+    # A cached device is reused when its node still has the same name and, for USB cameras, the same serial
+    node_dir = os.path.join(root, f"video{device['number']}")
+    if read_text(os.path.join(node_dir, "name")) != device["name"]:
+        return False
+    if device["serial"] is not None:
+        usb_dir = usb_device_dir(node_dir)
+        return usb_dir is not None and read_text(os.path.join(usb_dir, "serial")) == device["serial"]
+    return True
+
+def resolve_device(selector, cache_path = DEFAULT_CACHE, root = SYSFS_ROOT):
+    """
+    Return the VideoDevice for selector (see find_device), or None.
+
+    The match is cached in cache_path by selector. At the next launch, only the cached node is checked in sysfs (same
+    name and serial), and the full scan and the format queries only run when the camera moved or changed.
+    """
+    cache = {}
+    if cache_path:
+        try:
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+    key = str(selector)
+    cached = cache.get(key)
+    if cached is not None and still_present(cached, root):
+        return VideoDevice(**cached)
+
+    device = find_device(selector, list_devices(root))
+    if device is not None and cache_path:
+        cache[key] = device._asdict()
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print(f"Could not write the camera cache {cache_path}: {e}")
+    return device
+
+def main():
+    devices = list_devices()
+    if not devices:
+        print(f"No video device found in {SYSFS_ROOT}")
+    for device in devices:
+        kind = "capture" if is_capture(device) else "other"
+        print(f"{device.path:<13}{kind:<9}{device.name or '-':<40}bus {device.bus_id or '-':<10}serial {device.serial or '-':<16}{','.join(device.formats)}")
+        if device.by_id:
+            print(f"{'':<22}by-id {device.by_id}")
+    if len(sys.argv) > 1:
+        device = find_device(sys.argv[1], devices)
+        print(f"{sys.argv[1]} -> {device.path if device else 'not found'}")
+
+if __name__ == "__main__":
+    main()
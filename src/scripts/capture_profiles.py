@@ -0,0 +1,336 @@
+"""
+Capture profiles (pixel format, resolution and frame rate) of the cameras, and a benchmark of the frame rate they really
+deliver.
+
+The V4L2 profiles come from the VIDIOC_ENUM_FMT, VIDIOC_ENUM_FRAMESIZES and VIDIOC_ENUM_FRAMEINTERVALS ioctls, the
+Realsense ones from pyrealsense2. The benchmark opens every profile with its FOURCC and buffer size set explicitly,
+reads for a few seconds and reports the delivered frame rate, the read time and the decode cost (MJPG decoding or
+YUYV conversion, timed apart from the read with CAP_PROP_CONVERT_RGB off). With --save the fastest usable profile is
+locked for the camera in ~/.cache/follower, where DeviceCamera(capture_profile="auto") reads it.
+
+Usage: python capture_profiles.py [selector] [--benchmark] [--seconds 3] [--min-width 640] [--save] [--json out.json]
+"""
+import os
+import json
+import time
+import fcntl
+import struct
+import argparse
+from collections import namedtuple
+import cv2
+import numpy as np
+
+try:
+    from scripts.camera_discovery import list_devices, is_capture, find_device, VIDIOC_ENUM_FMT, V4L2_BUF_TYPE_VIDEO_CAPTURE
+except ImportError:
+    from camera_discovery import list_devices, is_capture, find_device, VIDIOC_ENUM_FMT, V4L2_BUF_TYPE_VIDEO_CAPTURE
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "follower", "capture_profiles.json")
+
+# V4L2 ioctls and enum types from linux/videodev2.h
+VIDIOC_ENUM_FRAMESIZES = 0xC02C564A
+VIDIOC_ENUM_FRAMEINTERVALS = 0xC034564B
+V4L2_FRMSIZE_TYPE_DISCRETE = 1
+V4L2_FRMIVAL_TYPE_DISCRETE = 1
+
+# stream is "video" for a V4L2 node, "color" or "depth" for a Realsense sensor
+CaptureProfile = namedtuple("CaptureProfile", ["stream", "fourcc", "width", "height", "fps"])
+
+def parse_profile(text):
+    """
+    Parse "MJPG 1280x720@30" (or "1280x720@30", "1280x720", "YUYV 640x480") into a CaptureProfile, the missing parts are
+    None and left to the driver.
+    """
+    fourcc = None
+    parts = text.strip().split()
+    if len(parts) == 2:
+        fourcc, text = parts[0].upper(), parts[1]
+    elif len(parts) == 1 and "x" not in parts[0]:
+        return CaptureProfile("video", parts[0].upper(), None, None, None)
+    size, _, fps = text.partition("@")
+    width, _, height = size.partition("x")
+    return CaptureProfile("video", fourcc, int(width), int(height), float(fps) if fps else None)
+
+def format_profile(profile):
+    size = f"{profile.width}x{profile.height}" if profile.width else "default"
+    fps = f"@{profile.fps:g}" if profile.fps else ""
+    return f"{profile.fourcc or ''} {size}{fps}".strip()
+
+def fourcc_text(code):
+    return int(code).to_bytes(4, "little").decode("ascii", "replace").strip("\x00 ")
+
+def enum(fd, request, size, fields, values, unpack):
+    # Run an ENUM ioctl until the driver returns EINVAL, the structure starts with the index followed by the other fields
+    items = []
+    while True:
+        buffer = bytearray(size)
+        struct.pack_into(fields, buffer, 0, len(items), *values)
+        try:
+            fcntl.ioctl(fd, request, buffer)
+        except OSError:
+            return items
+        items.append(unpack(buffer))
+
+def frame_sizes(fd, pixelformat):
+    # Discrete sizes as listed, stepwise or continuous ranges as their smallest and largest size
+    def unpack(buffer):
+        kind = struct.unpack_from("<I", buffer, 8)[0]
+        if kind == V4L2_FRMSIZE_TYPE_DISCRETE:
+            return [struct.unpack_from("<II", buffer, 12)]
+        min_width, max_width, _, min_height, max_height, _ = struct.unpack_from("<6I", buffer, 12)
+        return [(min_width, min_height), (max_width, max_height)]
+    sizes = enum(fd, VIDIOC_ENUM_FRAMESIZES, 44, "<II", (pixelformat,), unpack)
+    return [size for group in sizes for size in group]
+
+def frame_rates(fd, pixelformat, width, height):
+    # Frame rates of the discrete intervals, the fastest and slowest of a stepwise range
+    def unpack(buffer):
+        kind = struct.unpack_from("<I", buffer, 16)[0]
+        fractions = [struct.unpack_from("<II", buffer, 20)]
+        if kind != V4L2_FRMIVAL_TYPE_DISCRETE:
+            fractions.append(struct.unpack_from("<II", buffer, 28))
+        return [denominator / numerator for numerator, denominator in fractions if numerator]
+    rates = enum(fd, VIDIOC_ENUM_FRAMEINTERVALS, 52, "<IIII", (pixelformat, width, height), unpack)
+    return sorted({round(rate, 2) for group in rates for rate in group}, reverse=True)
+
+def list_v4l2_profiles(path):
+    """
+    Return every CaptureProfile the driver of a V4L2 capture node offers, without starting a stream.
+    """
+    try:
+        fd = os.open(path, os.O_RDONLY | os.O_NONBLOCK)
+    except OSError:
+        return []
+    try:
+        def unpack_format(buffer):
+            return struct.unpack_from("<I", buffer, 44)[0]
+        profiles = []
+        for pixelformat in enum(fd, VIDIOC_ENUM_FMT, 64, "<II", (V4L2_BUF_TYPE_VIDEO_CAPTURE,), unpack_format):
+            for width, height in frame_sizes(fd, pixelformat):
+                for fps in frame_rates(fd, pixelformat, width, height) or [None]:
+                    profiles.append(CaptureProfile("video", fourcc_text(pixelformat), width, height, fps))
+        return profiles
+    finally:
+        os.close(fd)
+
+def list_realsense_profiles(rs, serial = None):
+    """
+    Return the color and depth CaptureProfiles of the first (or the given) Realsense device.
+    """
+    for device in rs.context().query_devices():
+        if serial is not None and device.get_info(rs.camera_info.serial_number) != serial:
+            continue
+        profiles = []
+        for sensor in device.query_sensors():
+            for stream_profile in sensor.get_stream_profiles():
+                if not stream_profile.is_video_stream_profile():
+                    continue
+                video = stream_profile.as_video_stream_profile()
+                stream = str(stream_profile.stream_type()).split(".")[-1]
+                fourcc = str(stream_profile.format()).split(".")[-1].upper()
+                profiles.append(CaptureProfile(stream, fourcc, video.width(), video.height(), float(stream_profile.fps())))
+        return sorted(set(profiles), key=lambda p: (p.stream, p.fourcc, -p.width, -p.fps))
+    return []
+
+def apply_profile(capture, profile, buffers = 1):
+    """
+    Set the FOURCC, size, frame rate and driver buffer count of an opened cv2.VideoCapture, the FOURCC first since the
+    V4L2 backend negotiates the size for the current format. Return the CaptureProfile actually negotiated.
+    """
+    if buffers:
+        capture.set(cv2.CAP_PROP_BUFFERSIZE, buffers)
+    if profile is not None:
+        if profile.fourcc:
+            capture.set(cv2.CAP_PROP_FOURCC, cv2.VideoWriter_fourcc(*profile.fourcc.ljust(4)))
+        if profile.width:
+            capture.set(cv2.CAP_PROP_FRAME_WIDTH, profile.width)
+            capture.set(cv2.CAP_PROP_FRAME_HEIGHT, profile.height)
+        if profile.fps:
+            capture.set(cv2.CAP_PROP_FPS, profile.fps)
+    return CaptureProfile("video", fourcc_text(capture.get(cv2.CAP_PROP_FOURCC)), int(capture.get(cv2.CAP_PROP_FRAME_WIDTH)),
+                          int(capture.get(cv2.CAP_PROP_FRAME_HEIGHT)), capture.get(cv2.CAP_PROP_FPS))
+
+def decode_raw(raw, fourcc, width, height):
+    # Convert a frame read with CAP_PROP_CONVERT_RGB off into BGR, the work OpenCV otherwise does inside read()
+    if raw.ndim == 3 and raw.shape[2] == 3:
+        return raw
+    if fourcc == "MJPG":
+        return cv2.imdecode(raw.reshape(-1), cv2.IMREAD_COLOR)
+    if fourcc in ("YUYV", "YUY2"):
+        return cv2.cvtColor(raw.reshape(height, width, 2), cv2.COLOR_YUV2BGR_YUYV)
+    if fourcc == "UYVY":
+        return cv2.cvtColor(raw.reshape(height, width, 2), cv2.COLOR_YUV2BGR_UYVY)
+    return raw
+
+def benchmark_v4l2(device, profile, seconds = 3.0, buffers = 1, warmup = 5):
+    """
+    Open device with profile and return the negotiated profile, the delivered frame rate and the median read and decode
+    times in milliseconds.
+    """
+    capture = cv2.VideoCapture(device, cv2.CAP_V4L2)
+    try:
+        if not capture.isOpened():
+            return {"profile": format_profile(profile), "error": "not opened"}
+        negotiated = apply_profile(capture, profile, buffers)
+        capture.set(cv2.CAP_PROP_CONVERT_RGB, 0)
+        for _ in range(warmup):
+            capture.read()
+
+        reads = []
+        decodes = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            read_start = time.perf_counter()
+            ok, raw = capture.read()
+            if not ok:
+                break
+            decode_start = time.perf_counter()
+            decode_raw(raw, negotiated.fourcc, negotiated.width, negotiated.height)
+            reads.append(decode_start - read_start)
+            decodes.append(time.perf_counter() - decode_start)
+        elapsed = time.perf_counter() - start
+    finally:
+        capture.release()
+
+    return {
+        "profile": format_profile(profile),
+        "negotiated": format_profile(negotiated),
+        "frames": len(reads),
+        "delivered_fps": len(reads) / elapsed if elapsed > 0 else 0.0,
+        "read_ms": float(np.median(reads)) * 1000 if reads else None,
+        "decode_ms": float(np.median(decodes)) * 1000 if decodes else None,
+        "error": None if reads else "no frame",
+    }
+
+def benchmark_realsense(rs, profile, seconds = 3.0, warmup = 5):
+    # Color or depth stream alone through a Realsense pipeline, the SDK converts the format so there is no decode time
+    formats = {"BGR8": rs.format.bgr8, "RGB8": rs.format.rgb8, "YUYV": rs.format.yuyv, "Z16": rs.format.z16}
+    pipeline = rs.pipeline()
+    config = rs.config()
+    stream = rs.stream.depth if profile.stream == "depth" else rs.stream.color
+    config.enable_stream(stream, profile.width, profile.height, formats.get(profile.fourcc, rs.format.any), int(profile.fps))
+    try:
+        pipeline.start(config)
+    except RuntimeError as e:
+        return {"profile": f"{profile.stream} {format_profile(profile)}", "error": str(e)}
+    try:
+        for _ in range(warmup):
+            pipeline.wait_for_frames()
+        reads = []
+        start = time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            read_start = time.perf_counter()
+            pipeline.wait_for_frames()
+            reads.append(time.perf_counter() - read_start)
+        elapsed = time.perf_counter() - start
+    finally:
+        pipeline.stop()
+    return {
+        "profile": f"{profile.stream} {format_profile(profile)}",
+        "negotiated": format_profile(profile),
+        "frames": len(reads),
+        "delivered_fps": len(reads) / elapsed,
+        "read_ms": float(np.median(reads)) * 1000 if reads else None,
+        "decode_ms": 0.0,
+        "error": None if reads else "no frame",
+    }
+
+def fastest_usable(results, profiles, min_width = 640, min_fps_ratio = 0.9):
+    """
+    Return the profile delivering the most frames per second (then the cheapest decode) among the ones at least
+    min_width wide that keep min_fps_ratio of their nominal rate, or None.
+    """
+    usable = []
+    for result, profile in zip(results, profiles):
+        if result.get("error") or (profile.width or 0) < min_width:
+            continue
+        if profile.fps and result["delivered_fps"] < min_fps_ratio * profile.fps:
+            continue
+        usable.append((result, profile))
+    if not usable:
+        return None
+    return max(usable, key=lambda item: (round(item[0]["delivered_fps"]), -(item[0]["decode_ms"] or 0.0)))[1]
+
+def device_key(device):
+    # Survives the renumbering of the /dev/videoN nodes
+    return device.serial or device.by_id or device.bus_id or device.path
+
+def load_locked(cache_path = DEFAULT_CACHE):
+    try:
+        with open(cache_path, "r") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def locked_profile(device, cache_path = DEFAULT_CACHE):
+    """
+    Return the CaptureProfile saved for a VideoDevice by the benchmark, or None.
+    """
+    text = load_locked(cache_path).get(device_key(device))
+    return parse_profile(text) if text else None
+
+def save_locked(device, profile, cache_path = DEFAULT_CACHE):
+    locked = load_locked(cache_path)
+    locked[device_key(device)] = format_profile(profile)
+    try:
+        os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        with open(cache_path, "w") as f:
+            json.dump(locked, f, indent=2)
+    except OSError as e:
+        print(f"Could not write the capture profile cache {cache_path}: {e}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("selector", nargs="?", help="camera selector, see camera_discovery.find_device; all cameras when omitted")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--seconds", type=float, default=3.0)
+    parser.add_argument("--buffers", type=int, default=1, help="driver buffer count set with CAP_PROP_BUFFERSIZE")
+    parser.add_argument("--min-width", type=int, default=640)
+    parser.add_argument("--realsense", action="store_true", help="list (and benchmark) the Realsense profiles with pyrealsense2")
+    parser.add_argument("--save", action="store_true", help="lock every camera to its fastest usable profile")
+    parser.add_argument("--json", help="write the benchmark results to this file")
+    args = parser.parse_args()
+
+    report = {}
+    if args.realsense:
+        import pyrealsense2 as rs
+        profiles = [p for p in list_realsense_profiles(rs, args.selector) if p.width >= args.min_width or p.stream == "depth"]
+        for profile in profiles:
+            print(f"realsense {profile.stream:<6}{format_profile(profile)}")
+        if args.benchmark:
+            report["realsense"] = [benchmark_realsense(rs, profile, args.seconds) for profile in profiles]
+    else:
+        devices = [device for device in list_devices() if is_capture(device)]
+        if args.selector is not None:
+            device = find_device(args.selector, devices)
+            devices = [device] if device is not None else []
+        if not devices:
+            print("No capture device found")
+        for device in devices:
+            profiles = list_v4l2_profiles(device.path)
+            print(f"{device.path} {device.name or ''} ({len(profiles)} profiles)")
+            for profile in profiles:
+                print(f"  {format_profile(profile)}")
+            if not args.benchmark:
+                continue
+
+            candidates = [profile for profile in profiles if profile.width >= args.min_width]
+            results = [benchmark_v4l2(device.path, profile, args.seconds, args.buffers) for profile in candidates]
+            for result in results:
+                if result["error"]:
+                    print(f"  {result['profile']:<24}{result['error']}")
+                else:
+                    print(f"  {result['profile']:<24}-> {result['negotiated']:<24}{result['delivered_fps']:6.1f} fps  read {result['read_ms']:.2f} ms  decode {result['decode_ms']:.2f} ms")
+            best = fastest_usable(results, candidates, args.min_width)
+            print(f"  fastest usable: {format_profile(best) if best else 'none'}")
+            report[device.path] = {"device": device._asdict(), "results": results, "fastest": format_profile(best) if best else None}
+            if args.save and best is not None:
+                save_locked(device, best)
+                print(f"  locked {device_key(device)} to {format_profile(best)}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+
+if __name__ == "__main__":
+    main()
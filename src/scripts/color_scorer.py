@@ -0,0 +1,62 @@
+import cv2
+import numpy as np
+
+class ColorScorer:
+    """
+    Score the safety-vest color inside many boxes at once.
+
+    prepare() converts the frame, or a copy downscaled by `scale`, to HSV once, masks it with every (low, high) HSV range
+    and builds an integral image of each mask and of their union. score() then returns the colored pixel area of every box
+    with four lookups, whatever the number of boxes. Areas are given in full resolution pixels and the boxes are clamped
+    to the actual frame shape.
+    """
+    def __init__(self, ranges, scale = 1.0):
+        self.ranges = [(np.asarray(low, dtype=np.uint8), np.asarray(high, dtype=np.uint8)) for low, high in ranges]
+        self.scale = scale
+        self.integrals = None
+        self.frame_shape = None
+
+    def prepare(self, image):
+        self.frame_shape = image.shape[:2]
+        if self.scale != 1.0:
+            image = cv2.resize(image, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        hsv = cv2.cvtColor(image, cv2.COLOR_BGR2HSV)
+
+        masks = [cv2.inRange(hsv, low, high) for low, high in self.ranges]
+        union = masks[0]
+        for mask in masks[1:]:
+            union = cv2.bitwise_or(union, mask)
+
+        # The masks are 0 or 255, so the sums stay far below the int32 limit
+        self.integrals = [cv2.integral(mask, sdepth=cv2.CV_32S) for mask in [union] + masks]
+        return self
+
+    def lookup(self, integral, boxes):
+        height, width = self.frame_shape
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        x1 = np.clip(boxes[:, 0], 0, width)
+        x2 = np.clip(boxes[:, 2], 0, width)
+        y1 = np.clip(boxes[:, 1], 0, height)
+        y2 = np.clip(boxes[:, 3], 0, height)
+
+        # Map the clamped boxes onto the possibly downscaled mask
+        mask_height, mask_width = integral.shape[0] - 1, integral.shape[1] - 1
+        x1 = np.rint(x1 * mask_width / width).astype(np.intp)
+        x2 = np.rint(x2 * mask_width / width).astype(np.intp)
+        y1 = np.rint(y1 * mask_height / height).astype(np.intp)
+        y2 = np.rint(y2 * mask_height / height).astype(np.intp)
+
+        pixels = integral[y2, x2] - integral[y1, x2] - integral[y2, x1] + integral[y1, x1]
+        return pixels / 255.0 * (width * height) / (mask_width * mask_height)
+
+    def score(self, boxes):
+        """
+        Return the area of the union of all the color ranges inside every box.
+        """
+        return self.lookup(self.integrals[0], boxes)
+
+    def score_per_range(self, boxes):
+        """
+        Return an (N, number of ranges) array with the area of every color range inside every box.
+        """
+        return np.stack([self.lookup(integral, boxes) for integral in self.integrals[1:]], axis=1)
@@ -0,0 +1,60 @@
+import time
+import threading
+
+# UInt8 codes of the rover_command topic read by the Arduino sketch
+COMMAND_CODES = {'Hold': 0, 'Right': 1, 'Left': 2, 'Center': 3}
+
+class CommandLink:
+    """
+    Rate-limited, change-driven sender of the rover command over the rosserial link.
+
+    update() is called with every decision and its frame capture time, and only stores it. tick() runs on its own timer
+    (e.g. a rospy.Timer at `rate` Hz) and calls publish(code, direction, timestamp) when:
+      - the command differs from the last one sent, or
+      - keepalive seconds passed since the last send (0 disables the keepalive).
+    A decision older than deadline seconds is never sent. When the newest decision goes stale, Hold is sent once (unless
+    hold_on_stale is false) so the rover does not keep executing an outdated command while the detector stalls.
+    """
+    def __init__(self, publish, keepalive = 1.0, deadline = 0.5, hold_on_stale = True):
+        self.publish = publish
+        self.keepalive = keepalive
+        self.deadline = deadline
+        self.hold_on_stale = hold_on_stale
+        self.lock = threading.Lock()
+        self.latest = None
+        self.last_sent = None
+        self.last_sent_time = 0.0
+        self.sent = 0
+        self.unchanged = 0
+        self.stale = 0
+
+    def update(self, direction, timestamp):
+        with self.lock:
+            self.latest = (direction, timestamp)
+
+    def tick(self, event = None):
+        # event is the rospy.TimerEvent when called from a rospy.Timer
+        now = time.time()
+        with self.lock:
+            latest = self.latest
+        if latest is None:
+            return False
+
+        direction, timestamp = latest
+        if self.deadline and now - timestamp > self.deadline:
+            self.stale += 1
+            if not self.hold_on_stale or self.last_sent == 'Hold':
+                return False
+            direction = 'Hold'
+        elif direction == self.last_sent and (not self.keepalive or now - self.last_sent_time < self.keepalive):
+            self.unchanged += 1
+            return False
+
+        self.publish(COMMAND_CODES.get(direction, 0), direction, timestamp)
+        self.last_sent = direction
+        self.last_sent_time = now
+        self.sent += 1
+        return True
+
+    def stats(self):
+        return {"sent": self.sent, "unchanged": self.unchanged, "stale": self.stale}
@@ -1,136 +1,183 @@
 import os
+import time
+import threading
 import cv2
 import numpy as np
 
+try:
+    from scripts.yolo_decoder import decode_detections, DetectionBuffers, POSITIONS, to_structured, command_for
+    from scripts.inference_backend import select_engine
+    from scripts.blob_preprocessor import BlobPreprocessor
+    from scripts.color_scorer import ColorScorer
+    from scripts.stage_metrics import DISABLED_METRICS
+except ImportError:
+    from yolo_decoder import decode_detections, DetectionBuffers, POSITIONS, to_structured, command_for
+    from inference_backend import select_engine
+    from blob_preprocessor import BlobPreprocessor
+    from color_scorer import ColorScorer
+    from stage_metrics import DISABLED_METRICS
+
 ROOT_DIR = os.path.dirname(__file__)
 
 class DarknetDNN:
-    def __init__(self, dnn_model = "weights/yolov3-tiny.weights", dnn_config = "cfg/yolov3-tiny.cfg"):
+    def __init__(self, dnn_model = "weights/yolov3-tiny.weights", dnn_config = "cfg/yolov3-tiny.cfg", backend = "auto", onnx_model = None, preallocate = False, metrics = None, cache_engine = False, dnn_names = "coco.names"):
         #Check the installed OpenCV version
         print("Loading on OpenCV version", cv2.__version__)
 
+        #Blob parameter
+        self.blob_scalefactor = 1/255.0
+        self.blob_size = (320, 320)
+        self.blob_scalar = (0, 0, 0)
+        self.blob_swapRB = True
+        self.blob_crop = False
+        self.blob_ddepth = cv2.CV_32F
+
         #Initiate DNN model using Darknet framework
         print("Initiating Darknet ...")
         self.dnn_model = os.path.join(ROOT_DIR, dnn_model)
         self.dnn_config = os.path.join(ROOT_DIR, dnn_config)
-        self.dnn_name_lists = os.path.join(ROOT_DIR, "coco.names")
+        self.dnn_name_lists = os.path.join(ROOT_DIR, dnn_names)
         print("Loading model from ", self.dnn_model)
         print("Loading config from ", self.dnn_config)
         print("Loading names from ", self.dnn_name_lists)
-        self.net = cv2.dnn.readNet(self.dnn_model, self.dnn_config)
-        self.net.setPreferableBackend(cv2.dnn.DNN_BACKEND_CUDA)
-        self.net.setPreferableTarget(cv2.dnn.DNN_TARGET_CUDA)
+
+        #A pre-converted ONNX export next to the weights (yolov3-tiny.onnx for yolov3-tiny.weights) is used when none is given
+        onnx_model = os.path.join(ROOT_DIR, onnx_model) if onnx_model else None
+        converted = os.path.splitext(self.dnn_model)[0] + ".onnx"
+        if onnx_model is None and os.path.isfile(converted):
+            print("Found pre-converted model", converted)
+            onnx_model = converted
+
+        #Pick the fastest available inference backend, "auto" probes all of them unless the last probe is cached next to the weights
+        start = time.perf_counter()
+        cache_path = self.dnn_model + ".engine.json" if cache_engine else None
+        self.engine = select_engine(self.dnn_model, self.dnn_config, backend, onnx_model, self.blob_size, cache_path=cache_path)
+        self.load_time = time.perf_counter() - start
+        self.backend = self.engine.name
+        self.net = self.engine.net
+        self.output_layers = self.engine.output_layers
 
         self.classes = []
 
         with open(self.dnn_name_lists, "r") as f:
             self.classes = [line.strip() for line in f.readlines()]
-        
-        self.layer_names = self.net.getLayerNames()
-        #self.colors = np.random.uniform(0, 255, size=(len(self.classes), 3))
-
-        #Check the type of output layer, some older version OpenCV has a different type of output layer
-        print("Output layer type is", type(self.net.getUnconnectedOutLayers()[0]))
-        if isinstance(self.net.getUnconnectedOutLayers()[0], np.int32):
-            self.output_layers = [self.layer_names[i - 1] for i in self.net.getUnconnectedOutLayers()]
-        else:
-            self.output_layers = [self.layer_names[i[0] - 1] for i in self.net.getUnconnectedOutLayers()]
-
-        #Blob parameter
-        self.blob_scalefactor = 1/255.0
-        self.blob_size = (320, 320)
-        self.blob_scalar = (0, 0, 0)
-        self.blob_swapRB = True
-        self.blob_crop = False
-        self.blob_ddepth = cv2.CV_32F
 
         #Threshold for detecting object
         self.confidence_threshold = 0.3
         self.nms_threshold = 0.4
 
-    def detect_object(self, image):
+        #Reuse persistent blob and detection arrays instead of allocating them on every frame
+        #Only preprocess and decode use them by default, the pipeline stages of follow_me.py. detect stays thread-safe and
+        #allocates per call unless a single-threaded caller asks for detect(image, shared=True)
+        self.preprocessor = BlobPreprocessor(self.blob_scalefactor, self.blob_swapRB) if preallocate else None
+        self.detection_buffers = DetectionBuffers() if preallocate else None
+
+        #The vest color is scored on a frame downscaled by this factor
+        self.color_scale = 0.5
+
+        #Stage timers (preprocess, forward, decode, nms, color_check), see StageMetrics
+        self.metrics = DISABLED_METRICS if metrics is None else metrics
+
+        #The OpenCV net keeps its input and outputs between setInput and forward, so concurrent callers take turns there
+        self.forward_lock = threading.Lock()
+
+    def warmup(self, blob_sizes = None, count = 2, frame_shape = (480, 640, 3)):
+        """
+        Run count preprocess and forward passes of a blank frame at every blob size, so the first real frame does not pay
+        for the backend initialization or the reallocation on a new input shape. Returns the time spent in seconds.
+        """
+        start = time.perf_counter()
+        metrics, self.metrics = self.metrics, DISABLED_METRICS
+        try:
+            frame = np.zeros(frame_shape, dtype=np.uint8)
+            for size in blob_sizes or [self.blob_size]:
+                for _ in range(count):
+                    self.forward_blob(self.preprocess(frame, tuple(size)))
+        finally:
+            self.metrics = metrics
+        return time.perf_counter() - start
+
+    def preprocess(self, image, blob_size = None, shared = True):
+        #With shared false the blob is allocated for this call instead of taken from the preallocated buffers
+        blob_size = self.blob_size if blob_size is None else blob_size
+        with self.metrics.timer("preprocess"):
+            if shared and self.preprocessor is not None:
+                return self.preprocessor(image, blob_size)
+            return cv2.dnn.blobFromImage(image, self.blob_scalefactor, blob_size, self.blob_scalar, self.blob_swapRB, self.blob_crop, self.blob_ddepth)
+
+    def forward(self, image):
         #Pre-process the input image
-        height, width, channels = image.shape
-        blob = cv2.dnn.blobFromImage(image, self.blob_scalefactor, self.blob_size, self.blob_scalar, self.blob_swapRB, self.blob_crop, self.blob_ddepth)
-
-        #Pass the blob as input into the DNN
-        self.net.setInput(blob)
-
-        #Wait for the output
-        output = self.net.forward(self.output_layers)
-
-        #Detected object information
-        self.object_classes = []
-        self.object_confidences = []
-        self.object_boxes = []
-        self.object_area = []
-        self.object_position = []
-
-        #For every output of the DNN
-        for out in output:
-            #For every detection in output
-            for detection in out:
-                #Takes the detection scores
-                scores = detection[5:]
-
-                #The object id detected is the largest scores
-                class_id = np.argmax(scores)
-
-                #The confidence of the detected object is the scores of the detected object
-                confidence = scores[class_id]
-
-                #Filter out if the object has low confidence
-                if confidence <= self.confidence_threshold:
-                    continue
-
-                #Filter out non-human object
-                if class_id != 0:
-                    continue
-
-                #Get the location of the detected object in the frame input
-                cx = int(detection[0] * width)
-                cy = int(detection[1] * height)
-                w = int(detection[2] * width)
-                h = int(detection[3] * height)
-                x1 = int(cx - w/2)
-                y1 = int(cy - h/2)
-                x2 = int(cx + w/2)
-                y2 = int(cy + h/2)
-                area = (w * h)
-
-                #Save the information about the detected object
-                self.object_classes.append(class_id)
-                self.object_confidences.append(confidence)
-                self.object_boxes.append([x1, y1, x2, y2])
-                self.object_area.append(area)
-                
-                position = 'Center'
-                if cx <= width/3:
-                    position = 'Left'
-                elif cx >= 2 * width/3:
-                    position = 'Right'
-                
-                self.object_position.append(position)
-    
-    def draw_detected_object(self, frame, depth_frame = None):
-        #Perform Non-Maximum Suppression to remove the redundant detections
-        indexes = cv2.dnn.NMSBoxes(self.object_boxes, self.object_confidences, self.confidence_threshold, self.nms_threshold)
-        for i in indexes:
-            #i = i[0]
-            x1, y1, x2, y2 = self.object_boxes[i]
-            label = self.classes[self.object_classes[i]]
-            color = (0, 255, 0)
+        blob = self.preprocess(image)
+
+        #Pass the blob into the DNN and wait for the output
+        with self.metrics.timer("forward"):
+            return self.forward_blob(blob)
+
+    def forward_blob(self, blob):
+        #Every forward of the engine goes through here, so concurrent callers take turns on the net
+        with self.forward_lock:
+            return self.engine.forward(blob)
+
+    def preprocess_batch(self, images):
+        with self.metrics.timer("preprocess"):
+            return cv2.dnn.blobFromImages(images, self.blob_scalefactor, self.blob_size, self.blob_scalar, self.blob_swapRB, self.blob_crop, self.blob_ddepth)
+
+    def detect_batch(self, images):
+        """
+        Detect humans on several images with one batched forward, returning a DETECTION_DTYPE array for every image.
+        """
+        blob = self.preprocess_batch(images)
+        with self.metrics.timer("forward"):
+            output = self.forward_blob(blob)
+
+        #Batched outputs are (batch, rows, values), a single image gives (rows, values)
+        output = [out.reshape(len(images), -1, out.shape[-1]) for out in output]
+        detections = []
+        for index, image in enumerate(images):
+            height, width = image.shape[:2]
+            #The shared detection buffers would be recycled within a large batch, so every camera gets its own arrays
+            detections.append(to_structured(*decode_detections([out[index] for out in output], width, height, self.confidence_threshold, self.nms_threshold)))
+        return detections
+
+    def decode(self, output, width, height, shared = True):
+        #Decode every output layer at once, the result is already filtered by Non-Maximum Suppression
+        #With shared false the arrays are allocated for this call instead of taken from the preallocated buffers
+        with self.metrics.timer("decode"):
+            return decode_detections(output, width, height, self.confidence_threshold, self.nms_threshold, out=self.detection_buffers if shared else None,
+                                     metrics=self.metrics if self.metrics.enabled else None)
+
+    def detect(self, image, blob_size = None, shared = False):
+        """
+        Detect the humans on an image and return them as a read-only DETECTION_DTYPE array, after Non-Maximum Suppression.
+
+        Nothing is stored on the instance and the blob and the decoded arrays are allocated for this call instead of taken
+        from the preallocated buffers, so one net can serve several threads and every frame is decoded once, whatever draws
+        it or picks the command from it. Only the forward itself is serialized. A single-threaded caller can set shared to
+        true to use the preallocated buffers (with preallocate), the returned array is a copy either way.
+        """
+        height, width = image.shape[:2]
+        blob = self.preprocess(image, blob_size, shared=shared)
+        with self.metrics.timer("forward"):
+            output = self.forward_blob(blob)
+        return to_structured(*self.decode(output, width, height, shared=shared))
+
+    def draw_detected_object(self, frame, detections, depth_frame = None):
+        #The detections are already filtered by Non-Maximum Suppression in detect
+        label = self.classes[0].capitalize()
+        color = (0, 255, 0)
+        for detection in detections:
+            x1, y1, x2, y2 = detection["box"].tolist()
 
             cx = int((x1 + x2)/2)
             cy = int((y1 + y2)/2)
 
-            this_position = self.object_position[i]
+            this_position = POSITIONS[detection["position"]]
 
             cv2.rectangle(frame, (x1, y1), (x2, y2), color, 1)
 
-            text_size, _ = cv2.getTextSize(label.capitalize(), cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+            text_size, _ = cv2.getTextSize(label, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
             cv2.rectangle(frame, (x1 + 5, y1 + 5), (x1 + 5 + text_size[0], y1 + 5 - text_size[1]), (0,0,0), cv2.FILLED)
-            cv2.putText(frame, label.capitalize(), (x1 + 5, y1 + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
+            cv2.putText(frame, label, (x1 + 5, y1 + 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
             cv2.putText(frame, this_position, (x1+5, y1+50), 0, 0.8, (255, 255, 255), 2)
             
             if depth_frame is not None:
@@ -139,94 +186,16 @@ class DarknetDNN:
                 cv2.rectangle(frame, (x1 + 5, y1 + 25), (x1 + 5 + text_size[0], y1 + 25 - text_size[1]), (0,0,0), cv2.FILLED)
                 cv2.putText(frame, f"{distance} m", (x1 + 5, y1 + 25), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
     
-    def get_command(self):
-        if not self.object_area:
-            return 'Hold'
-        else:
-            return self.object_position[self.object_area.index(max(self.object_area))]
+    def get_command(self, detections):
+        #Follow the largest person, Hold when nobody is detected
+        return command_for(detections)
     
     def detect_with_color(self, image, low_hsv, high_hsv):
-        # Pre-process the input image
-        height, width, channels = image.shape
-        blob = cv2.dnn.blobFromImage(image, self.blob_scalefactor, self.blob_size, self.blob_scalar, self.blob_swapRB, self.blob_crop, self.blob_ddepth)
-
-        # Pass the blob as input into the DNN
-        self.net.setInput(blob)
-
-        # Wait for the output
-        output = self.net.forward(self.output_layers)
-
-        # Detected object information
-        #object_classes = []
-        object_confidences = []
-        object_boxes = []
-
-        # For every output of the DNN
-        for out in output:
-            # For every detection in output
-            for detection in out:
-                # Takes the detection scores
-                scores = detection[5:]
-
-                # The object id detected is the largest scores
-                class_id = np.argmax(scores)
-
-                # The confidence of the detected object is the scores of the detected object
-                confidence = scores[class_id]
-
-                # Filter out if the object has low confidence
-                if confidence <= self.confidence_threshold:
-                    continue
-
-                # Filter out non-human object
-                if class_id != 0:
-                    continue
-
-                # Get the location of the detected object in the frame input
-                cx = int(detection[0] * width)
-                cy = int(detection[1] * height)
-                w = int(detection[2] * width)
-                h = int(detection[3] * height)
-                x1 = int(cx - w/2)
-                y1 = int(cy - h/2)
-                x2 = int(cx + w/2)
-                y2 = int(cy + h/2)
-
-                # Save the information about the detected object
-                #self.object_classes.append(class_id)
-                object_confidences.append(confidence)
-                object_boxes.append([x1, y1, x2, y2])
-        
-        # Perform Non-Maximum Suppression to remove the redundant detections
-        indexes = cv2.dnn.NMSBoxes(object_boxes, object_confidences, self.confidence_threshold, self.nms_threshold)
-        color_area = []
-        output_box = []
-        for i in indexes:
-            x_1, y_1, x_2, y_2 = object_boxes[i]
-            color = (0, 255, 0)
-
-            # Check the color of the person
-            ## Take the roi of our detected human
-            roi = image[y_1:y_2, x_1:x_2]
-            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-
-            ## Apply color filtering to the object
-            mask = cv2.inRange(roi, low_hsv, high_hsv)
-
-            ## Find the contours of the color
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-
-            ## Calculate the Area
-            total_area = 0
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                total_area += area
-
-            ## Save the area
-            color_area.append(total_area)
-            output_box.append([x_1, y_1, x_2, y_2])
-        
-        return color_area, output_box
+        detections = self.detect(image)
+
+        # Check the color of every detected human at once
+        color_area = self.check_color(image, detections["box"], low_hsv, high_hsv)
+        return color_area, detections["box"].tolist()
     
     def draw_target(self, frame, color_area, output_box):
         target_list = list(zip(color_area, output_box))
@@ -246,94 +215,14 @@ class DarknetDNN:
             
         return frame
     
-    def detect_human(self, image):
-        #Pre-process the input image
-        height, width, channels = image.shape
-        blob = cv2.dnn.blobFromImage(image, self.blob_scalefactor, self.blob_size, self.blob_scalar, self.blob_swapRB, self.blob_crop, self.blob_ddepth)
-
-        #Pass the blob as input into the DNN
-        self.net.setInput(blob)
-
-        #Wait for the output
-        output = self.net.forward(self.output_layers)
-
-        #Detected object information
-        #self.object_classes = []
-        self.object_confidences = []
-        self.object_boxes = []
-        #self.object_area = []
-        self.object_position = []
-
-        #For every output of the DNN
-        for out in output:
-            #For every detection in output
-            for detection in out:
-                #Takes the detection scores
-                scores = detection[5:]
-
-                #The object id detected is the largest scores
-                class_id = np.argmax(scores)
-
-                #The confidence of the detected object is the scores of the detected object
-                confidence = scores[class_id]
-
-                #Filter out if the object has low confidence
-                if confidence <= self.confidence_threshold:
-                    continue
-
-                #Filter out non-human object
-                if class_id != 0:
-                    continue
-
-                #Get the location of the detected object in the frame input
-                cx = int(detection[0] * width)
-                cy = int(detection[1] * height)
-                w = int(detection[2] * width)
-                h = int(detection[3] * height)
-                x1 = int(cx - w/2)
-                y1 = int(cy - h/2)
-                x2 = int(cx + w/2)
-                y2 = int(cy + h/2)
-                area = (w * h)
-
-                #Save the information about the detected object
-                #self.object_classes.append(class_id)
-                self.object_confidences.append(confidence)
-                self.object_boxes.append([x1, y1, x2, y2])
-                #self.object_area.append(area)
-                
-                position = 'Center'
-                if cx <= width/3:
-                    position = 'Left'
-                elif cx >= 2 * width/3:
-                    position = 'Right'
-                
-                self.object_position.append(position)
-        
-        output_bbox = []
-        output_confidences = []
-        output_position = []
-
-        #Perform Non-Maximum Suppression to remove the redundant detections
-        indexes = cv2.dnn.NMSBoxes(self.object_boxes, self.object_confidences, self.confidence_threshold, self.nms_threshold)
-        for i in indexes:
-            #i = i[0]
-            #x1, y1, x2, y2 = self.object_boxes[i]
-            output_bbox.append(self.object_boxes[i])
-            output_confidences.append(self.object_confidences[i])
-            output_position.append(self.object_position[i])
-
-            cx = int((x1 + x2)/2)
-            cy = int((y1 + y2)/2)
-
-        return output_bbox, output_confidences, output_position
-    
-    def draw_human_info(self, frame, bbox, confidences, positions, areas):
-        for box, confidence, position, area in zip(bbox, confidences, positions, areas):
-            x1, y1, x2, y2 = box
-            confidence_value = confidence
-            position_in_frame = position
-            color_conf = area
+    def draw_human_info(self, frame, detections, color_areas = None):
+        # The third line is the vest color area of every person when given, otherwise its box area
+        if color_areas is None:
+            color_areas = detections["area"].tolist()
+        for detection, color_conf in zip(detections, color_areas):
+            x1, y1, x2, y2 = detection["box"].tolist()
+            confidence_value = float(detection["confidence"])
+            position_in_frame = POSITIONS[detection["position"]]
 
             font = cv2.FONT_HERSHEY_SIMPLEX
 
@@ -349,54 +238,35 @@ class DarknetDNN:
             cv2.putText(frame, f"{color_conf}", (x1 + 5, y1 + 5 + text_size[1] + text_size_2[1]), font, 0.5, (0, 255, 0), 1)
 
     def check_color(self, image, bbox, low_hsv, upp_hsv):
-        areas = []
-        for box in bbox:
-            x1, y1, x2, y2 = box
-
-            if x1 < 0:
-                x1 = 0
-            if x2 > 640:
-                x2 = 640
-            if y1 < 0:
-                y1 = 0
-            if y2 > 480:
-                y2 = 480
-
-            roi = image[y1:y2, x1:x2]
-            roi = cv2.cvtColor(roi, cv2.COLOR_BGR2HSV)
-
-            mask = cv2.inRange(roi, low_hsv, upp_hsv)
-
-            contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
-            
-            total_area = 0
-            for contour in contours:
-                area = cv2.contourArea(contour)
-                total_area += area
-            
-            areas.append(total_area)
-        
-        return areas
+        return self.check_colors(image, bbox, [(low_hsv, upp_hsv)])
+
+    def check_colors(self, image, bbox, hsv_ranges):
+        # Area of the pixels inside any of the HSV ranges for every box, from one HSV conversion of the frame
+        if len(bbox) == 0:
+            return []
+        with self.metrics.timer("color_check"):
+            scorer = ColorScorer(hsv_ranges, self.color_scale).prepare(image)
+            return scorer.score(bbox).tolist()
     
-    def hunt(self, frame, depth, bbox, confidences, postitions, areas):
-        # Check if the bbox is empty or not
-        if not bbox:
-            return 
+    def hunt(self, frame, depth, detections, color_areas, distances = None):
+        # Check if anybody is detected, otherwise return the index of the target, the person wearing the most vest color
+        # distances in meters (DeviceCamera.box_distances) replace the depth pixel read at the center of the box
+        if len(detections) == 0:
+            return None
         
         # Get the maximum color
-        max_areas = max(areas)
-        max_index = areas.index(max_areas)
+        max_index = int(np.argmax(color_areas))
 
         # Get the target info
-        x1, y1, x2, y2 = bbox[max_index]
-        confidence = confidences[max_index]
-        postition = postitions[max_index]
+        x1, y1, x2, y2 = detections["box"][max_index].tolist()
         distance = None
         cx = int((x1 + x2)/2)
         cy = int((y1 + y2)/2)
 
         # Check if depth exist
-        if depth:
+        if distances is not None:
+            distance = None if np.isnan(distances[max_index]) else round(distances[max_index] * 100)
+        elif depth is not None:
             distance = round(depth[cy,cx]/10)
 
         # Draw the info
@@ -405,7 +275,7 @@ class DarknetDNN:
         text_size, _ret2 = cv2.getTextSize(f"Distance: {distance} cm", font, 0.5, 1)
         cv2.rectangle(frame, (cx, cy + text_size[1]), (cx, cy + text_size[1] ), (0, 0, 0), cv2.FILLED)
         cv2.putText(frame, f"Distance: {distance} cm", (cx, cy + text_size[1]), font, 0.5, (0, 255, 0), 1)
-        return 
+        return max_index
         
 
 def main():
@@ -415,8 +285,7 @@ def main():
     while True:
         _, frame = cap.read()
 
-        net.detect_object(frame)
-        net.draw_detected_object(frame)
+        net.draw_detected_object(frame, net.detect(frame))
 
         cv2.imshow("Video", frame)
 
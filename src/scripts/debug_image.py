@@ -0,0 +1,56 @@
+import time
+import threading
+import cv2
+
+class DebugImageWorker:
+    """
+    Draw and JPEG-encode annotated frames on a background thread at a low rate.
+
+    submit() only copies the frame when the next image is due and never waits for the encoder, so the detection loop
+    does not pay for drawing or compression. publish is called from the worker thread with (jpeg_bytes, timestamp), and
+    draw, when given, with (frame, detections) to draw the overlays in place.
+    """
+    def __init__(self, publish, draw = None, rate = 2.0, quality = 70):
+        self.publish = publish
+        self.draw = draw
+        self.period = 1.0 / rate
+        self.encode_params = [cv2.IMWRITE_JPEG_QUALITY, int(quality)]
+        self.last_submit = 0.0
+        self.pending = None
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.run, name="DebugImageWorker", daemon=True)
+        self.thread.start()
+
+    def submit(self, frame, detections = None, timestamp = None):
+        now = time.time()
+        if now - self.last_submit < self.period:
+            return False
+        self.last_submit = now
+
+        # Keep only the newest frame if the encoder is still busy
+        with self.condition:
+            self.pending = (frame.copy(), detections, now if timestamp is None else timestamp)
+            self.condition.notify()
+        return True
+
+    def run(self):
+        while self.running:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending is not None or not self.running, 0.5)
+                if self.pending is None:
+                    continue
+                frame, detections, timestamp = self.pending
+                self.pending = None
+
+            if self.draw is not None:
+                self.draw(frame, detections)
+            ok, jpeg = cv2.imencode(".jpg", frame, self.encode_params)
+            if ok:
+                self.publish(jpeg.tobytes(), timestamp)
+
+    def stop(self):
+        with self.condition:
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
@@ -0,0 +1,54 @@
+# Order in which the filters are applied, decimation first so every later block works on fewer pixels
+FILTER_ORDER = ["decimation", "threshold", "spatial", "temporal", "hole_filling"]
+
+# Options used for a filter enabled with true instead of an options dict, named like pyrealsense2.option
+DEFAULT_OPTIONS = {
+    "decimation": {"filter_magnitude": 2},
+    "threshold": {"min_distance": 0.1, "max_distance": 8.0},
+    "spatial": {"filter_magnitude": 2, "filter_smooth_alpha": 0.5, "filter_smooth_delta": 20, "holes_fill": 0},
+    "temporal": {"filter_smooth_alpha": 0.4, "filter_smooth_delta": 20, "holes_fill": 3},
+    "hole_filling": {"holes_fill": 1},
+}
+
+class DepthFilterChain:
+    """
+    RealSense depth post-processing blocks built once and reused on every frame.
+
+    config maps the filter names of FILTER_ORDER to an options dict (or true for DEFAULT_OPTIONS). The spatial and
+    temporal filters run in the disparity domain as Intel recommends, unless config has "disparity": false.
+    process() takes the frameset from wait_for_frames and returns a frameset, so it can run before rs.align and the
+    alignment then works on the decimated depth.
+    """
+    def __init__(self, rs, config):
+        self.rs = rs
+        self.names = [name for name in FILTER_ORDER if config.get(name)]
+        constructors = {
+            "decimation": rs.decimation_filter,
+            "threshold": rs.threshold_filter,
+            "spatial": rs.spatial_filter,
+            "temporal": rs.temporal_filter,
+            "hole_filling": rs.hole_filling_filter,
+        }
+
+        self.filters = []
+        use_disparity = config.get("disparity", True) and ("spatial" in self.names or "temporal" in self.names)
+        for name in self.names:
+            if use_disparity and name in ("spatial", "temporal") and not any(isinstance(f, rs.disparity_transform) for f in self.filters):
+                self.filters.append(rs.disparity_transform(True))
+            block = constructors[name]()
+            options = config[name] if isinstance(config[name], dict) else DEFAULT_OPTIONS[name]
+            for option, value in options.items():
+                block.set_option(getattr(rs.option, option), value)
+            self.filters.append(block)
+            if use_disparity and name == ("temporal" if "temporal" in self.names else "spatial"):
+                self.filters.append(rs.disparity_transform(False))
+
+    def process(self, frames):
+        if not self.filters:
+            return frames
+        for block in self.filters:
+            frames = block.process(frames)
+        return frames.as_frameset()
+
+    def __repr__(self):
+        return f"DepthFilterChain({' -> '.join(self.names) or 'empty'})"
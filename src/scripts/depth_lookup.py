@@ -0,0 +1,153 @@
+import numpy as np
+from collections import namedtuple
+
+# Pinhole intrinsics of a stream, named like pyrealsense2.intrinsics. The lens distortion is ignored, the Realsense depth
+# stream has none and the color distortion of the D400 cameras is negligible at the patch sizes used here.
+Intrinsics = namedtuple("Intrinsics", ["width", "height", "fx", "fy", "ppx", "ppy"])
+
+def scaled(intrinsics, width, height):
+    # Intrinsics of the same stream at another resolution, e.g. after the decimation filter
+    if (width, height) == (intrinsics.width, intrinsics.height):
+        return intrinsics
+    sx = width / intrinsics.width
+    sy = height / intrinsics.height
+    return Intrinsics(width, height, intrinsics.fx * sx, intrinsics.fy * sy, intrinsics.ppx * sx, intrinsics.ppy * sy)
+
+def deproject(intrinsics, u, v, z):
+    # Pixel coordinates and depth in meters to (N, 3) points in the camera frame
+    u, v, z = np.broadcast_arrays(np.asarray(u, dtype=np.float64), np.asarray(v, dtype=np.float64), np.asarray(z, dtype=np.float64))
+    return np.stack([(u - intrinsics.ppx) / intrinsics.fx * z, (v - intrinsics.ppy) / intrinsics.fy * z, z], axis=-1)
+
+def project(intrinsics, points):
+    # (N, 3) points to (u, v) pixel coordinates
+    z = np.maximum(points[..., 2], 1e-6)
+    return points[..., 0] / z * intrinsics.fx + intrinsics.ppx, points[..., 1] / z * intrinsics.fy + intrinsics.ppy
+
+def transform(extrinsics, points):
+    rotation, translation = extrinsics
+    return points @ rotation.T + translation
+
+def invert(extrinsics):
+    rotation, translation = extrinsics
+    return rotation.T, -rotation.T @ translation
+
+def patch_distance(depth, box, depth_scale = 0.001, shrink = 0.5, stride = 4, percentile = 50):
+    """
+    Robust distance in meters of a box on a depth image aligned with the color frame, or None without valid depth.
+
+    Only the central `shrink` part of the box is read (the corners of a person box are mostly background), every stride
+    pixels, and the percentile of the valid (non zero) samples is returned.
+    """
+    x1, y1, x2, y2 = shrink_box(box, shrink)
+    patch = depth[max(int(y1), 0):max(int(y2), 0):stride, max(int(x1), 0):max(int(x2), 0):stride]
+    valid = patch[patch > 0]
+    if valid.size == 0:
+        return None
+    return float(np.percentile(valid, percentile)) * depth_scale
+
+def shrink_box(box, shrink):
+    x1, y1, x2, y2 = (float(value) for value in box)
+    dx = (x2 - x1) * (1 - shrink) / 2
+    dy = (y2 - y1) * (1 - shrink) / 2
+    return x1 + dx, y1 + dy, x2 - dx, y2 - dy
+
+class DepthProjector:
+    """
+    Distances of color pixels and boxes read from the raw depth frame, instead of aligning the whole depth image to the
+    color stream on every frame.
+
+    The depth of a color pixel is unknown until it is found in the depth image, so a color box is mapped into depth
+    space at both ends of depth_range (meters). The region between them covers the box at any distance. That region
+    is sampled every stride depth pixels, and the valid samples are projected back into the color image. Only the samples
+    landing in the central `shrink` part of the box count, and their percentile (the median by default) is the distance.
+    Only a few hundred pixels are touched per box, against the reprojection of the whole depth image by rs.align.
+
+    color_to_depth is the (rotation, translation) taking points from the color camera frame to the depth camera frame,
+    depth_scale the meters per depth unit. Depth images of another resolution than depth_intrinsics (decimation
+    filter) are handled by scaling the intrinsics.
+    """
+    def __init__(self, depth_intrinsics, color_intrinsics, color_to_depth, depth_scale = 0.001, depth_range = (0.2, 10.0)):
+        self.depth_intrinsics = depth_intrinsics
+        self.color_intrinsics = color_intrinsics
+        self.color_to_depth = (np.asarray(color_to_depth[0], dtype=np.float64).reshape(3, 3), np.asarray(color_to_depth[1], dtype=np.float64))
+        self.depth_to_color = invert(self.color_to_depth)
+        self.depth_scale = depth_scale
+        self.depth_range = depth_range
+
+    def to_meta(self):
+        # JSON description stored with the recordings, see from_meta
+        return {
+            "depth_intrinsics": list(self.depth_intrinsics),
+            "color_intrinsics": list(self.color_intrinsics),
+            "color_to_depth": {"rotation": self.color_to_depth[0].tolist(), "translation": self.color_to_depth[1].tolist()},
+            "depth_scale": self.depth_scale,
+            "depth_range": list(self.depth_range),
+        }
+
+    @classmethod
+    def from_meta(cls, meta):
+        extrinsics = meta["color_to_depth"]
+        return cls(Intrinsics(*meta["depth_intrinsics"]), Intrinsics(*meta["color_intrinsics"]), (extrinsics["rotation"], extrinsics["translation"]),
+                   meta["depth_scale"], tuple(meta["depth_range"]))
+
+    @classmethod
+    def from_realsense(cls, profile, rs, depth_range = (0.2, 10.0)):
+        """
+        Build the projector from the pipeline profile returned by rs.pipeline.start.
+        """
+        depth_profile = profile.get_stream(rs.stream.depth).as_video_stream_profile()
+        color_profile = profile.get_stream(rs.stream.color).as_video_stream_profile()
+        to_intrinsics = lambda i: Intrinsics(i.width, i.height, i.fx, i.fy, i.ppx, i.ppy)
+        extrinsics = color_profile.get_extrinsics_to(depth_profile)
+        # The Realsense rotation is stored column-major
+        rotation = np.asarray(extrinsics.rotation, dtype=np.float64).reshape(3, 3).T
+        depth_scale = profile.get_device().first_depth_sensor().get_depth_scale()
+        return cls(to_intrinsics(depth_profile.get_intrinsics()), to_intrinsics(color_profile.get_intrinsics()),
+                   (rotation, extrinsics.translation), depth_scale, depth_range)
+
+    def depth_region(self, intrinsics, x1, y1, x2, y2):
+        # Bounding rectangle in the depth image of the color rectangle at every distance of depth_range
+        corners_u = np.array([x1, x2, x1, x2] * 2)
+        corners_v = np.array([y1, y1, y2, y2] * 2)
+        corners_z = np.repeat(self.depth_range, 4)
+        points = transform(self.color_to_depth, deproject(self.color_intrinsics, corners_u, corners_v, corners_z))
+        u, v = project(intrinsics, points)
+        return (int(np.clip(np.floor(u.min()), 0, intrinsics.width)), int(np.clip(np.floor(v.min()), 0, intrinsics.height)),
+                int(np.clip(np.ceil(u.max()) + 1, 0, intrinsics.width)), int(np.clip(np.ceil(v.max()) + 1, 0, intrinsics.height)))
+
+    def samples(self, depth, x1, y1, x2, y2, stride):
+        """
+        Return the depths in meters of the valid depth pixels, taken every stride pixels, that land inside the color
+        rectangle (x1, y1, x2, y2).
+        """
+        intrinsics = scaled(self.depth_intrinsics, depth.shape[1], depth.shape[0])
+        du1, dv1, du2, dv2 = self.depth_region(intrinsics, x1, y1, x2, y2)
+        patch = depth[dv1:dv2:stride, du1:du2:stride]
+        rows, cols = np.nonzero(patch)
+        if len(rows) == 0:
+            return np.empty(0)
+        z = patch[rows, cols] * self.depth_scale
+        points = transform(self.depth_to_color, deproject(intrinsics, du1 + cols * stride, dv1 + rows * stride, z))
+        u, v = project(self.color_intrinsics, points)
+        inside = (u >= x1) & (u < x2) & (v >= y1) & (v < y2)
+        return points[inside, 2]
+
+    def box_distance(self, depth, box, shrink = 0.5, stride = 4, percentile = 50):
+        """
+        Robust distance in meters of a color box (the percentile of the samples in its central `shrink` part), or None
+        without valid depth there.
+        """
+        z = self.samples(depth, *shrink_box(box, shrink), stride)
+        if z.size == 0:
+            return None
+        return float(np.percentile(z, percentile))
+
+    def box_distances(self, depth, boxes, shrink = 0.5, stride = 4, percentile = 50):
+        return [self.box_distance(depth, box, shrink, stride, percentile) for box in boxes]
+
+    def distance_at(self, depth, u, v, radius = 2):
+        """
+        Distance in meters at a color pixel, the median of the depth pixels within radius pixels of it, or None.
+        """
+        z = self.samples(depth, u - radius, v - radius, u + radius + 1, v + radius + 1, 1)
+        return float(np.median(z)) if z.size else None
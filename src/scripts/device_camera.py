@@ -1,5 +1,37 @@
 import cv2
+import time
+import threading
 import numpy as np
+from collections import deque, namedtuple
+
+try:
+    from scripts.depth_filters import DepthFilterChain
+    from scripts.frame_recording import FrameRecorder
+    from scripts.stage_metrics import DISABLED_METRICS
+    from scripts.camera_discovery import list_devices, is_capture, resolve_device
+    from scripts.depth_lookup import DepthProjector, patch_distance
+    from scripts.capture_profiles import CaptureProfile, parse_profile, format_profile, apply_profile, locked_profile
+except ImportError:
+    from depth_filters import DepthFilterChain
+    from frame_recording import FrameRecorder
+    from stage_metrics import DISABLED_METRICS
+    from camera_discovery import list_devices, is_capture, resolve_device
+    from depth_lookup import DepthProjector, patch_distance
+    from capture_profiles import CaptureProfile, parse_profile, format_profile, apply_profile, locked_profile
+
+# Used when no capture profile is given or locked for the camera, MJPG keeps 640x480@30 within the USB 2 bandwidth
+DEFAULT_PROFILE = CaptureProfile("video", "MJPG", 640, 480, 30.0)
+
+# Depth resolutions of the D400 depth sensor, the depth stream follows the color profile with one of them
+REALSENSE_DEPTH_SIZES = [(1280, 720), (848, 480), (640, 480), (640, 360), (480, 270), (424, 240)]
+
+def realsense_depth_size(width, height):
+    # The largest depth resolution with the aspect ratio of the color stream that is not wider than it, else 640x480
+    same_aspect = [size for size in REALSENSE_DEPTH_SIZES if abs(size[0] / size[1] - width / height) < 0.02 and size[0] <= width]
+    return same_aspect[0] if same_aspect else (640, 480)
+
+# A captured frame with the time it was grabbed and its sequence number since the stream started
+Frame = namedtuple("Frame", ["color", "depth", "timestamp", "sequence"])
 
 class DeviceCamera:
     """
@@ -7,10 +39,30 @@ class DeviceCamera:
 
     The class will try to use Intel Realsense python library (pyrelsense2) but it also able to use any camera device by passing the device id argument and set the realsense flag to false.
     
-    You can also scan the device id.
+    You can also scan the device id. device_id may be an index or a stable selector resolved through sysfs (serial, USB bus
+    id, /dev/v4l/by-id name or part of the camera name, see camera_discovery.find_device), cached between launches. A
+    selector matching no camera raises a RuntimeError, only a missing device_id opens the first available camera.
+
+    depth_filters configures the Realsense depth post-processing chain applied to every frame (see DepthFilterChain).
+
+    With align_depth set to false, the Realsense depth frame is returned as captured instead of being reprojected onto the
+    color frame, and depth_projector (a DepthProjector built from the stream intrinsics and extrinsics) maps only the
+    queried boxes into it. box_distances works on both kinds of depth frames.
+
+    With threaded set to true, a background thread keeps grabbing frames into a small ring buffer and get_frame returns the
+    newest one, so a slow consumer never works on frames queued in the driver. The frames skipped this way are counted in
+    dropped_frames.
+
+    capture_profile sets the format, resolution and frame rate, as a CaptureProfile or a string like "MJPG 1280x720@30"
+    (see capture_profiles.parse_profile). "auto" uses the profile locked for the camera by the capture_profiles
+    benchmark. A Realsense only takes the resolution and frame rate of its color stream from it. capture_buffers is the
+    number of driver buffers of a regular camera, 1 keeps the driver from queueing old frames.
+
+    metrics is a StageMetrics receiving the capture, depth_filter and align times of every frame.
     """
-    def __init__(self, device_id = None, realsense = True):
+    def __init__(self, device_id = None, realsense = True, threaded = False, buffer_size = 2, depth_filters = None, metrics = None, align_depth = True, capture_profile = None, capture_buffers = 1):
         print("Loading camera ...")
+        self.metrics = DISABLED_METRICS if metrics is None else metrics
 
         # Check if pyrealsense2 is available
         self.realsense, self.rs = self.check_pyrealsense2() if realsense else (False, None)
@@ -21,6 +73,14 @@ class DeviceCamera:
         self.capture = None
         self.pipeline = None
         self.winname = None
+        self.depth_filters = depth_filters
+        self.depth_filter_chain = None
+        self.align_depth = align_depth
+        self.capture_profile = parse_profile(capture_profile) if isinstance(capture_profile, str) and capture_profile != "auto" else capture_profile
+        self.capture_buffers = capture_buffers
+        self.negotiated_profile = None
+        self.depth_projector = None
+        self.depth_scale = 0.001
 
         # Initialize device
         #print(self.realsense)
@@ -34,6 +94,13 @@ class DeviceCamera:
             self.winname = "Regular Stream"
             self.stream_regular()
 
+        self.init_overlay()
+        self.init_buffers(threaded, buffer_size)
+
+        if self.threaded:
+            self.start_capture_thread()
+    
+    def init_overlay(self):
         # FPS Calculation
         self.tick_frequency = cv2.getTickFrequency()
         self.start_time = cv2.getTickCount()
@@ -48,7 +115,22 @@ class DeviceCamera:
         self.font_thickness = 1
         self.font_line_type = cv2.LINE_AA
         self.font_bottom_left_origin = False
-    
+
+    def init_buffers(self, threaded, buffer_size):
+        # Frame bookkeeping, shared with the capture thread
+        self.threaded = threaded
+        self.frames = deque(maxlen=buffer_size)
+        self.frame_condition = threading.Condition()
+        self.sequence = 0
+        self.last_sequence = 0
+        self.dropped_frames = 0
+        self.running = False
+        self.capture_thread = None
+        self.recorder = None
+
+        # Set when a finite source such as a replay has no frame left
+        self.finished = False
+
     def check_pyrealsense2(self):
         try:
             import pyrealsense2
@@ -63,35 +145,133 @@ class DeviceCamera:
         # Configure depth and color streams
         self.pipeline = self.rs.pipeline()
         config = self.rs.config()
-        config.enable_stream(self.rs.stream.depth, 640, 480, self.rs.format.z16, 30)
-        config.enable_stream(self.rs.stream.color, 640, 480, self.rs.format.bgr8, 30)
+        profile = self.capture_profile if isinstance(self.capture_profile, CaptureProfile) else DEFAULT_PROFILE
+        width, height, fps = profile.width or DEFAULT_PROFILE.width, profile.height or DEFAULT_PROFILE.height, int(profile.fps or DEFAULT_PROFILE.fps)
+        depth_width, depth_height = realsense_depth_size(width, height)
+        config.enable_stream(self.rs.stream.depth, depth_width, depth_height, self.rs.format.z16, fps)
+        config.enable_stream(self.rs.stream.color, width, height, self.rs.format.bgr8, fps)
+        self.negotiated_profile = CaptureProfile("color", "BGR8", width, height, float(fps))
 
         # Start streaming
-        self.pipeline.start(config)
+        self.profile = self.pipeline.start(config)
+        self.depth_scale = self.profile.get_device().first_depth_sensor().get_depth_scale()
         
-        # Align the depth stream with color stream
+        # Align the depth stream with color stream, or only project the queried boxes into the raw depth frame
         self.align = self.rs.align(self.rs.stream.color)
+        if not self.align_depth:
+            self.depth_projector = DepthProjector.from_realsense(self.profile, self.rs)
+
+        # Depth post-processing runs before the alignment, built once from the depth_filters config
+        if self.depth_filters:
+            self.depth_filter_chain = DepthFilterChain(self.rs, self.depth_filters)
+            print("Depth filters:", self.depth_filter_chain)
+        self.spatial_filter = self.rs.spatial_filter()
+        self.spatial_filter.set_option(self.rs.option.holes_fill, 3)
 
     def stream_regular(self):
-        # Searching for the first available device id if not specified
+        # Resolve a camera name, serial or bus id into its device number. A requested camera that is missing is an error,
+        # falling back to another one would have the rover follow the wrong camera
+        if isinstance(self.device_id, str) and not self.device_id.startswith("/dev/"):
+            selector = self.device_id
+            device = resolve_device(selector)
+            if device is None:
+                raise RuntimeError(f"Camera '{selector}' not found, check that it is connected or change the camera selector")
+            self.device_id = device.number
+            print(f"Camera '{selector}' is", device.path)
+
+        # Searching for the first available device id only when no camera was requested
         if self.device_id is None:
             self.device_id = self.search_available_device_id()
         
-        # Start streaming
+        # The profile locked by the capture_profiles benchmark for this camera
+        profile = self.capture_profile
+        if profile == "auto":
+            device = resolve_device(self.device_id) if self.device_id is not None else None
+            profile = locked_profile(device) if device is not None else None
+            print("Locked capture profile:", format_profile(profile) if profile is not None else "none")
+
+        # Start streaming with the FOURCC, size, frame rate and driver buffer count set explicitly
+        profile = profile or DEFAULT_PROFILE
         self.capture = cv2.VideoCapture(self.device_id)
-        self.capture.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-        self.capture.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-        print("Starting on device ", self.device_id)
+        self.negotiated_profile = apply_profile(self.capture, profile, self.capture_buffers)
+        print("Starting on device ", self.device_id, "with", format_profile(self.negotiated_profile))
+        if profile.fourcc and self.negotiated_profile.fourcc != profile.fourcc:
+            print(f"Warning: the camera refused the {profile.fourcc} format and streams {self.negotiated_profile.fourcc}")
+
+    def start_capture_thread(self):
+        self.running = True
+        self.capture_thread = threading.Thread(target=self.capture_loop, name="DeviceCameraCapture", daemon=True)
+        self.capture_thread.start()
+
+    def capture_loop(self):
+        while self.running:
+            color, depth = self.read_frame()
+            timestamp = time.time()
+
+            if color is None:
+                time.sleep(0.005)
+                continue
+
+            # Copy the Realsense frames so librealsense can recycle its frame pool while they wait in the buffer
+            if self.realsense:
+                color = color.copy()
+                depth = depth.copy()
+
+            with self.frame_condition:
+                self.sequence += 1
+                frame = Frame(color, depth, timestamp, self.sequence)
+                self.frames.append(frame)
+                self.frame_condition.notify_all()
+
+            if self.recorder is not None:
+                self.recorder.write(frame)
 
     def get_frame(self):
+        frame = self.get_frame_stamped()
+        return frame.color, frame.depth
+
+    def get_frame_stamped(self, timeout = 1.0):
+        """
+        Return the newest Frame(color, depth, timestamp, sequence).
+
+        In threaded mode this waits up to timeout seconds for a frame newer than the last one returned, and counts the
+        frames that were captured in between but never returned. A frame is never returned twice: without a newer one,
+        the result is Frame(None, None, None, last_sequence).
+        """
+        if not self.threaded:
+            color, depth = self.read_frame()
+            self.sequence += 1
+            self.last_sequence = self.sequence
+            frame = Frame(color, depth, time.time(), self.sequence)
+            if self.recorder is not None and color is not None:
+                self.recorder.write(frame)
+            return frame
+
+        with self.frame_condition:
+            self.frame_condition.wait_for(lambda: not self.running or (self.frames and self.frames[-1].sequence > self.last_sequence), timeout)
+            if not self.frames or self.frames[-1].sequence <= self.last_sequence:
+                return Frame(None, None, None, self.last_sequence)
+
+            frame = self.frames[-1]
+            self.dropped_frames += frame.sequence - self.last_sequence - 1
+            self.last_sequence = frame.sequence
+        return frame
+
+    def read_frame(self):
         if self.realsense:
             # Read the incoming frame from Realsense
-            frames = self.pipeline.wait_for_frames()
+            with self.metrics.timer("capture"):
+                frames = self.pipeline.wait_for_frames()
+            if self.depth_filter_chain is not None:
+                with self.metrics.timer("depth_filter"):
+                    frames = self.depth_filter_chain.process(frames)
 
             # Aligned the color frame and depth frame
-            aligned_frames = self.align.process(frames)
-            color_frame = aligned_frames.get_color_frame()
-            depth_frame = aligned_frames.get_depth_frame()
+            if self.align_depth:
+                with self.metrics.timer("align"):
+                    frames = self.align.process(frames)
+            color_frame = frames.get_color_frame()
+            depth_frame = frames.get_depth_frame()
 
             # Check if the stream is success or not
             if not color_frame or not depth_frame:
@@ -105,10 +285,34 @@ class DeviceCamera:
             return color_image, depth_image
         else:
             # Read the incoming frame from Regular Camera
-            retval, frame = self.capture.read()
+            with self.metrics.timer("capture"):
+                retval, frame = self.capture.read()
 
             return frame, None
 
+    def frame_shape(self):
+        """
+        Return the (height, width, 3) shape of the color frames, from the negotiated capture profile, or read from the
+        first frame when the driver did not report its size.
+        """
+        profile = self.negotiated_profile
+        if profile is not None and profile.width and profile.height:
+            return (profile.height, profile.width, 3)
+        color = self.get_frame_stamped().color
+        return color.shape if color is not None else (DEFAULT_PROFILE.height, DEFAULT_PROFILE.width, 3)
+
+    def box_distances(self, depth, boxes):
+        """
+        Return the distance in meters of every [x1, y1, x2, y2] color box, NaN where the depth is unknown.
+        """
+        if depth is None:
+            return [float("nan")] * len(boxes)
+        if self.depth_projector is not None:
+            distances = self.depth_projector.box_distances(depth, boxes)
+        else:
+            distances = [patch_distance(depth, box, self.depth_scale) for box in boxes]
+        return [float("nan") if distance is None else distance for distance in distances]
+
     def show_fps(self, frame):
         self.frame_count += 1
         current_time = cv2.getTickCount()
@@ -125,7 +329,38 @@ class DeviceCamera:
         cv2.putText(frame, f"FPS: {self.fps}", self.org, self.font_face, self.font_scale, self.font_color, self.font_thickness, self.font_line_type, self.font_bottom_left_origin)
         return frame
 
+    def depth_geometry(self):
+        """
+        Return how the depth frames map onto the color frames, as stored with the recordings: {"align_depth": true,
+        "depth_scale"} for aligned depth, the DepthProjector.to_meta description with "align_depth": false for raw
+        depth, None without depth.
+        """
+        if not self.realsense:
+            return None
+        if self.depth_projector is not None:
+            return dict(self.depth_projector.to_meta(), align_depth=False)
+        return {"align_depth": True, "depth_scale": self.depth_scale}
+
+    def start_recording(self, path, chunk_size = 300):
+        # Record every captured frame to path, see FrameRecorder
+        self.recorder = FrameRecorder(path, chunk_size, self.depth_geometry())
+
+    def stop_recording(self):
+        if self.recorder is not None:
+            recorder = self.recorder
+            self.recorder = None
+            recorder.close()
+
+    def stop_capture_thread(self):
+        if self.capture_thread is not None:
+            self.running = False
+            self.capture_thread.join()
+            self.capture_thread = None
+
     def stop(self):
+        self.stop_capture_thread()
+        self.stop_recording()
+
         if self.realsense:
             self.pipeline.stop()
         else:
@@ -149,12 +384,22 @@ class DeviceCamera:
             return False
     
     def search_available_device_id(self):
+        # Listed from sysfs without opening the devices, opening every id only where sysfs is not available
+        devices = list_devices()
+        if devices:
+            capture = [device.number for device in devices if is_capture(device)]
+            return capture[0] if capture else None
+
         for device_id in self.device_ids:
             if self.validate_device_id(device_id):
                 return device_id
         return None
     
     def available_device_id(self):
+        devices = list_devices()
+        if devices:
+            return [device.number for device in devices if is_capture(device)]
+
         available_device = [device_id for device_id in self.device_ids if self.validate_device_id(device_id)]
         return available_device
 
@@ -187,9 +432,7 @@ class DeviceCamera:
                 print("Error, impossible to get the frame, make sure that the Intel Realsense camera is correctly connected")
                 return None, None
             
-            spatial = self.rs.spatial_filter()
-            spatial.set_option(self.rs.option.holes_fill, 3)
-            filtered_depth = spatial.process(depth_frame)
+            filtered_depth = self.spatial_filter.process(depth_frame)
             
             # Convert the frame into Matrix
             color_image = np.asanyarray(color_frame.get_data())
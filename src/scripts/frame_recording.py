@@ -0,0 +1,110 @@
+import os
+import json
+import threading
+import numpy as np
+
+# Row of the index of a recording: which chunk and slot hold the frame, and when it was captured
+INDEX_DTYPE = np.dtype([("timestamp", np.float64), ("sequence", np.int64), ("chunk", np.int32), ("offset", np.int32)])
+
+class FrameRecorder:
+    """
+    Record color and depth frames into a directory of memory-mapped NumPy chunks.
+
+    Every chunk file (color_00000.npy, depth_00000.npy, ...) holds up to chunk_size frames and is written through
+    np.lib.format.open_memmap, so a frame costs one copy into the page cache. index.npy lists the timestamp, sequence
+    number, chunk and offset of every frame and meta.json the shapes, both written by close(). Depth chunks are only
+    created when the frames have depth. depth_geometry (see DeviceCamera.depth_geometry) tells how the depth maps onto
+    the color frames and is stored in meta.json, so a replay can read distances the way the camera did.
+    """
+    def __init__(self, path, chunk_size = 300, depth_geometry = None):
+        self.path = path
+        self.depth_geometry = depth_geometry
+        self.chunk_size = chunk_size
+        self.index = []
+        self.chunk = -1
+        self.offset = chunk_size
+        self.color = None
+        self.depth = None
+        self.color_shape = None
+        self.depth_shape = None
+        self.lock = threading.Lock()
+        self.closed = False
+        os.makedirs(path, exist_ok=True)
+
+    def open_chunk(self, frame):
+        self.flush()
+        self.chunk += 1
+        self.offset = 0
+        self.color_shape = frame.color.shape
+        self.color = np.lib.format.open_memmap(os.path.join(self.path, f"color_{self.chunk:05d}.npy"), mode="w+", dtype=frame.color.dtype, shape=(self.chunk_size,) + frame.color.shape)
+        if frame.depth is not None:
+            self.depth_shape = frame.depth.shape
+            self.depth = np.lib.format.open_memmap(os.path.join(self.path, f"depth_{self.chunk:05d}.npy"), mode="w+", dtype=frame.depth.dtype, shape=(self.chunk_size,) + frame.depth.shape)
+
+    def write(self, frame):
+        with self.lock:
+            if self.closed:
+                return
+            if self.offset >= self.chunk_size:
+                self.open_chunk(frame)
+            self.color[self.offset] = frame.color
+            if self.depth is not None and frame.depth is not None:
+                self.depth[self.offset] = frame.depth
+            self.index.append((frame.timestamp, frame.sequence, self.chunk, self.offset))
+            self.offset += 1
+
+    def flush(self):
+        for chunk in (self.color, self.depth):
+            if chunk is not None:
+                chunk.flush()
+        self.color = None
+        self.depth = None
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+            self.flush()
+            np.save(os.path.join(self.path, "index.npy"), np.array(self.index, dtype=INDEX_DTYPE))
+            meta = {
+                "frames": len(self.index),
+                "chunk_size": self.chunk_size,
+                "chunks": self.chunk + 1,
+                "color_shape": list(self.color_shape) if self.color_shape else None,
+                "depth_shape": list(self.depth_shape) if self.depth_shape else None,
+                "depth_geometry": self.depth_geometry,
+            }
+            with open(os.path.join(self.path, "meta.json"), "w") as f:
+                json.dump(meta, f, indent=2)
+        print(f"Recorded {len(self.index)} frames to {self.path}")
+
+class FrameReader:
+    """
+    Random access to a recording made by FrameRecorder, reading the chunks as read-only memory maps.
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, "meta.json"), "r") as f:
+            self.meta = json.load(f)
+        self.index = np.load(os.path.join(path, "index.npy"))
+        self.has_depth = self.meta["depth_shape"] is not None
+        self.chunks = {}
+
+    def __len__(self):
+        return len(self.index)
+
+    def chunk(self, number):
+        if number not in self.chunks:
+            color = np.load(os.path.join(self.path, f"color_{number:05d}.npy"), mmap_mode="r")
+            depth = np.load(os.path.join(self.path, f"depth_{number:05d}.npy"), mmap_mode="r") if self.has_depth else None
+            self.chunks[number] = (color, depth)
+        return self.chunks[number]
+
+    def read(self, position):
+        """
+        Return (color, depth, timestamp) of the frame at position, the images are copied out of the memory map.
+        """
+        timestamp, sequence, chunk, offset = self.index[position]
+        color, depth = self.chunk(int(chunk))
+        return np.array(color[offset]), (np.array(depth[offset]) if depth is not None else None), float(timestamp)
@@ -0,0 +1,173 @@
+import os
+import json
+import time
+import cv2
+import numpy as np
+
+# OpenCV DNN backend and target for every engine name, looked up by name because older builds miss some of them
+OPENCV_BACKENDS = {
+    "cuda": ("DNN_BACKEND_CUDA", "DNN_TARGET_CUDA"),
+    "cuda_fp16": ("DNN_BACKEND_CUDA", "DNN_TARGET_CUDA_FP16"),
+    "openvino": ("DNN_BACKEND_INFERENCE_ENGINE", "DNN_TARGET_CPU"),
+    "vulkan": ("DNN_BACKEND_VKCOM", "DNN_TARGET_VULKAN"),
+    "cpu": ("DNN_BACKEND_OPENCV", "DNN_TARGET_CPU"),
+}
+
+# Probed in this order when the backend is "auto"
+DEFAULT_PROBE_ORDER = ["cuda", "cuda_fp16", "openvino", "vulkan", "cpu", "onnxruntime"]
+
+class OpenCVEngine:
+    """
+    Inference engine running a Darknet model with cv2.dnn on one backend and target.
+    """
+    def __init__(self, name, dnn_model, dnn_config):
+        backend_name, target_name = OPENCV_BACKENDS[name]
+        self.name = name
+        self.net = cv2.dnn.readNet(dnn_model, dnn_config)
+        self.net.setPreferableBackend(getattr(cv2.dnn, backend_name))
+        self.net.setPreferableTarget(getattr(cv2.dnn, target_name))
+        self.output_layers = list(self.net.getUnconnectedOutLayersNames())
+
+    def forward(self, blob):
+        self.net.setInput(blob)
+        return self.net.forward(self.output_layers)
+
+class OnnxRuntimeEngine:
+    """
+    Inference engine running an ONNX export of the model with onnxruntime on the CPU.
+
+    The export must keep the Darknet output layout, one row of [cx, cy, w, h, objectness, class scores ...] per anchor.
+    """
+    def __init__(self, onnx_model):
+        import onnxruntime
+        self.name = "onnxruntime"
+        self.net = None
+        self.session = onnxruntime.InferenceSession(onnx_model, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_layers = [output.name for output in self.session.get_outputs()]
+
+    def forward(self, blob):
+        outputs = self.session.run(self.output_layers, {self.input_name: blob})
+        return [output.reshape(-1, output.shape[-1]) for output in outputs]
+
+def is_available(name, onnx_model = None):
+    if name == "onnxruntime":
+        if onnx_model is None or not os.path.isfile(onnx_model):
+            return False
+        try:
+            import onnxruntime
+        except ImportError:
+            return False
+        return "CPUExecutionProvider" in onnxruntime.get_available_providers()
+
+    if name not in OPENCV_BACKENDS:
+        return False
+    backend_name, target_name = OPENCV_BACKENDS[name]
+    backend = getattr(cv2.dnn, backend_name, None)
+    target = getattr(cv2.dnn, target_name, None)
+    if backend is None or target is None:
+        return False
+
+    # Without this check OpenCV silently falls back to its slow default when the backend is not built in
+    try:
+        return target in cv2.dnn.getAvailableTargets(backend)
+    except cv2.error:
+        return False
+
+def create_engine(name, dnn_model, dnn_config, onnx_model = None):
+    if name == "onnxruntime":
+        return OnnxRuntimeEngine(onnx_model)
+    if name not in OPENCV_BACKENDS:
+        raise ValueError(f"Unknown inference backend '{name}', expected one of {DEFAULT_PROBE_ORDER}")
+    return OpenCVEngine(name, dnn_model, dnn_config)
+
+def parse_backends(backends):
+    if backends is None or backends == "auto":
+        return list(DEFAULT_PROBE_ORDER)
+    if isinstance(backends, str):
+        return [name.strip() for name in backends.split(",") if name.strip()]
+    return list(backends)
+
+def time_forward(engine, blob, warmup = 3):
+    # The first forward pays for the backend initialization, so it is not counted
+    engine.forward(blob)
+    timings = []
+    for _ in range(warmup):
+        start = time.perf_counter()
+        engine.forward(blob)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+def engine_cache_key(dnn_model, dnn_config, onnx_model, candidates, blob_size):
+    # The probe result stays valid as long as the model files, the OpenCV build and the candidates are the same
+    files = {}
+    for path in (dnn_model, dnn_config, onnx_model):
+        if path and os.path.isfile(path):
+            files[os.path.basename(path)] = [os.path.getsize(path), int(os.path.getmtime(path))]
+    return {"files": files, "opencv": cv2.__version__, "candidates": candidates, "blob_size": list(blob_size)}
+
+def load_cached_engine(cache_path, key):
+    try:
+        with open(cache_path, "r") as f:
+            cache = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if cache.get("key") != key:
+        return None
+    return cache.get("backend")
+
+def save_cached_engine(cache_path, key, engine):
+    try:
+        with open(cache_path, "w") as f:
+            json.dump({"key": key, "backend": engine.name, "latency_ms": engine.latency * 1000}, f, indent=2)
+    except OSError as e:
+        print(f"Could not write the inference backend cache {cache_path}: {e}")
+
+def select_engine(dnn_model, dnn_config, backends = "auto", onnx_model = None, blob_size = (320, 320), warmup = 3, cache_path = None):
+    """
+    Probe the available inference engines, time a warmup forward on each of them and return the fastest.
+
+    `backends` is "auto" to probe every engine in DEFAULT_PROBE_ORDER, or one name or a comma separated list of names
+    ("cuda", "cuda_fp16", "openvino", "vulkan", "cpu", "onnxruntime") to restrict the probe.
+    The returned engine has the `latency` of its timed forward in seconds.
+
+    With cache_path set, the name of the winner is stored there with the sizes and times of the model files, the OpenCV
+    version and the candidates. While they do not change, later calls only build that engine instead of probing them all.
+    """
+    candidates = [name for name in parse_backends(backends) if is_available(name, onnx_model)]
+    if not candidates:
+        print("No requested inference backend is available, falling back to OpenCV CPU")
+        candidates = ["cpu"]
+
+    blob = np.zeros((1, 3, blob_size[1], blob_size[0]), dtype=np.float32)
+
+    key = engine_cache_key(dnn_model, dnn_config, onnx_model, candidates, blob_size) if cache_path else None
+    cached = load_cached_engine(cache_path, key) if cache_path else None
+    if cached in candidates:
+        try:
+            engine = create_engine(cached, dnn_model, dnn_config, onnx_model)
+            engine.latency = time_forward(engine, blob, warmup)
+            print(f"Using cached inference backend {cached}: {engine.latency * 1000:.2f} ms per forward")
+            return engine
+        except Exception as e:
+            print(f"Cached inference backend {cached} failed, probing again: {e}")
+    best = None
+    for name in candidates:
+        try:
+            engine = create_engine(name, dnn_model, dnn_config, onnx_model)
+            engine.latency = time_forward(engine, blob, warmup)
+        except Exception as e:
+            print(f"Inference backend {name} failed: {e}")
+            continue
+
+        print(f"Inference backend {name}: {engine.latency * 1000:.2f} ms per forward")
+        if best is None or engine.latency < best.latency:
+            best = engine
+
+    if best is None:
+        raise RuntimeError(f"None of the inference backends {candidates} could run the model")
+
+    print(f"Using inference backend {best.name}")
+    if cache_path:
+        save_cached_engine(cache_path, key, best)
+    return best
@@ -0,0 +1,224 @@
+import sys
+import time
+import queue
+import threading
+import multiprocessing
+from multiprocessing import shared_memory
+import numpy as np
+
+try:
+    from scripts.stage_metrics import RollingHistogram
+except ImportError:
+    from stage_metrics import RollingHistogram
+
+def worker_main(worker_id, model, threads, warmup, slot_names, tasks, results):
+    # Runs in the worker process: its own DarknetDNN reading the frames straight from the shared memory slots
+    import cv2
+    try:
+        from scripts.darknet_yolo import DarknetDNN
+    except ImportError:
+        from darknet_yolo import DarknetDNN
+
+    cv2.setNumThreads(threads)
+    slots = [shared_memory.SharedMemory(name=name) for name in slot_names]
+    try:
+        start = time.time()
+        # The decoded arrays are pickled later by the queue feeder thread, so they must not be recycled detection buffers
+        net = DarknetDNN(**dict(model, preallocate=False))
+        if warmup:
+            net.warmup(warmup)
+        results.put(("ready", worker_id, time.time() - start))
+
+        while True:
+            task = tasks.get()
+            if task is None:
+                break
+            ticket, slot, shape, blob_size = task
+            started = time.time()
+            try:
+                image = np.ndarray(shape, dtype=np.uint8, buffer=slots[slot].buf)
+                output = net.forward_blob(net.preprocess(image, blob_size))
+                detections = net.decode(output, shape[1], shape[0])
+                results.put(("done", worker_id, ticket, slot, detections, None, started, time.time()))
+            except Exception as e:
+                results.put(("done", worker_id, ticket, slot, None, repr(e), started, time.time()))
+    finally:
+        for shm in slots:
+            shm.close()
+
+class hidden_main_path:
+    # Spawned children run the main script again unless it is imported by module name. ROS node scripts have no
+    # __main__ guard, so the path is hidden while the workers start and they only import this module.
+    def __enter__(self):
+        self.main = sys.modules["__main__"]
+        self.path = self.main.__dict__.pop("__file__", None)
+
+    def __exit__(self, *exc):
+        if self.path is not None:
+            self.main.__file__ = self.path
+        return False
+
+class WorkerStats:
+    def __init__(self, window):
+        self.frames = 0
+        self.errors = 0
+        self.load_time = None
+        self.latency = RollingHistogram(window)
+        self.wait = RollingHistogram(window)
+
+class InferencePool:
+    """
+    Run the detector in `workers` processes, each holding its own DarknetDNN built with the `model` keyword arguments.
+
+    submit() copies the frame into a free shared memory slot (blocking while all of them are in use) and queues only the
+    slot number, so the pixels are never pickled; it returns a ticket. The workers preprocess, forward and decode the
+    frame and send back the small detection arrays. get() returns the results in submission order: get(ticket) waits for
+    that ticket and discards the results of earlier tickets nobody asked for, so a consumer that skips frames stays in
+    order. Every worker runs OpenCV with `threads` threads, since for tiny models several single-threaded nets use the
+    cores better than one multi-threaded net.
+
+    warmup lists the blob sizes every worker runs DarknetDNN.warmup on before the pool is ready. stats() gives per worker
+    the frame count, the load time and the p50/p95 of the processing time and of the wait in the task queue.
+    """
+    def __init__(self, workers = 2, model = None, frame_shape = (480, 640, 3), slots = None, threads = 1, warmup = None, window = 300, start_timeout = 120.0):
+        self.context = multiprocessing.get_context("spawn")
+        self.frame_shape = tuple(frame_shape)
+        self.slot_bytes = int(np.prod(self.frame_shape))
+        self.shm = [shared_memory.SharedMemory(create=True, size=self.slot_bytes) for _ in range(slots or 2 * workers)]
+        self.free_slots = queue.Queue()
+        for slot in range(len(self.shm)):
+            self.free_slots.put(slot)
+
+        self.tasks = self.context.Queue()
+        self.results = self.context.Queue()
+        self.worker_stats = [WorkerStats(window) for _ in range(workers)]
+        self.processes = []
+        with hidden_main_path():
+            for worker_id in range(workers):
+                process = self.context.Process(target=worker_main, name=f"InferenceWorker-{worker_id}", daemon=True,
+                                               args=(worker_id, model or {}, threads, warmup, [shm.name for shm in self.shm], self.tasks, self.results))
+                process.start()
+                self.processes.append(process)
+
+        # Results waiting to be handed out in ticket order
+        self.condition = threading.Condition()
+        self.completed = {}
+        self.submitted = {}
+        self.next_ticket = 0
+        self.next_result = 0
+        self.skipped = 0
+        self.running = True
+
+        self.wait_ready(start_timeout)
+        self.collector = threading.Thread(target=self.collect, name="InferencePoolCollector", daemon=True)
+        self.collector.start()
+
+    def wait_ready(self, timeout):
+        deadline = time.time() + timeout
+        ready = 0
+        while ready < len(self.processes):
+            try:
+                message = self.results.get(timeout=max(0.1, deadline - time.time()))
+            except queue.Empty:
+                self.close()
+                raise RuntimeError(f"Only {ready} of {len(self.processes)} inference workers started within {timeout} s")
+            if message[0] == "ready":
+                self.worker_stats[message[1]].load_time = message[2]
+                ready += 1
+        print(f"Inference pool ready with {len(self.processes)} workers")
+
+    def submit(self, image, blob_size = (320, 320), timeout = None):
+        """
+        Queue an image for detection and return its ticket, or None when no slot got free within timeout.
+        """
+        if image.dtype != np.uint8 or image.size > self.slot_bytes:
+            raise ValueError(f"Frames must be uint8 and at most {self.frame_shape}, got {image.dtype} {image.shape}")
+        try:
+            slot = self.free_slots.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        np.copyto(np.ndarray(image.shape, dtype=np.uint8, buffer=self.shm[slot].buf), image)
+        with self.condition:
+            ticket = self.next_ticket
+            self.next_ticket += 1
+            self.submitted[ticket] = time.time()
+        self.tasks.put((ticket, slot, image.shape, tuple(blob_size)))
+        return ticket
+
+    def collect(self):
+        while self.running:
+            try:
+                message = self.results.get(timeout=0.1)
+            except queue.Empty:
+                continue
+            except (EOFError, OSError):
+                break
+            _, worker_id, ticket, slot, detections, error, started, finished = message
+            self.free_slots.put(slot)
+
+            stats = self.worker_stats[worker_id]
+            stats.frames += 1
+            stats.errors += error is not None
+            stats.latency.add(finished - started)
+            with self.condition:
+                stats.wait.add(max(0.0, started - self.submitted.pop(ticket, started)))
+                self.completed[ticket] = (detections, error)
+                self.condition.notify_all()
+
+    def get(self, ticket = None, timeout = None):
+        """
+        Return (ticket, detections) of the next result in submission order, or of `ticket` after discarding the earlier
+        ones. Returns None on timeout and raises RuntimeError when the worker failed on that frame.
+        """
+        with self.condition:
+            if ticket is not None:
+                # Results of the tickets before this one are no longer wanted
+                while self.next_result < ticket:
+                    if self.next_result in self.completed:
+                        del self.completed[self.next_result]
+                        self.skipped += 1
+                        self.next_result += 1
+                    elif not self.condition.wait(timeout):
+                        return None
+            if not self.condition.wait_for(lambda: self.next_result in self.completed or not self.running, timeout):
+                return None
+            if self.next_result not in self.completed:
+                return None
+            detections, error = self.completed.pop(self.next_result)
+            ticket = self.next_result
+            self.next_result += 1
+
+        if error is not None:
+            raise RuntimeError(f"Inference worker failed on frame {ticket}: {error}")
+        return ticket, detections
+
+    def stats(self):
+        stats = {}
+        for worker_id, worker in enumerate(self.worker_stats):
+            latency = worker.latency.summary()
+            wait = worker.wait.summary()
+            stats[f"worker{worker_id}"] = {
+                "frames": worker.frames,
+                "errors": worker.errors,
+                "load_s": worker.load_time,
+                "p50_ms": latency["p50_ms"],
+                "p95_ms": latency["p95_ms"],
+                "wait_p50_ms": wait["p50_ms"],
+                "wait_p95_ms": wait["p95_ms"],
+            }
+        return stats
+
+    def close(self):
+        self.running = False
+        with self.condition:
+            self.condition.notify_all()
+        for _ in self.processes:
+            self.tasks.put(None)
+        for process in self.processes:
+            process.join(timeout=5.0)
+            if process.is_alive():
+                process.terminate()
+        for shm in self.shm:
+            shm.close()
+            shm.unlink()
@@ -0,0 +1,71 @@
+import time
+
+class LatencyController:
+    """
+    Keep the end-to-end latency of every frame within a budget by switching the blob resolution.
+
+    observe() is fed the capture-to-output latency of every frame. Its exponential moving average is compared to the
+    budget: above it the next smaller blob size is used, below `low_ratio` of it the next larger one, each only after
+    `patience` frames in a row and never within `cooldown` frames of the last switch. should_skip() tells whether a frame
+    is already older than the budget before any work is spent on it.
+    """
+    def __init__(self, blob_sizes = (224, 320, 416), budget = 0.08, initial_size = 320, low_ratio = 0.6, patience = 10, cooldown = 30, smoothing = 0.1):
+        self.blob_sizes = sorted(blob_sizes)
+        self.budget = budget
+        self.low_ratio = low_ratio
+        self.patience = patience
+        self.cooldown = cooldown
+        self.smoothing = smoothing
+        self.index = min(range(len(self.blob_sizes)), key=lambda i: abs(self.blob_sizes[i] - initial_size))
+        self.latency = None
+        self.over = 0
+        self.under = 0
+        self.since_switch = 0
+        self.skipped = 0
+        self.switches = 0
+
+    @property
+    def blob_size(self):
+        size = self.blob_sizes[self.index]
+        return (size, size)
+
+    def should_skip(self, timestamp):
+        if time.time() - timestamp > self.budget:
+            self.skipped += 1
+            return True
+        return False
+
+    def observe(self, latency):
+        """
+        Record the latency in seconds of one frame. Return True when the blob size changed.
+        """
+        self.latency = latency if self.latency is None else self.latency + self.smoothing * (latency - self.latency)
+        self.since_switch += 1
+        self.over = self.over + 1 if self.latency > self.budget else 0
+        self.under = self.under + 1 if self.latency < self.low_ratio * self.budget else 0
+        if self.since_switch < self.cooldown:
+            return False
+
+        if self.over >= self.patience and self.index > 0:
+            self.index -= 1
+        elif self.under >= self.patience and self.index < len(self.blob_sizes) - 1:
+            self.index += 1
+        else:
+            return False
+
+        # Start measuring the new operating point from scratch
+        self.latency = None
+        self.over = 0
+        self.under = 0
+        self.since_switch = 0
+        self.switches += 1
+        return True
+
+    def operating_point(self):
+        return {
+            "blob_size": self.blob_sizes[self.index],
+            "latency_ms": 1000 * self.latency if self.latency is not None else 0.0,
+            "budget_ms": 1000 * self.budget,
+            "skipped_frames": self.skipped,
+            "switches": self.switches,
+        }
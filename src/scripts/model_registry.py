@@ -0,0 +1,183 @@
+"""
+Registry of the supported Darknet models, with their latency profiled on the current machine.
+
+Every entry of MODELS names its cfg, weights, class list and COCO accuracy. describe() reads the rest from the cfg: input
+size, and per YOLO output layer its stride, anchors and coordinate encoding. Both models come out of cv2.dnn with the
+same row layout, [cx, cy, w, h, objectness, class scores ...] normalized to the input, which decode_detections reads.
+Only how the boxes are encoded before that differs:
+  yolov3-tiny  2 output layers (stride 32, 16), logistic center offsets and exponential sizes
+  yolov7-tiny  3 output layers (stride 8, 16, 32), new_coords with scale_x_y 2 (squared sigmoid sizes)
+
+select_model() profiles every model whose weights are installed (cached per machine in ~/.cache/follower) and returns
+the most accurate one that fits a latency budget.
+
+Usage: python model_registry.py [--budget 0.1] [--size 320] [--backend auto]
+"""
+import os
+import json
+import time
+import argparse
+import platform
+from collections import namedtuple
+import cv2
+import numpy as np
+
+try:
+    from scripts.darknet_yolo import DarknetDNN, ROOT_DIR
+    from scripts.synthetic_weights import parse_cfg
+except ImportError:
+    from darknet_yolo import DarknetDNN, ROOT_DIR
+    from synthetic_weights import parse_cfg
+
+DEFAULT_CACHE = os.path.join(os.path.expanduser("~"), ".cache", "follower", "model_profiles.json")
+
+# Paths are relative to the scripts directory like the DarknetDNN defaults. map50 is the COCO mAP@0.5 published for the
+# model (Darknet yolov3-tiny at 416, YOLOv7 paper for yolov7-tiny), only used to rank the models.
+MODELS = {
+    "yolov3-tiny": {"cfg": "cfg/yolov3-tiny.cfg", "weights": "weights/yolov3-tiny.weights", "names": "coco.names", "map50": 33.1},
+    "yolov7-tiny": {"cfg": "cfg/yolov7-tiny.cfg", "weights": "weights/yolov7-tiny.weights", "names": "coco.names", "map50": 56.7},
+}
+
+ModelSpec = namedtuple("ModelSpec", ["name", "cfg", "weights", "names", "map50", "input_size", "classes", "outputs"])
+OutputLayer = namedtuple("OutputLayer", ["stride", "anchors", "new_coords", "scale_x_y"])
+
+def yolo_layers(cfg):
+    # Walk the layers keeping the stride of each, a [yolo] layer takes the stride of the layer before it
+    strides = []
+    stride = 1
+    layers = []
+    for name, options in parse_cfg(cfg)[1:]:
+        if name in ("convolutional", "maxpool"):
+            stride *= int(options.get("stride", 1))
+        elif name == "upsample":
+            stride //= int(options.get("stride", 2))
+        elif name == "route":
+            first = int(options["layers"].split(",")[0])
+            stride = strides[first if first >= 0 else len(strides) + first]
+        elif name == "yolo":
+            anchors = [int(value) for value in options["anchors"].replace(" ", "").split(",") if value]
+            anchors = list(zip(anchors[0::2], anchors[1::2]))
+            mask = [int(value) for value in options["mask"].split(",")]
+            layers.append(OutputLayer(stride, [anchors[i] for i in mask], options.get("new_coords", "0") == "1", float(options.get("scale_x_y", 1.0))))
+        strides.append(stride)
+    return layers
+
+def describe(name):
+    """
+    Return the ModelSpec of a registered model, with absolute paths and the layout read from its cfg.
+    """
+    if name not in MODELS:
+        raise ValueError(f"Unknown model '{name}', expected one of {list(MODELS)}")
+    entry = MODELS[name]
+    cfg = os.path.join(ROOT_DIR, entry["cfg"])
+    sections = parse_cfg(cfg)
+    net = sections[0][1]
+    classes = {int(options["classes"]) for section, options in sections if section == "yolo"}
+    return ModelSpec(name, cfg, os.path.join(ROOT_DIR, entry["weights"]), os.path.join(ROOT_DIR, entry["names"]), entry["map50"],
+                     (int(net["width"]), int(net["height"])), classes.pop(), yolo_layers(cfg))
+
+def available_models():
+    # The models whose weights are installed, the cfgs ship with the package
+    return [name for name in MODELS if os.path.isfile(describe(name).weights)]
+
+def profile_key(spec, backend, blob_size):
+    files = [spec.weights, spec.cfg]
+    return {
+        "model": spec.name,
+        "files": [[os.path.getsize(path), int(os.path.getmtime(path))] for path in files],
+        "backend": backend,
+        "blob_size": list(blob_size),
+        "host": platform.node(),
+        "opencv": cv2.__version__,
+    }
+
+def profile(spec, backend = "auto", blob_size = (320, 320), repeat = 10):
+    """
+    Load the model and return its backend and median forward latency in seconds at blob_size, after a warmup.
+    """
+    net = DarknetDNN(spec.weights, spec.cfg, backend, dnn_names=spec.names)
+    blob = np.zeros((1, 3, blob_size[1], blob_size[0]), dtype=np.float32)
+    net.forward_blob(blob)
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        net.forward_blob(blob)
+        timings.append(time.perf_counter() - start)
+    return {"backend": net.backend, "latency": float(np.median(timings))}
+
+def profiles(names = None, backend = "auto", blob_size = (320, 320), cache_path = DEFAULT_CACHE):
+    """
+    Return {model name: {"backend", "latency"}} for the given (default: installed) models. A model is only profiled
+    again when its files, the backend request, the blob size, the host or the OpenCV version changed.
+    """
+    cache = {}
+    if cache_path:
+        try:
+            with open(cache_path, "r") as f:
+                cache = json.load(f)
+        except (OSError, ValueError):
+            cache = {}
+
+    results = {}
+    changed = False
+    for name in available_models() if names is None else names:
+        spec = describe(name)
+        key = profile_key(spec, backend, blob_size)
+        cache_id = f"{name}@{blob_size[0]}x{blob_size[1]}/{backend}"
+        cached = cache.get(cache_id)
+        if cached is not None and cached.get("key") == key:
+            results[name] = cached["result"]
+            continue
+        print(f"Profiling {name} at {blob_size[0]}x{blob_size[1]}")
+        results[name] = profile(spec, backend, blob_size)
+        cache[cache_id] = {"key": key, "result": results[name]}
+        changed = True
+
+    if cache_path and changed:
+        try:
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+            with open(cache_path, "w") as f:
+                json.dump(cache, f, indent=2)
+        except OSError as e:
+            print(f"Could not write the model profile cache {cache_path}: {e}")
+    return results
+
+def select_model(budget, blob_size = (320, 320), backend = "auto", names = None, cache_path = DEFAULT_CACHE):
+    """
+    Return (ModelSpec, profiles) of the most accurate model whose forward latency fits within budget seconds, or of the
+    fastest model when none does.
+    """
+    results = profiles(names, backend, blob_size, cache_path)
+    if not results:
+        raise RuntimeError(f"No model weights installed, expected one of {[describe(name).weights for name in MODELS]}")
+    specs = {name: describe(name) for name in results}
+    fitting = [name for name in results if results[name]["latency"] <= budget]
+    if fitting:
+        best = max(fitting, key=lambda name: specs[name].map50)
+    else:
+        best = min(results, key=lambda name: results[name]["latency"])
+        print(f"No model fits within {budget * 1000:.0f} ms, using the fastest one")
+    return specs[best], results
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--budget", type=float, default=0.1, help="forward latency budget in seconds")
+    parser.add_argument("--size", type=int, default=320)
+    parser.add_argument("--backend", default="auto")
+    args = parser.parse_args()
+
+    for name in MODELS:
+        spec = describe(name)
+        installed = "installed" if os.path.isfile(spec.weights) else "no weights"
+        print(f"{name:<14}{installed:<12}input {spec.input_size[0]}x{spec.input_size[1]}  classes {spec.classes}  mAP50 {spec.map50}")
+        for layer in spec.outputs:
+            print(f"{'':<14}stride {layer.stride:<4}anchors {layer.anchors}  {'new_coords' if layer.new_coords else 'logistic'} scale_x_y {layer.scale_x_y}")
+
+    if available_models():
+        spec, results = select_model(args.budget, (args.size, args.size), args.backend)
+        for name, result in results.items():
+            print(f"{name:<14}{result['backend']:<12}{result['latency'] * 1000:.2f} ms")
+        print(f"Selected {spec.name} for a budget of {args.budget * 1000:.0f} ms")
+
+if __name__ == "__main__":
+    main()
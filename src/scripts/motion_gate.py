@@ -0,0 +1,71 @@
+import time
+import cv2
+import numpy as np
+
+class MotionGate:
+    """
+    Cheap scene change detector deciding whether a frame needs the detector at all.
+
+    Every frame is shrunk to `size` (INTER_AREA for the grayscale image, which also averages out the sensor noise, nearest
+    neighbour for depth) and compared with the reference, the frame of the last detection. A pixel changed when its gray
+    level moved by more than pixel_threshold, or its depth by more than depth_threshold in depth units (millimeters on
+    a Realsense) or between valid and invalid. The frame needs the detector when more than `threshold` of the pixels
+    changed, when no reference exists yet, or when the last detection is older than max_hold seconds.
+
+    Depth is used when given and use_depth is true, it ignores lighting changes such as the auto exposure. Comparing with
+    the reference instead of the previous frame also catches slow motion. skipped counts the forwards saved.
+    """
+    def __init__(self, threshold = 0.01, pixel_threshold = 12, depth_threshold = 50, max_hold = 1.0, size = (80, 60), use_depth = True):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.depth_threshold = depth_threshold
+        self.max_hold = max_hold
+        self.size = size
+        self.use_depth = use_depth
+        self.reference = None
+        self.reference_depth = False
+        self.reference_time = 0.0
+        self.score = 0.0
+        self.frames = 0
+        self.skipped = 0
+
+    def shrink(self, frame, depth):
+        if depth:
+            return cv2.resize(frame, self.size, interpolation=cv2.INTER_NEAREST)
+        small = cv2.resize(frame, self.size, interpolation=cv2.INTER_AREA)
+        return cv2.cvtColor(small, cv2.COLOR_BGR2GRAY) if small.ndim == 3 else small
+
+    def change(self, small, depth):
+        # Fraction of the pixels that changed since the reference
+        if not depth:
+            return np.count_nonzero(cv2.absdiff(small, self.reference) > self.pixel_threshold) / small.size
+        valid = small > 0
+        reference_valid = self.reference > 0
+        moved = np.abs(small.astype(np.int32) - self.reference) > self.depth_threshold
+        return np.count_nonzero((moved & valid & reference_valid) | (valid != reference_valid)) / small.size
+
+    def should_detect(self, frame, depth = None, timestamp = None):
+        """
+        Return true when the detector has to run on this frame, which then becomes the reference.
+        """
+        now = time.time() if timestamp is None else timestamp
+        self.frames += 1
+        use_depth = depth is not None and self.use_depth
+        small = self.shrink(depth if use_depth else frame, use_depth)
+
+        if self.reference is None or self.reference_depth != use_depth or now - self.reference_time >= self.max_hold:
+            detect = True
+        else:
+            self.score = float(self.change(small, use_depth))
+            detect = self.score > self.threshold
+
+        if detect:
+            self.reference = small
+            self.reference_depth = use_depth
+            self.reference_time = now
+        else:
+            self.skipped += 1
+        return detect
+
+    def stats(self):
+        return {"frames": self.frames, "skipped": self.skipped, "last_score": self.score}
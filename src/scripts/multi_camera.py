@@ -0,0 +1,54 @@
+try:
+    from scripts.yolo_decoder import position_names, command_for
+except ImportError:
+    from yolo_decoder import position_names, command_for
+
+class MultiCameraDetector:
+    """
+    Run one DarknetDNN on several DeviceCamera instances with a single batched forward per round.
+
+    get_frames() takes the newest frame of every camera and, when their capture times are more than max_skew seconds
+    apart, grabs the oldest ones again so the batch shows the same moment. Cameras should be created with threaded=True
+    so grabbing never waits for a queued frame. detect() splits the detections back per camera, and every camera gets its
+    own Left/Center/Right command.
+    """
+    def __init__(self, net, cameras, names = None, max_skew = 0.05, max_regrabs = 3):
+        self.net = net
+        self.cameras = cameras
+        self.names = names if names is not None else [f"camera_{index}" for index in range(len(cameras))]
+        self.max_skew = max_skew
+        self.max_regrabs = max_regrabs
+        self.unsynced_rounds = 0
+
+    def get_frames(self):
+        frames = [camera.get_frame_stamped() for camera in self.cameras]
+        if any(frame.color is None for frame in frames):
+            return None
+
+        for _ in range(self.max_regrabs):
+            timestamps = [frame.timestamp for frame in frames]
+            if max(timestamps) - min(timestamps) <= self.max_skew:
+                return frames
+            oldest = timestamps.index(min(timestamps))
+            frame = self.cameras[oldest].get_frame_stamped()
+            if frame.color is None:
+                return None
+            frames[oldest] = frame
+
+        self.unsynced_rounds += 1
+        return frames
+
+    def detect(self, frames):
+        """
+        Return a dict of camera name to (detections, command) for one synchronized round of frames.
+        """
+        detections = self.net.detect_batch([frame.color for frame in frames])
+        return {name: (camera_detections, command_for(camera_detections)) for name, camera_detections in zip(self.names, detections)}
+
+    def stop(self):
+        for camera in self.cameras:
+            camera.stop()
+
+def describe(results):
+    # One line summary of the command and detections of every camera
+    return ", ".join(f"{name}: {command} ({len(detections)} persons, {position_names(detections['position'])})" for name, (detections, command) in results.items())
@@ -0,0 +1,227 @@
+import time
+import threading
+from collections import deque
+
+class Job:
+    """
+    One unit of work flowing through the Pipeline, usually one camera frame.
+
+    Stages attach their results as attributes (frame, blob, output, ...). The timestamp is the capture time used by the
+    max_age policy.
+    """
+    def __init__(self, sequence, timestamp = None, **fields):
+        self.sequence = sequence
+        self.timestamp = time.time() if timestamp is None else timestamp
+        self.__dict__.update(fields)
+
+    def age(self):
+        return time.time() - self.timestamp
+
+class LatestQueue:
+    """
+    Bounded queue between two stages that never blocks the producer.
+
+    When the queue is full the oldest job is discarded, so the consumer always gets the freshest work. With block set,
+    put waits for a free place instead, so no job is ever lost.
+    """
+    def __init__(self, maxsize = 1, block = False):
+        self.maxsize = maxsize
+        self.block = block
+        self.items = deque()
+        self.condition = threading.Condition()
+        self.dropped = 0
+
+    def put(self, item, timeout = None):
+        # Returns false when a blocking queue stayed full for timeout seconds, the item is then not queued
+        with self.condition:
+            if self.block and not self.condition.wait_for(lambda: len(self.items) < self.maxsize, timeout):
+                return False
+            if len(self.items) >= self.maxsize:
+                self.items.popleft()
+                self.dropped += 1
+            self.items.append(item)
+            self.condition.notify_all()
+            return True
+
+    def get(self, timeout = None):
+        with self.condition:
+            self.condition.wait_for(lambda: self.items, timeout)
+            if not self.items:
+                return None
+            item = self.items.popleft()
+            self.condition.notify_all()
+            return item
+
+    def empty(self):
+        with self.condition:
+            return not self.items
+
+class Stage:
+    def __init__(self, name, function):
+        self.name = name
+        self.function = function
+        self.processed = 0
+        self.stale = 0
+        self.busy_time = 0.0
+
+    def process(self, *job):
+        # The source stage is called without a job
+        start = time.perf_counter()
+        job = self.function(*job)
+        self.busy_time += time.perf_counter() - start
+        self.processed += 1
+        return job
+
+class Pipeline:
+    """
+    Run a chain of stages, each on its own thread, connected by bounded LatestQueues.
+
+    The first stage is the source, it is called without argument and returns a new Job (or None to skip). Every next stage
+    receives a Job and returns it (or None to drop it). While a stage works on frame N, the stage before it already works
+    on frame N+1, so the throughput approaches the speed of the slowest stage.
+
+    Stale work is dropped in two places: a full queue discards its oldest job, and a stage skips any job older than
+    max_age seconds (when set) before processing it. queue_size is one size for every queue or a list with the size of
+    the queue in front of every stage after the source. With lossless set, nothing is dropped: a full queue blocks the
+    stage before it and max_age is ignored, so every job of the source reaches the end, e.g. for an offline replay.
+
+    finish() ends the source and lets the stages complete the jobs already queued before the pipeline stops, stop()
+    abandons them.
+
+    stop_condition, when set, is called by every stage after each wait for work, so at least every 0.1 s even when no
+    frame comes (and once per frame by run_inline). The pipeline stops when it returns true, e.g. rospy.is_shutdown.
+    """
+    def __init__(self, stages, queue_size = 1, max_age = None, stop_condition = None, lossless = False):
+        self.stages = [Stage(name, function) for name, function in stages]
+        sizes = queue_size if isinstance(queue_size, (list, tuple)) else [queue_size] * (len(self.stages) - 1)
+        self.queues = [LatestQueue(size, block=lossless) for size in sizes]
+        self.max_age = None if lossless else max_age
+        self.stop_condition = stop_condition
+        self.running = threading.Event()
+        self.finishing = threading.Event()
+        # Set when the thread of a stage has passed on its last job
+        self.done = [threading.Event() for _ in self.stages]
+        self.threads = []
+        self.error = None
+
+    def is_stale(self, stage, job):
+        if self.max_age is not None and job.age() > self.max_age:
+            stage.stale += 1
+            return True
+        return False
+
+    def check_stop(self):
+        if self.stop_condition is not None and self.stop_condition():
+            self.stop()
+
+    def forward(self, queue, job):
+        # A blocking queue is retried until it has room or the pipeline stops
+        while not queue.put(job, timeout=0.1):
+            self.check_stop()
+            if not self.running.is_set():
+                return
+
+    def source_loop(self):
+        stage = self.stages[0]
+        try:
+            while self.running.is_set() and not self.finishing.is_set():
+                job = self.guard(stage.process)
+                if job is not None:
+                    self.forward(self.queues[0], job)
+        finally:
+            self.done[0].set()
+
+    def stage_loop(self, index):
+        stage = self.stages[index]
+        inbox = self.queues[index - 1]
+        outbox = self.queues[index] if index < len(self.queues) else None
+        try:
+            while self.running.is_set():
+                job = inbox.get(timeout=0.1)
+                self.check_stop()
+                if job is None:
+                    # Finished once the stage before it is done and nothing is left in between
+                    if self.done[index - 1].is_set() and inbox.empty():
+                        break
+                    continue
+                if self.is_stale(stage, job) or not self.running.is_set():
+                    continue
+                job = self.guard(stage.process, job)
+                if job is not None and outbox is not None:
+                    self.forward(outbox, job)
+        finally:
+            self.done[index].set()
+
+    def guard(self, function, *args):
+        # Stop the whole pipeline on the first error, join() raises it again
+        try:
+            return function(*args)
+        except Exception as e:
+            self.error = e
+            self.stop()
+            return None
+
+    def start(self, include_last = True):
+        self.running.set()
+        self.finishing.clear()
+        for done in self.done:
+            done.clear()
+        self.threads = [threading.Thread(target=self.source_loop, name=f"Pipeline-{self.stages[0].name}", daemon=True)]
+        last = len(self.stages) if include_last else len(self.stages) - 1
+        for index in range(1, last):
+            self.threads.append(threading.Thread(target=self.stage_loop, args=(index,), name=f"Pipeline-{self.stages[index].name}", daemon=True))
+        for thread in self.threads:
+            thread.start()
+
+    def run(self):
+        """
+        Run the last stage on the calling thread, which keeps GUI calls such as cv2.imshow on the main thread.
+        """
+        self.start(include_last=False)
+        self.stage_loop(len(self.stages) - 1)
+        self.join()
+
+    def run_inline(self):
+        """
+        Run every stage one after another on the calling thread, the sequential reference behaviour.
+        """
+        self.running.set()
+        self.finishing.clear()
+        while self.running.is_set() and not self.finishing.is_set():
+            self.check_stop()
+            job = self.guard(self.stages[0].process)
+            for stage in self.stages[1:]:
+                if job is None or self.is_stale(stage, job):
+                    break
+                job = self.guard(stage.process, job)
+        self.join()
+
+    def finish(self):
+        # The source makes no more jobs, the stages complete the queued ones and return
+        self.finishing.set()
+
+    def stop(self):
+        self.running.clear()
+
+    def join(self):
+        current = threading.current_thread()
+        for thread in self.threads:
+            if thread is not current:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def stats(self):
+        """
+        Return processed, stale, dropped and mean time in ms per stage. dropped counts the jobs a full queue discarded
+        before the stage could take them.
+        """
+        stats = {}
+        for index, stage in enumerate(self.stages):
+            stats[stage.name] = {
+                "processed": stage.processed,
+                "stale": stage.stale,
+                "dropped": self.queues[index - 1].dropped if index > 0 else 0,
+                "mean_ms": 1000 * stage.busy_time / stage.processed if stage.processed else 0.0,
+            }
+        return stats
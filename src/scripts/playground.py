@@ -30,13 +30,13 @@ while True:
     #    break
 
     # Detect the human from the frame
-    bbox, confidences, positions = net.detect_human(frame)
-    areas = net.check_color(frame, bbox, lower_hsv, upper_hsv)
+    detections = net.detect(frame)
+    areas = net.check_color(frame, detections["box"], lower_hsv, upper_hsv)
     #areas = []
     
     # Draw the bounding box of the object detected
-    net.draw_human_info(frame, bbox, confidences, positions, areas)
-    net.hunt(frame, depth, bbox, confidences, positions, areas)
+    net.draw_human_info(frame, detections, areas)
+    net.hunt(frame, depth, detections, areas, camera.box_distances(depth, detections["box"]))
 
     frame = camera.show_fps(frame)
 
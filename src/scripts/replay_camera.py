@@ -0,0 +1,96 @@
+import time
+
+try:
+    from scripts.device_camera import DeviceCamera
+    from scripts.frame_recording import FrameReader
+    from scripts.stage_metrics import DISABLED_METRICS
+    from scripts.depth_lookup import DepthProjector
+except ImportError:
+    from device_camera import DeviceCamera
+    from frame_recording import FrameReader
+    from stage_metrics import DISABLED_METRICS
+    from depth_lookup import DepthProjector
+
+class ReplayCamera(DeviceCamera):
+    """
+    Replay a recording made with DeviceCamera.start_recording behind the same get_frame interface.
+
+    With realtime set to true the frames are delivered at the recorded rate, otherwise as fast as they are asked for, so
+    the detector and the whole node can be benchmarked without a camera. A replay that is not realtime always runs
+    without the capture thread, which would drop frames at random, so every run processes every frame exactly once.
+    When the recording ends, finished is set and get_frame returns None frames, unless loop is true.
+
+    The distances are read like on the recording camera, through the same DepthProjector for raw depth, from the depth
+    geometry in meta.json. Recordings with depth but without that geometry raise a RuntimeError.
+    """
+    def __init__(self, path, realtime = True, loop = False, threaded = False, buffer_size = 2, metrics = None):
+        print("Loading replay from", path)
+        self.reader = FrameReader(path)
+        self.realtime = realtime
+        self.loop = loop
+        self.position = 0
+        self.replay_start = None
+        self.recorded_start = None
+        self.metrics = DISABLED_METRICS if metrics is None else metrics
+        if threaded and not realtime:
+            print("Replay is not realtime, reading the frames on demand instead of from a capture thread")
+            threaded = False
+
+        # Camera parameters of DeviceCamera that a replay does not use
+        self.realsense, self.rs = False, None
+        self.device_id = path
+        self.capture = None
+        self.pipeline = None
+        self.winname = "Replay"
+        self.depth_filters = None
+        self.depth_filter_chain = None
+
+        # Read the distances like the recording camera did
+        geometry = self.reader.meta.get("depth_geometry")
+        if geometry is None and self.reader.has_depth:
+            raise RuntimeError(f"The recording {path} has depth but no depth geometry in its meta.json, "
+                               "so its distances can't be trusted, record it again")
+        self.align_depth = geometry is None or geometry["align_depth"]
+        self.depth_projector = None if self.align_depth else DepthProjector.from_meta(geometry)
+        self.depth_scale = geometry["depth_scale"] if geometry is not None else 0.001
+        self.capture_profile = None
+        self.negotiated_profile = None
+
+        self.init_overlay()
+        self.init_buffers(threaded, buffer_size)
+
+        if self.threaded:
+            self.start_capture_thread()
+
+    def read_frame(self):
+        if self.position >= len(self.reader):
+            if not self.loop:
+                self.finished = True
+                return None, None
+            self.position = 0
+            self.replay_start = None
+
+        # The capture time of a replay is the read from the recording, the pacing below is not counted
+        with self.metrics.timer("capture"):
+            color, depth, timestamp = self.reader.read(self.position)
+        self.position += 1
+
+        # Wait until the frame is due at the recorded rate
+        if self.realtime:
+            if self.replay_start is None:
+                self.replay_start = time.time()
+                self.recorded_start = timestamp
+            delay = (timestamp - self.recorded_start) - (time.time() - self.replay_start)
+            if delay > 0:
+                time.sleep(delay)
+        return color, depth
+
+    def depth_geometry(self):
+        return self.reader.meta.get("depth_geometry")
+
+    def frame_shape(self):
+        return tuple(self.reader.meta["color_shape"])
+
+    def stop(self):
+        self.stop_capture_thread()
+        self.stop_recording()
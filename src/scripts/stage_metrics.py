@@ -0,0 +1,115 @@
+import time
+import threading
+import numpy as np
+
+# Upper edges of the latency histogram buckets in ms, the last bucket counts everything above the last edge
+HISTOGRAM_EDGES_MS = (1, 2, 5, 10, 20, 33, 50, 100, 200, 500, 1000)
+
+# Order in which the stages are reported, stages not listed here follow in the order they were first recorded
+STAGE_ORDER = ["capture", "depth_filter", "align", "preprocess", "forward", "decode", "nms", "color_check", "distance", "publish", "frame_age"]
+
+class RollingHistogram:
+    """
+    The last `window` samples of one duration in seconds, kept in a ring buffer and summarized on demand.
+    """
+    def __init__(self, window = 300):
+        self.samples = np.zeros(window, dtype=np.float64)
+        self.count = 0
+        self.lock = threading.Lock()
+
+    def add(self, seconds):
+        with self.lock:
+            self.samples[self.count % len(self.samples)] = seconds
+            self.count += 1
+
+    def values(self):
+        with self.lock:
+            return self.samples[:min(self.count, len(self.samples))].copy()
+
+    def summary(self, edges = HISTOGRAM_EDGES_MS):
+        """
+        Return count (since the start), mean, p50, p95, p99 and max in ms over the window, and the bucket counts of the
+        window for the upper edges in `edges` plus one overflow bucket.
+        """
+        values = self.values() * 1000
+        buckets = np.bincount(np.searchsorted(edges, values, side="left"), minlength=len(edges) + 1)
+        if len(values) == 0:
+            return {"count": self.count, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0, "histogram": buckets.tolist()}
+        p50, p95, p99 = np.percentile(values, (50, 95, 99))
+        return {
+            "count": self.count,
+            "mean_ms": float(values.mean()),
+            "p50_ms": float(p50),
+            "p95_ms": float(p95),
+            "p99_ms": float(p99),
+            "max_ms": float(values.max()),
+            "histogram": buckets.tolist(),
+        }
+
+class StageTimer:
+    # Context manager adding the time spent in its block to a histogram
+    __slots__ = ("histogram", "start")
+
+    def __init__(self, histogram):
+        self.histogram = histogram
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.add(time.perf_counter() - self.start)
+        return False
+
+class NullTimer:
+    # Shared do-nothing timer handed out while the metrics are disabled
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+NULL_TIMER = NullTimer()
+
+class StageMetrics:
+    """
+    Named latency histograms fed from any thread, e.g. `with metrics.timer("forward"): ...` or
+    metrics.record("frame_age", seconds).
+
+    When disabled, timer() returns a shared no-op context manager and record() returns at once, so the instrumented code
+    pays one attribute lookup and call per stage.
+    """
+    def __init__(self, enabled = True, window = 300):
+        self.enabled = enabled
+        self.window = window
+        self.histograms = {}
+        self.lock = threading.Lock()
+
+    def histogram(self, name):
+        histogram = self.histograms.get(name)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(name, RollingHistogram(self.window))
+        return histogram
+
+    def timer(self, name):
+        if not self.enabled:
+            return NULL_TIMER
+        return StageTimer(self.histogram(name))
+
+    def record(self, name, seconds):
+        if self.enabled:
+            self.histogram(name).add(seconds)
+
+    def summary(self):
+        """
+        Return {stage: RollingHistogram.summary()} for every recorded stage, in STAGE_ORDER.
+        """
+        names = list(self.histograms)
+        names.sort(key=lambda name: STAGE_ORDER.index(name) if name in STAGE_ORDER else len(STAGE_ORDER))
+        return {name: self.histograms[name].summary() for name in names}
+
+# Default of the instrumented classes, so they never need to check for None
+DISABLED_METRICS = StageMetrics(enabled=False)
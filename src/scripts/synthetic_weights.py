@@ -0,0 +1,89 @@
+"""
+Random Darknet weights matching a .cfg file, so the model can be loaded and run without the trained weights.
+
+The weights file is the Darknet format read by cv2.dnn.readNet: a header of major, minor and revision as int32 and the
+number of seen images as int64, then for every convolutional layer its biases (with batch normalization: biases, scales,
+rolling mean and rolling variance) followed by the kernel, all float32. The kernels are drawn with a He normal
+initialization and the batch normalization is the identity, so the activations stay finite through deep models.
+
+Usage: python synthetic_weights.py cfg/yolov3-tiny.cfg yolov3-tiny.weights [--seed 0]
+"""
+import argparse
+import numpy as np
+
+def parse_cfg(path):
+    # List of (section name, options) in file order, the options are kept as strings
+    sections = []
+    with open(path, "r") as f:
+        for line in f:
+            line = line.split("#", 1)[0].strip()
+            if not line:
+                continue
+            if line.startswith("["):
+                sections.append((line.strip("[]").strip(), {}))
+            elif "=" in line and sections:
+                key, value = line.split("=", 1)
+                sections[-1][1][key.strip()] = value.strip()
+    return sections
+
+def convolution_shapes(cfg):
+    """
+    Return (filters, input channels per group, size, batch_normalize) of every convolutional layer of a .cfg file.
+    """
+    sections = parse_cfg(cfg)
+    net = sections[0][1] if sections and sections[0][0] in ("net", "network") else {}
+    channels = int(net.get("channels", 3))
+
+    shapes = []
+    # Output channels of every layer, indexed like the layers of the cfg (the [net] section is not a layer)
+    outputs = []
+    for name, options in sections[1:]:
+        if name in ("convolutional", "conv"):
+            filters = int(options["filters"])
+            groups = int(options.get("groups", 1))
+            size = int(options.get("size", 1))
+            shapes.append((filters, channels // groups, size, int(options.get("batch_normalize", 0)) == 1))
+            channels = filters
+        elif name == "route":
+            layers = [int(layer) for layer in options["layers"].split(",")]
+            layers = [layer if layer >= 0 else len(outputs) + layer for layer in layers]
+            channels = sum(outputs[layer] for layer in layers) // int(options.get("groups", 1))
+        elif name not in ("maxpool", "upsample", "yolo", "region", "shortcut", "dropout", "avgpool", "reorg"):
+            raise ValueError(f"Layer [{name}] of {cfg} is not supported")
+        outputs.append(channels)
+    return shapes
+
+def weight_count(cfg):
+    count = 0
+    for filters, channels, size, batch_normalize in convolution_shapes(cfg):
+        count += filters * (4 if batch_normalize else 1) + filters * channels * size * size
+    return count
+
+def write_random_weights(cfg, path, seed = 0):
+    rng = np.random.default_rng(seed)
+    with open(path, "wb") as f:
+        np.array([0, 2, 0], dtype=np.int32).tofile(f)
+        np.array([0], dtype=np.int64).tofile(f)
+        for filters, channels, size, batch_normalize in convolution_shapes(cfg):
+            fan_in = channels * size * size
+            np.zeros(filters, dtype=np.float32).tofile(f)
+            if batch_normalize:
+                np.ones(filters, dtype=np.float32).tofile(f)
+                np.zeros(filters, dtype=np.float32).tofile(f)
+                np.ones(filters, dtype=np.float32).tofile(f)
+            kernel = rng.normal(0, np.sqrt(2.0 / fan_in), filters * fan_in)
+            kernel.astype(np.float32).tofile(f)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("cfg")
+    parser.add_argument("weights")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    write_random_weights(args.cfg, args.weights, args.seed)
+    print(f"Wrote {weight_count(args.cfg)} random weights for {args.cfg} to {args.weights}")
+
+if __name__ == "__main__":
+    main()
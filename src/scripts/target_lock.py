@@ -0,0 +1,119 @@
+import numpy as np
+
+try:
+    from scripts.yolo_decoder import bin_positions
+    from scripts.tracker import iou_matrix
+except ImportError:
+    from yolo_decoder import bin_positions
+    from tracker import iou_matrix
+
+class TargetLock:
+    """
+    Run the detector only on a region around the followed person once a target is chosen.
+
+    The region is the last target box expanded by `expand`, made square like the blob so the person is not distorted,
+    and fed to the net with the smaller `blob_size`. plan() returns None, meaning a full-frame search, when there is no
+    target, after `max_misses` region passes without a detection, or every `search_interval` frames.
+    """
+    def __init__(self, expand = 2.0, blob_size = (224, 224), search_interval = 30, max_misses = 3):
+        self.expand = expand
+        self.blob_size = tuple(blob_size)
+        self.search_interval = search_interval
+        self.max_misses = max_misses
+        self.target = None
+        self.misses = 0
+        self.frames_since_search = 0
+        self.roi_frames = 0
+        self.full_frames = 0
+
+    def lock(self, box):
+        self.target = tuple(int(v) for v in box)
+        self.misses = 0
+
+    def unlock(self):
+        self.target = None
+        self.misses = 0
+
+    def plan(self, frame_shape):
+        """
+        Return the (x1, y1, x2, y2) region to run the detector on for the next frame, or None for the full frame.
+        """
+        target = self.target
+        if target is None or self.frames_since_search >= self.search_interval:
+            self.frames_since_search = 0
+            self.full_frames += 1
+            return None
+
+        self.frames_since_search += 1
+        self.roi_frames += 1
+        height, width = frame_shape[:2]
+        x1, y1, x2, y2 = target
+        side = int(max(x2 - x1, y2 - y1) * self.expand)
+        side = min(max(side, min(self.blob_size)), width, height)
+
+        # Center the region on the target and shift it back inside the frame
+        rx1 = min(max((x1 + x2) // 2 - side // 2, 0), width - side)
+        ry1 = min(max((y1 + y2) // 2 - side // 2, 0), height - side)
+        return rx1, ry1, rx1 + side, ry1 + side
+
+    @staticmethod
+    def crop(frame, roi):
+        if roi is None:
+            return frame
+        x1, y1, x2, y2 = roi
+        return frame[y1:y2, x1:x2]
+
+    @staticmethod
+    def to_frame(detections, roi, width):
+        """
+        Map detections decoded on the region back to frame coordinates and bin their position on the full frame width.
+        """
+        if roi is None:
+            return detections
+        boxes, confidences, positions, areas = detections
+        boxes = boxes + np.array([roi[0], roi[1], roi[0], roi[1]], dtype=np.int32)
+        positions = bin_positions((boxes[:, 0] + boxes[:, 2]) / 2, width)
+        return boxes, confidences, positions, areas
+
+    def update(self, boxes, roi = None, target_index = None):
+        """
+        Follow the target with the detections of the last frame.
+
+        target_index picks the new target explicitly (for example the box chosen by hunt), otherwise the detection that
+        overlaps the current target the most is kept.
+        """
+        if target_index is not None:
+            self.lock(boxes[target_index])
+            return
+
+        if len(boxes) == 0:
+            if self.target is not None and roi is not None:
+                self.misses += 1
+                if self.misses >= self.max_misses:
+                    self.unlock()
+            return
+
+        if self.target is None:
+            return
+
+        overlap = iou_matrix([self.target], boxes)[0]
+        best = int(np.argmax(overlap))
+        if overlap[best] > 0:
+            self.lock(boxes[best])
+        elif roi is not None:
+            self.misses += 1
+            if self.misses >= self.max_misses:
+                self.unlock()
+
+    def detect(self, net, image):
+        """
+        Run one detection of a DarknetDNN with the lock, returning the decode_detections layout in frame coordinates.
+        """
+        height, width = image.shape[:2]
+        roi = self.plan(image.shape)
+        crop = self.crop(image, roi)
+        blob = net.preprocess(crop, self.blob_size if roi is not None else None)
+        output = net.forward_blob(blob)
+        detections = self.to_frame(net.decode(output, crop.shape[1], crop.shape[0]), roi, width)
+        self.update(detections[0], roi)
+        return detections
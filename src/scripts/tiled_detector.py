@@ -0,0 +1,150 @@
+import time
+import cv2
+import numpy as np
+
+try:
+    from scripts.yolo_decoder import decode_detections, bin_positions, empty_detections, to_structured
+    from scripts.stage_metrics import DISABLED_METRICS
+except ImportError:
+    from yolo_decoder import decode_detections, bin_positions, empty_detections, to_structured
+    from stage_metrics import DISABLED_METRICS
+
+def tile_starts(length, tile, overlap):
+    # Evenly spaced offsets of the tiles along one axis, neighbours overlapping by at least `overlap` of a tile
+    if length <= tile:
+        return [0]
+    count = int(np.ceil((length - tile) / (tile * (1 - overlap)))) + 1
+    return np.linspace(0, length - tile, count).round().astype(int).tolist()
+
+def tile_grid(width, height, tile_size, overlap = 0.2):
+    """
+    Return the (x, y, w, h) tiles of tile_size pixels covering a width x height frame, the tiles are clipped to the frame.
+    """
+    tile_width = min(tile_size[0], width)
+    tile_height = min(tile_size[1], height)
+    return [(x, y, tile_width, tile_height) for y in tile_starts(height, tile_height, overlap) for x in tile_starts(width, tile_width, overlap)]
+
+def merge_detections(boxes, confidences, cut, nms_threshold = 0.4, containment = 0.6):
+    """
+    Return the indexes of the boxes to keep from the detections of overlapping tiles, in the frame coordinates.
+
+    The boxes are kept greedily, whole boxes first and then by confidence. A box is dropped when its IoU with a kept box
+    is above nms_threshold, like Non-Maximum Suppression. A box cut by a tile seam (cut true) only covers part of the
+    person, so its IoU with the whole box from the neighbouring tile stays low; it is also dropped when more than
+    `containment` of its area lies inside a kept box.
+    """
+    boxes = boxes.astype(np.float32)
+    areas = np.maximum((boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1]), 1.0)
+    keep = []
+    for i in np.lexsort((-confidences, cut)):
+        if keep:
+            kept = boxes[keep]
+            w = np.clip(np.minimum(kept[:, 2], boxes[i, 2]) - np.maximum(kept[:, 0], boxes[i, 0]), 0, None)
+            h = np.clip(np.minimum(kept[:, 3], boxes[i, 3]) - np.maximum(kept[:, 1], boxes[i, 1]), 0, None)
+            intersection = w * h
+            if (intersection / (areas[keep] + areas[i] - intersection)).max() > nms_threshold:
+                continue
+            if cut[i] and intersection.max() / areas[i] > containment:
+                continue
+        keep.append(i)
+    return np.asarray(keep, dtype=np.int64)
+
+class TiledDetector:
+    """
+    Detect small, distant people by running the DarknetDNN on overlapping tiles of the frame instead of on the whole frame
+    shrunk to one blob.
+
+    The frame is split into tiles of tile_size pixels overlapping by `overlap`, and every tile is resized to blob_size
+    (by default the tile size, so the detector sees the native resolution). With full_frame, the whole frame is added as
+    one more image for the large, nearby people that no tile holds entirely. All of them go through one blobFromImages
+    batch and one forward, so the cost is known from the frame size: len(tiles) + 1 images per frame. The detections of
+    every image are mapped back to the frame and merged across the seams with merge_detections.
+
+    preprocess, DarknetDNN.forward_blob and decode split detect into the stages of the pipeline, decode returns the same
+    (boxes, confidences, positions, areas) arrays as decode_detections.
+    """
+    def __init__(self, net, tile_size = (320, 320), overlap = 0.2, full_frame = True, blob_size = None, containment = 0.6):
+        self.net = net
+        self.tile_size = tuple(tile_size)
+        self.overlap = overlap
+        self.full_frame = full_frame
+        self.blob_size = self.tile_size if blob_size is None else tuple(blob_size)
+        self.containment = containment
+        self.layouts = {}
+
+    def layout(self, width, height):
+        # The tiles only depend on the frame size
+        key = (width, height)
+        if key not in self.layouts:
+            tiles = tile_grid(width, height, self.tile_size, self.overlap)
+            if self.full_frame and tiles != [(0, 0, width, height)]:
+                tiles.append((0, 0, width, height))
+            self.layouts[key] = tiles
+        return self.layouts[key]
+
+    def preprocess(self, image):
+        """
+        Return (blob, tiles): the batch blob of every tile of the image and the (x, y, w, h) tiles in the batch order.
+        """
+        height, width = image.shape[:2]
+        tiles = self.layout(width, height)
+        net = self.net
+        with net.metrics.timer("preprocess"):
+            blob = cv2.dnn.blobFromImages([image[y:y + h, x:x + w] for x, y, w, h in tiles], net.blob_scalefactor, self.blob_size,
+                                          net.blob_scalar, net.blob_swapRB, net.blob_crop, net.blob_ddepth)
+        return blob, tiles
+
+    def decode(self, output, tiles, width, height):
+        net = self.net
+        with net.metrics.timer("decode"):
+            # Batched outputs are (batch, rows, values), a single image gives (rows, values)
+            output = [out.reshape(len(tiles), -1, out.shape[-1]) for out in output]
+            boxes = []
+            confidences = []
+            cut = []
+            for index, (x, y, w, h) in enumerate(tiles):
+                tile_boxes, tile_confidences, _, _ = decode_detections([out[index] for out in output], w, h, net.confidence_threshold, net.nms_threshold)
+                # A box touching a side of its tile that lies inside the frame was cut by the seam
+                edges = (tile_boxes[:, 0] <= 1) & (x > 0)
+                edges |= (tile_boxes[:, 1] <= 1) & (y > 0)
+                edges |= (tile_boxes[:, 2] >= w - 1) & (x + w < width)
+                edges |= (tile_boxes[:, 3] >= h - 1) & (y + h < height)
+                boxes.append(tile_boxes + np.array([x, y, x, y], dtype=np.int32))
+                confidences.append(tile_confidences)
+                cut.append(edges)
+
+            boxes = np.concatenate(boxes)
+            if len(boxes) == 0:
+                return empty_detections()
+            confidences = np.concatenate(confidences)
+            start = time.perf_counter()
+            keep = merge_detections(boxes, confidences, np.concatenate(cut), net.nms_threshold, self.containment)
+            if net.metrics.enabled:
+                net.metrics.record("nms", time.perf_counter() - start)
+
+            boxes = boxes[keep]
+            areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+            return boxes, confidences[keep], bin_positions((boxes[:, 0] + boxes[:, 2]) / 2, width), areas.astype(np.int32)
+
+    def detect(self, image):
+        """
+        Detect the humans on an image tile by tile, returning a read-only DETECTION_DTYPE array like DarknetDNN.detect.
+        """
+        height, width = image.shape[:2]
+        blob, tiles = self.preprocess(image)
+        with self.net.metrics.timer("forward"):
+            output = self.net.forward_blob(blob)
+        return to_structured(*self.decode(output, tiles, width, height))
+
+    def warmup(self, frame_shape = (480, 640, 3), count = 2):
+        # Run the batch of a blank frame, the batch size depends on the frame size
+        start = time.perf_counter()
+        metrics, self.net.metrics = self.net.metrics, DISABLED_METRICS
+        try:
+            frame = np.zeros(frame_shape, dtype=np.uint8)
+            for _ in range(count):
+                blob, _ = self.preprocess(frame)
+                self.net.forward_blob(blob)
+        finally:
+            self.net.metrics = metrics
+        return time.perf_counter() - start
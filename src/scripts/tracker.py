@@ -0,0 +1,197 @@
+import numpy as np
+
+try:
+    from scripts.yolo_decoder import bin_positions, empty_detections, from_structured, to_structured
+except ImportError:
+    from yolo_decoder import bin_positions, empty_detections, from_structured, to_structured
+
+def iou_matrix(boxes_a, boxes_b):
+    # Intersection over union of every [x1, y1, x2, y2] box of boxes_a against every box of boxes_b
+    boxes_a = np.asarray(boxes_a, dtype=np.float32)[:, None, :]
+    boxes_b = np.asarray(boxes_b, dtype=np.float32)[None, :, :]
+    w = np.clip(np.minimum(boxes_a[..., 2], boxes_b[..., 2]) - np.maximum(boxes_a[..., 0], boxes_b[..., 0]), 0, None)
+    h = np.clip(np.minimum(boxes_a[..., 3], boxes_b[..., 3]) - np.maximum(boxes_a[..., 1], boxes_b[..., 1]), 0, None)
+    intersection = w * h
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    return intersection / np.maximum(area_a + area_b - intersection, 1e-6)
+
+def associate(iou, iou_threshold):
+    # Greedy matching on the highest IoU first, close to the Hungarian assignment for the few people in a frame
+    matches = []
+    if iou.size == 0:
+        return matches
+    order = np.dstack(np.unravel_index(np.argsort(-iou, axis=None), iou.shape))[0]
+    used_rows = set()
+    used_cols = set()
+    for row, col in order:
+        if iou[row, col] < iou_threshold:
+            break
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matches.append((row, col))
+    return matches
+
+class KalmanBoxTrack:
+    """
+    Constant velocity Kalman filter of one box, with the SORT state [cx, cy, area, aspect ratio, vx, vy, v_area].
+    """
+    F = np.eye(7)
+    F[0, 4] = F[1, 5] = F[2, 6] = 1
+    H = np.eye(4, 7)
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+
+    def __init__(self, track_id, box, confidence):
+        self.id = track_id
+        self.x = np.zeros(7)
+        self.x[:4] = self.to_measurement(box)
+        self.P = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+        self.confidence = float(confidence)
+        self.hits = 1
+        self.time_since_update = 0
+        # Detector runs in a row without a matching detection
+        self.misses = 0
+
+    @staticmethod
+    def to_measurement(box):
+        x1, y1, x2, y2 = box
+        w = max(x2 - x1, 1)
+        h = max(y2 - y1, 1)
+        return np.array([x1 + w/2, y1 + h/2, w * h, w / h])
+
+    def predict(self):
+        # Do not let the area become negative
+        if self.x[2] + self.x[6] <= 0:
+            self.x[6] = 0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        self.time_since_update += 1
+
+    def update(self, box, confidence):
+        y = self.to_measurement(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        self.P = (np.eye(7) - K @ self.H) @ self.P
+        self.confidence = float(confidence)
+        self.hits += 1
+        self.time_since_update = 0
+
+    def box(self):
+        cx, cy, area, ratio = self.x[:4]
+        w = np.sqrt(max(area * ratio, 1.0))
+        h = max(area, 1.0) / w
+        return [cx - w/2, cy - h/2, cx + w/2, cy + h/2]
+
+class SortTracker:
+    """
+    Multi-person tracker in the style of SORT: IoU association of the detections with constant velocity Kalman tracks.
+
+    step() is called once per frame, with the detections of that frame or without them when the detector was skipped,
+    in which case the tracks are only propagated. The confidence of a track decays by confidence_decay on every frame
+    without a matching detection, and tracks unmatched for more than max_age frames are removed.
+
+    Only the tracks matched by the last detector run are reported, as SORT does: on a detection frame the tracks matched
+    in that frame, on the skipped frames in between those tracks coasting. A track the detector missed is kept for
+    max_age frames so the person gets the same id back, but it is not reported, so nobody is followed after they left.
+    """
+    def __init__(self, iou_threshold = 0.3, max_age = 10, confidence_decay = 0.9):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.confidence_decay = confidence_decay
+        self.tracks = []
+        self.next_id = 1
+
+    def step(self, boxes = None, confidences = None):
+        for track in self.tracks:
+            track.predict()
+
+        if boxes is not None:
+            predicted = [track.box() for track in self.tracks]
+            matches = associate(iou_matrix(predicted, boxes), self.iou_threshold) if len(predicted) and len(boxes) else []
+            matched = set()
+            for row, col in matches:
+                self.tracks[row].update(boxes[col], confidences[col])
+                matched.add(col)
+            for track in self.tracks:
+                track.misses = 0 if track.time_since_update == 0 else track.misses + 1
+            for col in range(len(boxes)):
+                if col not in matched:
+                    self.tracks.append(KalmanBoxTrack(self.next_id, boxes[col], confidences[col]))
+                    self.next_id += 1
+
+        self.tracks = [track for track in self.tracks if track.time_since_update <= self.max_age]
+
+    def track_confidence(self, track):
+        return track.confidence * self.confidence_decay ** track.time_since_update
+
+    def reported(self):
+        return [track for track in self.tracks if track.misses == 0]
+
+    def min_confidence(self):
+        return min((self.track_confidence(track) for track in self.reported()), default=0.0)
+
+    def result(self, width, height):
+        """
+        Return (boxes, confidences, positions, areas, ids) of the reported tracks, in the layout of decode_detections.
+        """
+        tracks = self.reported()
+        if not tracks:
+            return empty_detections() + (np.empty(0, dtype=np.int32),)
+
+        boxes = np.array([track.box() for track in tracks])
+        boxes = np.trunc(boxes).astype(np.int32)
+        np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+        np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+        confidences = np.array([self.track_confidence(track) for track in tracks], dtype=np.float32)
+        areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+        positions = bin_positions((boxes[:, 0] + boxes[:, 2]) / 2, width)
+        ids = np.array([track.id for track in tracks], dtype=np.int32)
+        return boxes, confidences, positions, areas, ids
+
+class TrackedDetector:
+    """
+    Run the detector of a DarknetDNN only every detect_interval frames, or sooner when a track confidence drops below
+    redetect_confidence, and propagate the tracked boxes with SortTracker in between.
+
+    detect returns the tracked targets as the same read-only DETECTION_DTYPE array as DarknetDNN.detect, so get_command,
+    hunt and the drawing work on them unchanged.
+    """
+    def __init__(self, net, detect_interval = 3, redetect_confidence = 0.3, iou_threshold = 0.3, max_age = None):
+        self.net = net
+        self.detect_interval = max(int(detect_interval), 1)
+        self.redetect_confidence = redetect_confidence
+        self.tracker = SortTracker(iou_threshold, max_age if max_age is not None else 2 * self.detect_interval + 2)
+        self.frame_count = 0
+        self.detections_run = 0
+        self.ids = np.empty(0, dtype=np.int32)
+
+    def should_detect(self):
+        # Called once per frame before the inference is started
+        detect = self.frame_count % self.detect_interval == 0 or not self.tracker.reported() or self.tracker.min_confidence() < self.redetect_confidence
+        self.frame_count += 1
+        if detect:
+            self.detections_run += 1
+        return detect
+
+    def track(self, detections, width, height):
+        """
+        Advance the tracker by one frame with the decoded detections of the frame, or None when the detector was skipped.
+        """
+        if detections is None:
+            self.tracker.step()
+        else:
+            boxes, confidences, positions, areas = detections
+            self.tracker.step(boxes, confidences)
+        boxes, confidences, positions, areas, self.ids = self.tracker.result(width, height)
+        return boxes, confidences, positions, areas
+
+    def detect(self, image):
+        height, width, channels = image.shape
+        detections = None
+        if self.should_detect():
+            detections = from_structured(self.net.detect(image))
+        return to_structured(*self.track(detections, width, height))
@@ -0,0 +1,149 @@
+import time
+import cv2
+import numpy as np
+
+# Horizontal bins used for the Left/Center/Right command, indexed by the position code
+POSITIONS = ('Left', 'Center', 'Right')
+POSITION_LEFT = 0
+POSITION_CENTER = 1
+POSITION_RIGHT = 2
+
+# One row per detected person, the result of DarknetDNN.detect: box is [x1, y1, x2, y2] clamped to the frame, position an
+# index into POSITIONS and area the box area in pixels
+DETECTION_DTYPE = np.dtype([("box", np.int32, (4,)), ("confidence", np.float32), ("position", np.int8), ("area", np.int32)])
+
+class DetectionBuffers:
+    """
+    Preallocated result arrays for decode_detections, holding at most max_detections boxes.
+
+    `count` sets of arrays are handed out in turn so the results of the previous frames stay valid while the pipeline
+    still uses them.
+    """
+    def __init__(self, max_detections = 64, count = 3):
+        self.max_detections = max_detections
+        self.sets = [(np.empty((max_detections, 4), dtype=np.int32), np.empty(max_detections, dtype=np.float32),
+                      np.empty(max_detections, dtype=np.int8), np.empty(max_detections, dtype=np.int32)) for _ in range(count)]
+        self.index = 0
+
+    def next(self):
+        self.index = (self.index + 1) % len(self.sets)
+        return self.sets[self.index]
+
+def decode_detections(outputs, width, height, confidence_threshold = 0.3, nms_threshold = 0.4, class_id = 0, out = None, metrics = None):
+    """
+    Decode the raw YOLO output layers of a frame into boxes with NumPy, without looping over the rows.
+
+    Every row of an output layer is [cx, cy, w, h, objectness, class scores ...] normalized to the input size.
+    The class scores from OpenCV are already multiplied by the objectness, so rows with a low objectness are dropped before
+    the argmax is computed. Only the rows where `class_id` is the best class are kept.
+
+    Returns (boxes, confidences, positions, areas) after Non-Maximum Suppression:
+    boxes is an int32 (N, 4) array of [x1, y1, x2, y2] clamped to the frame, confidences is float32 (N,),
+    positions is an int8 (N,) array of indexes into POSITIONS and areas is an int32 (N,) array of the clamped box areas.
+    With out set to DetectionBuffers, the results are views into its next set of arrays, keeping the most confident
+    max_detections boxes. With metrics set to StageMetrics, the Non-Maximum Suppression time is recorded as "nms".
+    """
+    # Objectness is an upper bound of every class score, so it is a cheap prefilter applied before joining the layers
+    detections = [out[out[:, 4] > confidence_threshold] for out in outputs]
+    detections = detections[0] if len(detections) == 1 else np.concatenate(detections, axis=0)
+
+    # Keep the rows where the wanted class has the largest score, the same way np.argmax picks the first maximum
+    scores = detections[:, 5:]
+    confidences = scores[:, class_id]
+    best = scores.max(axis=1)
+    keep = (confidences > confidence_threshold) & (confidences >= best)
+    if class_id > 0:
+        keep &= confidences > scores[:, :class_id].max(axis=1)
+    detections = detections[keep]
+    confidences = confidences[keep]
+
+    if len(detections) == 0:
+        return empty_detections()
+
+    # Convert the normalized center format into pixel corners, truncating like int() does
+    cx = np.trunc(detections[:, 0] * width)
+    cy = np.trunc(detections[:, 1] * height)
+    w = np.trunc(detections[:, 2] * width)
+    h = np.trunc(detections[:, 3] * height)
+
+    boxes = np.empty((len(detections), 4), dtype=np.int32)
+    boxes[:, 0] = np.trunc(cx - w/2)
+    boxes[:, 1] = np.trunc(cy - h/2)
+    boxes[:, 2] = np.trunc(cx + w/2)
+    boxes[:, 3] = np.trunc(cy + h/2)
+
+    # Clamp the boxes so they can be used directly as slices of the frame
+    np.clip(boxes[:, 0::2], 0, width, out=boxes[:, 0::2])
+    np.clip(boxes[:, 1::2], 0, height, out=boxes[:, 1::2])
+
+    # Perform Non-Maximum Suppression, NMSBoxes expects [x, y, w, h]
+    rects = boxes.copy()
+    rects[:, 2:] -= rects[:, :2]
+    start = time.perf_counter()
+    indexes = cv2.dnn.NMSBoxes(rects, confidences, confidence_threshold, nms_threshold)
+    if metrics is not None:
+        metrics.record("nms", time.perf_counter() - start)
+    indexes = np.asarray(indexes, dtype=np.int64).reshape(-1)
+
+    if out is None:
+        boxes = boxes[indexes]
+        confidences = confidences[indexes].astype(np.float32, copy=False)
+        areas = rects[indexes, 2] * rects[indexes, 3]
+        return boxes, confidences, bin_positions(cx[indexes], width), areas
+
+    # NMSBoxes sorts by score, so the cut keeps the most confident boxes
+    indexes = indexes[:out.max_detections]
+    count = len(indexes)
+    out_boxes, out_confidences, out_positions, out_areas = (array[:count] for array in out.next())
+    np.take(boxes, indexes, axis=0, out=out_boxes)
+    np.take(confidences, indexes, out=out_confidences)
+    np.multiply(rects[indexes, 2], rects[indexes, 3], out=out_areas)
+    bin_positions(cx[indexes], width, out_positions)
+    return out_boxes, out_confidences, out_positions, out_areas
+
+def bin_positions(cx, width, out = None):
+    # Bin the center of every box into Left, Center or Right
+    positions = np.empty(len(cx), dtype=np.int8) if out is None else out
+    positions.fill(POSITION_CENTER)
+    positions[cx >= 2 * width/3] = POSITION_RIGHT
+    positions[cx <= width/3] = POSITION_LEFT
+    return positions
+
+def to_structured(boxes, confidences, positions, areas):
+    """
+    Pack the (boxes, confidences, positions, areas) arrays of decode_detections into one read-only DETECTION_DTYPE array.
+
+    The result is a copy, so it stays valid after the detection buffers are recycled and can be shared between threads.
+    """
+    detections = np.empty(len(boxes), dtype=DETECTION_DTYPE)
+    detections["box"] = boxes
+    detections["confidence"] = confidences
+    detections["position"] = positions
+    detections["area"] = areas
+    detections.flags.writeable = False
+    return detections
+
+def from_structured(detections):
+    # The (boxes, confidences, positions, areas) views of a DETECTION_DTYPE array
+    return detections["box"], detections["confidence"], detections["position"], detections["area"]
+
+def detection_rows(detections):
+    # Plain Python (x1, y1, x2, y2, confidence, position name, area) tuples, e.g. for the PersonDetection messages
+    return [(*box, confidence, POSITIONS[position], area) for box, confidence, position, area in
+            zip(detections["box"].tolist(), detections["confidence"].tolist(), detections["position"].tolist(), detections["area"].tolist())]
+
+def command_for(detections):
+    return select_command(detections["position"], detections["area"])
+
+def select_command(positions, areas):
+    # The command follows the largest person, Hold when nobody is detected
+    if len(areas) == 0:
+        return 'Hold'
+    return POSITIONS[positions[int(np.argmax(areas))]]
+
+def empty_detections():
+    return (np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32),
+            np.empty(0, dtype=np.int8), np.empty(0, dtype=np.int32))
+
+def position_names(positions):
+    return [POSITIONS[p] for p in positions]
@@ -0,0 +1,90 @@
+import os
+import sys
+import time
+import threading
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from scripts.device_camera import Frame
+from scripts.frame_recording import FrameRecorder
+from scripts.pipeline import Job, Pipeline
+from scripts.replay_camera import ReplayCamera
+
+FRAMES = 300
+
+class PipelineTest(unittest.TestCase):
+    def test_stop_condition_without_frames(self):
+        # The source never delivers a frame, so only the timed waits of the stages can notice the stop condition
+        shutdown = threading.Event()
+        pipeline = Pipeline([("source", lambda: time.sleep(0.01)), ("output", lambda job: job)], stop_condition=shutdown.is_set)
+        runner = threading.Thread(target=pipeline.run, daemon=True)
+        runner.start()
+        time.sleep(0.2)
+        self.assertTrue(runner.is_alive())
+        shutdown.set()
+        runner.join(timeout=2.0)
+        self.assertFalse(runner.is_alive())
+
+    def test_stop_condition_while_frames_flow(self):
+        shutdown = threading.Event()
+        processed = []
+        def output(job):
+            processed.append(job.sequence)
+            return job
+        pipeline = Pipeline([("source", lambda: Job(len(processed))), ("output", output)], stop_condition=shutdown.is_set)
+        runner = threading.Thread(target=pipeline.run, daemon=True)
+        runner.start()
+        time.sleep(0.2)
+        shutdown.set()
+        runner.join(timeout=2.0)
+        self.assertFalse(runner.is_alive())
+        self.assertTrue(processed)
+
+class LosslessReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        recorder = FrameRecorder(self.path, chunk_size=64)
+        for number in range(FRAMES):
+            recorder.write(Frame(np.full((8, 8, 3), number % 256, dtype=np.uint8), None, 1000.0 + number / 30, number + 1))
+        recorder.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def run_replay(self, inline):
+        # The stages are slower than the disk, like the detector on a replay, so a lossy pipeline would drop frames
+        camera = ReplayCamera(self.path, realtime=False)
+        outputs = []
+        def capture():
+            if camera.finished:
+                pipeline.finish()
+                return None
+            frame = camera.get_frame_stamped()
+            return Job(frame.sequence, frame.timestamp) if frame.color is not None else None
+        def slow(job):
+            time.sleep(0.001)
+            return job
+        def output(job):
+            outputs.append(job.sequence)
+            return job
+        pipeline = Pipeline([("capture", capture), ("preprocess", slow), ("inference", slow), ("output", output)],
+                            max_age=0.0001, lossless=True)
+        runner = threading.Thread(target=pipeline.run_inline if inline else pipeline.run, daemon=True)
+        runner.start()
+        runner.join(timeout=30.0)
+        camera.stop()
+        self.assertFalse(runner.is_alive())
+        return outputs
+
+    def test_every_frame_once_through_run(self):
+        self.assertEqual(self.run_replay(inline=False), list(range(1, FRAMES + 1)))
+
+    def test_every_frame_once_inline(self):
+        self.assertEqual(self.run_replay(inline=True), list(range(1, FRAMES + 1)))
+
+if __name__ == "__main__":
+    unittest.main()
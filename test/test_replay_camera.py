@@ -0,0 +1,102 @@
+import os
+import sys
+import time
+import shutil
+import tempfile
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from scripts.depth_lookup import DepthProjector, Intrinsics
+from scripts.device_camera import Frame
+from scripts.frame_recording import FrameRecorder
+from scripts.replay_camera import ReplayCamera
+
+FRAMES = 50
+
+class ReplayCameraTest(unittest.TestCase):
+    def setUp(self):
+        # Every frame is filled with its number, so the replayed frames can be told apart
+        self.path = tempfile.mkdtemp()
+        recorder = FrameRecorder(self.path, chunk_size=16)
+        for number in range(FRAMES):
+            recorder.write(Frame(np.full((48, 64, 3), number, dtype=np.uint8), None, 1000.0 + number / 30, number + 1))
+        recorder.close()
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def replay(self, **kwargs):
+        camera = ReplayCamera(self.path, **kwargs)
+        delivered = []
+        try:
+            # Bounded, a replay repeating its last frame must fail instead of hanging
+            for _ in range(2 * FRAMES):
+                frame = camera.get_frame_stamped(timeout=0.1)
+                if frame.color is None or (camera.finished and camera.threaded):
+                    break
+                delivered.append(int(frame.color[0, 0, 0]))
+        finally:
+            camera.stop()
+        return camera, delivered
+
+    def test_every_frame_once_when_not_realtime(self):
+        camera, delivered = self.replay(realtime=False, threaded=True)
+        self.assertFalse(camera.threaded)
+        self.assertTrue(camera.finished)
+        self.assertEqual(delivered, list(range(FRAMES)))
+        self.assertEqual(camera.dropped_frames, 0)
+
+    def test_threaded_never_repeats_a_frame(self):
+        camera = ReplayCamera(self.path, realtime=True, threaded=True)
+        sequences = []
+        try:
+            # Polled faster than the recorded 30 Hz, so most calls find no newer frame
+            deadline = time.time() + 10.0
+            while not camera.finished and time.time() < deadline:
+                frame = camera.get_frame_stamped(timeout=0.005)
+                if frame.color is not None:
+                    sequences.append(frame.sequence)
+            frame = camera.get_frame_stamped(timeout=0.05)
+        finally:
+            camera.stop()
+        self.assertTrue(camera.finished)
+        self.assertIsNone(frame.color)
+        self.assertTrue(sequences)
+        self.assertEqual(sequences, sorted(set(sequences)))
+
+    def test_same_frames_every_run(self):
+        self.assertEqual(self.replay(realtime=False)[1], self.replay(realtime=False)[1])
+
+class ReplayDepthTest(unittest.TestCase):
+    def setUp(self):
+        self.path = tempfile.mkdtemp()
+        # Raw depth at half the color resolution, shifted 5 cm from the color camera, the person 2 m away
+        self.projector = DepthProjector(Intrinsics(32, 24, 30.0, 30.0, 16.0, 12.0), Intrinsics(64, 48, 60.0, 60.0, 32.0, 24.0),
+                                        (np.eye(3), [0.05, 0.0, 0.0]))
+        self.depth = np.full((24, 32), 2000, dtype=np.uint16)
+        self.boxes = [[16, 12, 48, 40]]
+
+    def tearDown(self):
+        shutil.rmtree(self.path)
+
+    def record(self, depth_geometry):
+        recorder = FrameRecorder(self.path, depth_geometry=depth_geometry)
+        recorder.write(Frame(np.zeros((48, 64, 3), dtype=np.uint8), self.depth, 1000.0, 1))
+        recorder.close()
+        return ReplayCamera(self.path, realtime=False)
+
+    def test_raw_depth_uses_the_recorded_projector(self):
+        camera = self.record(dict(self.projector.to_meta(), align_depth=False))
+        frame = camera.get_frame_stamped()
+        camera.stop()
+        self.assertFalse(camera.align_depth)
+        self.assertEqual(camera.box_distances(frame.depth, self.boxes), self.projector.box_distances(self.depth, self.boxes))
+
+    def test_depth_without_geometry_fails(self):
+        with self.assertRaises(RuntimeError):
+            self.record(None)
+
+if __name__ == "__main__":
+    unittest.main()
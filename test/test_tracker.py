@@ -0,0 +1,62 @@
+import os
+import sys
+import unittest
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+from scripts.tracker import SortTracker, TrackedDetector
+from scripts.yolo_decoder import empty_detections
+
+WIDTH, HEIGHT = 640, 480
+
+def person(x):
+    boxes = np.array([[x, 100, x + 80, 400]], dtype=np.int32)
+    return boxes, np.array([0.9], dtype=np.float32), np.array([1], dtype=np.int8), np.array([80 * 300], dtype=np.int32)
+
+class TrackedDetectorTest(unittest.TestCase):
+    def run_frames(self, tracked, present):
+        # present(frame) tells whether the person is in the frame, the detector sees exactly that when it runs
+        results = []
+        for frame, visible in enumerate(present):
+            detections = None
+            if tracked.should_detect():
+                detections = person(200 + 4 * frame) if visible else empty_detections()
+            results.append((detections is not None, tracked.track(detections, WIDTH, HEIGHT)))
+        return results
+
+    def test_coasts_between_detections(self):
+        tracked = TrackedDetector(None, detect_interval=3)
+        results = self.run_frames(tracked, [True] * 9)
+        self.assertEqual([ran for ran, _ in results], [True, False, False] * 3)
+        for _, (boxes, confidences, positions, areas) in results:
+            self.assertEqual(len(boxes), 1)
+        self.assertEqual(len(set(tracked.ids.tolist())), 1)
+
+    def test_person_leaving_is_dropped_on_the_next_detection(self):
+        tracked = TrackedDetector(None, detect_interval=3)
+        results = self.run_frames(tracked, [True] * 6 + [False] * 12)
+        # The detector runs on frame 6 and no longer sees anybody, nothing may be reported from then on
+        self.assertTrue(results[6][0])
+        for ran, (boxes, confidences, positions, areas) in results[6:]:
+            self.assertEqual(len(boxes), 0)
+            self.assertEqual(len(areas), 0)
+
+    def test_detector_runs_every_frame_after_loss(self):
+        tracked = TrackedDetector(None, detect_interval=3)
+        results = self.run_frames(tracked, [True] * 3 + [False] * 6)
+        # Without a reported track the detector is not skipped
+        self.assertTrue(all(ran for ran, _ in results[3:]))
+
+    def test_missed_track_keeps_its_id(self):
+        tracker = SortTracker(max_age=5)
+        boxes, confidences, _, _ = person(200)
+        tracker.step(boxes, confidences)
+        first_id = tracker.result(WIDTH, HEIGHT)[4].tolist()
+        tracker.step(np.empty((0, 4), dtype=np.int32), np.empty(0, dtype=np.float32))
+        self.assertEqual(len(tracker.result(WIDTH, HEIGHT)[0]), 0)
+        tracker.step(boxes, confidences)
+        self.assertEqual(tracker.result(WIDTH, HEIGHT)[4].tolist(), first_id)
+
+if __name__ == "__main__":
+    unittest.main()